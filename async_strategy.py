@@ -0,0 +1,362 @@
+"""Асинхронное ядро стратегии торговли по спреду обычка/преф.
+
+Стаканы обеих ног запрашиваются одновременно, портфель обновляется параллельно с ценами,
+а перекладка идет отдельной задачей и не останавливает обработку котировок. Решение, как и в
+spread_strategy.py, принимается по исполнимому спреду, а заявки отслеживаются до исполнения
+через AsyncOrderManager.
+Запуск: python async_strategy.py
+"""
+
+import asyncio, datetime, time
+from typing import Optional
+
+from tinkoff.invest import (
+    AsyncClient,
+    LastPriceInstrument,
+    OrderBookInstrument,
+    OrderDirection
+)
+
+import spread_strategy as strategy
+from metrics import METRICS
+from order_manager import AsyncOrderManager
+from resilience import Resilience
+from trading_calendar import (
+    WARMUP,
+    TradingCalendar,
+    calendar_after_error,
+    create_trading_calendar,
+    fallback_sessions,
+    now_utc,
+    schedule_range,
+)
+from spread_strategy import (
+    HOLD,
+    BUY_OB,
+    BUY_PREF,
+    SWITCH_TO_OB,
+    SWITCH_TO_PREF,
+    BOOK_DEPTH,
+    MAX_TICK_AGE,
+    SpreadPair,
+    book_levels,
+    book_limit_price,
+    decide,
+    decide_executable,
+    is_connection_error
+)
+
+POLL_INTERVAL = 30                                      # Период опроса, если поток недоступен, сек
+PORTFOLIO_INTERVAL = 30                                 # Период фонового обновления портфеля, сек
+
+def quotation_to_float(quotation) -> float:
+    return quotation.units + quotation.nano * 1e-9
+
+# Асинхронный аналог ClientSession: один канал AsyncClient на все запросы
+class AsyncClientSession:
+
+    def __init__(self, TOKEN, client_factory=AsyncClient, resilience: Optional[Resilience] = None):
+        self.TOKEN = TOKEN
+        self.client_factory = client_factory
+        self.resilience = resilience or Resilience()
+        self._manager = None
+        self._client = None
+        self.lock = asyncio.Lock()                          # Запросы из gather не открывают канал одновременно
+
+    async def get_client(self):
+        if self._client is not None:
+            return self._client
+        async with self.lock:
+            if self._client is None:
+                manager = self.client_factory(self.TOKEN)
+                self._client = await manager.__aenter__()
+                self._manager = manager
+        return self._client
+
+    async def close(self):
+        async with self.lock:
+            manager, self._manager, self._client = self._manager, None, None
+        if manager is not None:
+            try:
+                await manager.__aexit__(None, None, None)
+            except Exception:
+                pass                                        # Канал уже разорван, закрывать нечего
+
+    async def handle_error(self, e: Exception):
+        if is_connection_error(e):
+            await self.close()
+
+    # Запрос с повторами, ограничением частоты и предохранителем: fn получает клиента и возвращает корутину
+    async def call(self, method: str, fn):
+        with METRICS.timer('api_call_seconds', method=method):
+            return await self._call(method, fn)
+
+    async def _call(self, method: str, fn):
+        for attempt in range(self.resilience.max_attempts):
+            wait = self.resilience.before_call(method)
+            if wait:
+                await asyncio.sleep(wait)
+            try:
+                result = await fn(await self.get_client())
+            except Exception as e:
+                print(f"Ошибка запроса {method}: {e}")
+                await self.handle_error(e)
+                await asyncio.sleep(self.resilience.after_failure(method, e, attempt))
+                continue
+            self.resilience.breaker(method).success()
+            return result
+
+class AsyncSpreadStrategy:
+
+    def __init__(self, session: AsyncClientSession, Account_id, catalog, figi_Ob, figi_Pref, price_1, price_2,
+                 calendar: Optional[TradingCalendar] = None):
+        self.session = session
+        self.calendar = calendar or TradingCalendar(fallback_sessions())
+        self.Account_id = Account_id
+        self.figi_Ob = figi_Ob
+        self.figi_Pref = figi_Pref
+        self.info_Ob = strategy.get_instrument_info(catalog, FIGI=figi_Ob)
+        self.info_Pref = strategy.get_instrument_info(catalog, FIGI=figi_Pref)
+        self.price_1 = price_1
+        self.price_2 = price_2
+        self.pair = SpreadPair(self.info_Ob, self.info_Pref, price_1, price_2)
+        self.lot_sizes = {figi_Ob: self.info_Ob['lot_size'], figi_Pref: self.info_Pref['lot_size']}
+        self.orders = AsyncOrderManager(session, Account_id)
+
+        self.prices = {}                                    # figi -> последняя цена
+        self.books = {}                                     # figi -> (bids, asks)
+        self.KObich = 0
+        self.KPrefa = 0
+        self.Money = 0
+        self.rebalance_task: Optional[asyncio.Task] = None
+
+    # Стаканы обеих ног запрашиваем одновременно, чтобы в спреде не было перекоса по времени
+    async def fetch_prices(self):
+
+        book_Ob, book_Pref = await asyncio.gather(
+            self.session.call('get_order_book', lambda client: client.market_data.get_order_book(figi=self.figi_Ob, depth=BOOK_DEPTH)),
+            self.session.call('get_order_book', lambda client: client.market_data.get_order_book(figi=self.figi_Pref, depth=BOOK_DEPTH))
+        )
+        for figi, book in ((self.figi_Ob, book_Ob), (self.figi_Pref, book_Pref)):
+            self.prices[figi] = quotation_to_float(book.last_price)
+            self.books[figi] = (book_levels(book.bids, self.lot_sizes[figi]), book_levels(book.asks, self.lot_sizes[figi]))
+
+    async def fetch_portfolio(self):
+
+        PositionResponse = await self.session.call('get_positions', lambda client: client.operations.get_positions(account_id=self.Account_id))
+
+        self.Money = int(PositionResponse.money[0].units) if PositionResponse.money else 0
+        self.KObich = 0
+        self.KPrefa = 0
+        for security in PositionResponse.securities:
+            if security.figi == self.figi_Ob:
+                self.KObich = security.balance
+            elif security.figi == self.figi_Pref:
+                self.KPrefa = security.balance
+
+    # Цены и портфель обновляются одновременно
+    async def refresh(self):
+        await asyncio.gather(self.fetch_prices(), self.fetch_portfolio())
+
+    def spread(self):
+        LastPrice_Ob = self.prices[self.figi_Ob]
+        LastPrice_Pref = self.prices[self.figi_Pref]
+        return round(LastPrice_Ob - LastPrice_Pref, 2), LastPrice_Ob, LastPrice_Pref
+
+    # Решение по исполнимым спредам обеих сторон, как в SpreadEngine.decision; без стаканов - по последним ценам
+    def decision(self, spread):
+        if not strategy.EXECUTABLE_SPREAD or self.figi_Ob not in self.books or self.figi_Pref not in self.books:
+            return decide(spread, self.price_1, self.price_2, self.KObich, self.KPrefa)
+        budget = self.Money + self.KObich * self.prices[self.figi_Ob] + self.KPrefa * self.prices[self.figi_Pref]
+        (to_Ob, _), (to_Pref, _) = self.pair.executable_spreads(self.books, self.prices, self.KObich, self.KPrefa, budget)
+        return decide_executable(to_Ob, to_Pref, self.price_1, self.price_2, self.KObich, self.KPrefa)
+
+    # Обработка нового спреда: быстрая и неблокирующая, сделки уходят в отдельную задачу
+    def on_spread(self, spread, LastPrice_Ob, LastPrice_Pref):
+
+        if self.rebalance_task is not None and not self.rebalance_task.done():
+            return                                          # Перекладка уже идет
+
+        action = self.decision(spread)
+        if action == HOLD:
+            return
+
+        print('Текущий спред', spread, 'Цена обычки =', LastPrice_Ob, 'Цена префов =', LastPrice_Pref, 'Дата:', datetime.datetime.now())
+        self.rebalance_task = asyncio.create_task(self.rebalance(action))
+
+    # Лимитная цена по текущему стакану, как SpreadEngine.limit_price; None - заявка по лучшей цене
+    def limit_price(self, figi, quantity, buy: bool):
+        if figi not in self.books:
+            return None
+        bids, asks = self.books[figi]
+        return book_limit_price(asks if buy else bids, quantity)
+
+    # Заявка ждет итогового статуса, котировки при этом обрабатываются
+    async def post_order(self, figi, lots, direction):
+        lot_size = self.lot_sizes[figi]
+        buy = direction == OrderDirection.ORDER_DIRECTION_BUY
+        return await self.orders.execute(figi, lots, direction, lot_size, self.limit_price(figi, int(lots) * lot_size, buy))
+
+    async def buy_on_all_money(self, figi, info):
+        await self.refresh()
+        lot_size = info.get('lot_size', 'Информация о лотности не найдена')
+        KolVo = int(self.Money/self.prices[figi]/lot_size*0.98)
+        print(f'Денег {self.Money}, можем купить {KolVo} лотов по цене {self.prices[figi]}')
+        return await self.post_order(figi, KolVo, OrderDirection.ORDER_DIRECTION_BUY)
+
+    # Продаем всю позицию по одной ноге и, если продажа исполнилась, покупаем другую
+    async def switch_legs(self, figi_sell, KolVo_sell, figi_buy, info_buy):
+        sell = await self.post_order(figi_sell, KolVo_sell // self.lot_sizes[figi_sell], OrderDirection.ORDER_DIRECTION_SELL)
+        if not sell.lots_executed:
+            print('Продажа не исполнилась, перекладку не продолжаем')
+            return
+        await self.buy_on_all_money(figi_buy, info_buy)
+
+    async def rebalance(self, action):
+
+        try:
+            if action == SWITCH_TO_OB:
+                print('У нас в портфеле префа', self.KPrefa, 'шт. нужно их продать и купить обычку')
+                await self.switch_legs(self.figi_Pref, self.KPrefa, self.figi_Ob, self.info_Ob)
+            elif action == SWITCH_TO_PREF:
+                print('У нас в портфеле обычка', self.KObich, 'шт. нужно ее продать и купить префа')
+                await self.switch_legs(self.figi_Ob, self.KObich, self.figi_Pref, self.info_Pref)
+            elif action == BUY_OB:
+                await self.buy_on_all_money(self.figi_Ob, self.info_Ob)
+            elif action == BUY_PREF:
+                await self.buy_on_all_money(self.figi_Pref, self.info_Pref)
+        finally:
+            await self.fetch_portfolio()
+            print("---------------------------------------------")
+
+    # Портфель обновляется в фоне и не задерживает обработку котировок
+    async def portfolio_loop(self):
+        while True:
+            await asyncio.sleep(PORTFOLIO_INTERVAL)
+            await self.fetch_portfolio()
+
+    # until - конец торговой сессии: в этот момент поток останавливается
+    async def run_streaming(self, until: Optional[datetime.datetime] = None):
+
+        client = await self.session.get_client()
+        stream = client.create_market_data_stream()
+        stream.last_price.subscribe([LastPriceInstrument(figi=self.figi_Ob), LastPriceInstrument(figi=self.figi_Pref)])
+        if strategy.EXECUTABLE_SPREAD:
+            stream.order_book.subscribe([OrderBookInstrument(figi=figi, depth=BOOK_DEPTH) for figi in (self.figi_Ob, self.figi_Pref)])
+        closer = None
+        if until is not None:
+            closer = asyncio.get_running_loop().call_later(max(0.0, (until - now_utc()).total_seconds()), stream.stop)
+
+        try:
+            async for marketdata in stream:
+                last_price = getattr(marketdata, 'last_price', None)
+                orderbook = getattr(marketdata, 'orderbook', None)
+                if last_price is not None and last_price.figi in self.lot_sizes:
+                    self.prices[last_price.figi] = quotation_to_float(last_price.price)
+                    tick_time = last_price.time
+                elif orderbook is not None and orderbook.figi in self.lot_sizes:
+                    lot_size = self.lot_sizes[orderbook.figi]
+                    self.books[orderbook.figi] = (book_levels(orderbook.bids, lot_size), book_levels(orderbook.asks, lot_size))
+                    tick_time = orderbook.time
+                else:
+                    continue
+                if tick_time and datetime.datetime.now(datetime.timezone.utc) - tick_time > MAX_TICK_AGE:
+                    continue
+                self.on_spread(*self.spread())
+        except Exception as e:
+            await self.session.handle_error(e)
+            raise
+        finally:
+            if closer is not None:
+                closer.cancel()
+            stream.stop()
+
+    # Расписание запрашивается через ту же асинхронную сессию: тот же канал, лимиты и повторы
+    async def update_calendar(self):
+        calendar = self.calendar
+        calendar.checked = time.time()
+        from_, to = schedule_range()
+        try:
+            response = await self.session.call('trading_schedules', lambda client: client.instruments.trading_schedules(
+                exchange=calendar.exchange, from_=from_, to=to))
+        except Exception as e:
+            self.calendar = calendar_after_error(calendar, e)
+            return
+        calendar.apply(response)
+        try:
+            calendar.save()
+        except OSError as e:
+            print(f"Не удалось сохранить расписание торгов: {e}")
+
+    # Спим до начала следующей сессии, за WARMUP секунд до него обновляем цены и портфель
+    async def wait_for_open(self):
+
+        upcoming = self.calendar.next_session()
+        if upcoming is None:
+            print('В расписании торгов нет следующей сессии, проверим через час')
+            await asyncio.sleep(3600)
+            return
+
+        start = upcoming[0]
+        print(f'Биржа не работает, следующая сессия {start.astimezone():%d.%m.%Y %H:%M}')
+        await asyncio.sleep(max(0.0, (start - now_utc()).total_seconds() - WARMUP))
+        try:
+            await self.refresh()
+        except Exception as e:
+            print("Не удалось прогреть подключение:", str(e))
+        await asyncio.sleep(max(0.0, (start - now_utc()).total_seconds()))
+
+    async def run(self):
+
+        await self.refresh()
+        portfolio_task = asyncio.create_task(self.portfolio_loop())
+        stream_retry_at = 0.0
+        loop = asyncio.get_running_loop()
+
+        try:
+            while True:
+                try:
+                    if self.calendar.is_stale():
+                        await self.update_calendar()
+
+                    trading = self.calendar.current()
+                    if trading is None:
+                        await self.wait_for_open()
+                        continue
+
+                    start, end = trading
+                    if strategy.STREAM_MODE and loop.time() >= stream_retry_at:
+                        try:
+                            await self.run_streaming(end)
+                            continue
+                        except Exception as e:
+                            print("Поток рыночных данных прервался, переходим на опрос:", str(e))
+                            stream_retry_at = loop.time() + strategy.STREAM_RETRY_DELAY
+
+                    await self.fetch_prices()
+                    self.on_spread(*self.spread())
+                    await asyncio.sleep(max(0.0, min(POLL_INTERVAL, (end - now_utc()).total_seconds())))
+
+                except Exception as e:
+                    print("Произошла ошибка:", str(e))
+                    print("------------------------------------------")
+        finally:
+            portfolio_task.cancel()
+            await self.session.close()
+
+if __name__ == '__main__':
+
+    print("---------------------------------------------")
+    print('Асинхронный скрипт торговли по спреду обычка/преф запущен')
+    print("---------------------------------------------")
+    session, Account_id = strategy.user_input_token()
+    print('Запрашиваю информацию об инструментах...')
+    catalog = strategy.create_instruments_catalog(session)
+    calendar = create_trading_calendar(session)
+    session.close()
+    print("---------------------------------------------")
+    figi_Ob, figi_Pref = strategy.user_input_tiker(catalog)
+    price_1, price_2 = strategy.user_input_spread()
+    print("---------------------------------------------")
+
+    asyncio.run(AsyncSpreadStrategy(AsyncClientSession(session.TOKEN), Account_id, catalog, figi_Ob, figi_Pref, price_1, price_2, calendar).run())
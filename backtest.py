@@ -0,0 +1,211 @@
+"""Бэктест стратегии на исторических свечах обеих ног и перебор порогов price_1/price_2.
+
+Повторяет логику decide() из spread_strategy.py: спред ниже price_1 - держим обычку,
+выше price_2 - держим префы, между порогами - ничего не меняем. Покупка идет целыми
+лотами на 98% денег, с каждой сделки удерживается комиссия.
+
+Какая нога держится на каждой свече, считается векторно через NumPy; в цикле на Python
+обрабатываются только моменты перекладки, которых на порядки меньше, чем свечей.
+
+Перебор порогов по минутным свечам, скачанным candles.py (тикеры берутся из кэша справочника):
+
+    python backtest.py SBER SBERP --from 2025-01-01 --to 2026-01-01 --price-1 0 3 0.1 --price-2 1 6 0.1
+    python backtest.py SBER SBERP --random 5000 --price-1 0 3 --price-2 1 6 --top 20
+"""
+
+import itertools, os, random
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+COMMISSION = 0.0005                                     # Комиссия брокера с оборота сделки (0.05%)
+BUY_FRACTION = 0.98                                     # Доля денег на покупку, как в торговом скрипте
+MONEY = 100000                                          # Стартовый капитал, руб
+
+# Спред как в торговом скрипте: обычка минус преф с округлением до копеек
+def spread_series(close_Ob: np.ndarray, close_Pref: np.ndarray) -> np.ndarray:
+    return np.round(close_Ob - close_Pref, 2)
+
+# Сигнал на каждой свече: 1 - спред ниже price_1 (нужна обычка), -1 - выше price_2 (нужны префы), 0 - между порогами
+def signal_series(spread: np.ndarray, price_1: float, price_2: float) -> np.ndarray:
+    return (spread < price_1).view(np.int8) - (spread > price_2).view(np.int8)
+
+# Свечи, на которых меняется нужная нога, и нога после перекладки.
+# Между порогами позиция не меняется, поэтому смотрим только на смену знака среди ненулевых сигналов
+def switch_points(spread: np.ndarray, price_1: float, price_2: float) -> Tuple[np.ndarray, np.ndarray]:
+    signal = signal_series(spread, price_1, price_2)
+    active = np.flatnonzero(signal)
+    legs = signal[active]
+    changed = np.flatnonzero(np.diff(legs, prepend=np.int8(0)))
+    return active[changed], legs[changed]
+
+def backtest(close_Ob: np.ndarray, close_Pref: np.ndarray, price_1: float, price_2: float,
+             lot_Ob: int = 1, lot_Pref: int = 1, money: float = MONEY, commission: float = COMMISSION,
+             spread: Optional[np.ndarray] = None) -> Dict[str, float]:
+
+    if spread is None:
+        spread = spread_series(close_Ob, close_Pref)
+
+    # Сделки совершаются только на свечах, где меняется нужная нога
+    switches, targets = switch_points(spread, price_1, price_2)
+
+    prices = {1: close_Ob, -1: close_Pref}
+    lots = {1: lot_Ob, -1: lot_Pref}
+    leg = 0                                                 # Нога, которая реально куплена
+    quantity = 0                                            # Кол-во бумаг этой ноги
+    trades = 0
+
+    for i, target in zip(switches.tolist(), targets.tolist()):
+
+        # Продаем текущую ногу целиком
+        if leg != 0 and quantity:
+            value = quantity * prices[leg][i]
+            money += value - value * commission
+            quantity = 0
+            trades += 1
+
+        # Покупаем нужную ногу целыми лотами на 98% денег
+        leg = target
+        if leg != 0:
+            price = prices[leg][i]
+            KolVo = int(int(money) / price / lots[leg] * BUY_FRACTION)
+            if KolVo > 0:
+                quantity = KolVo * lots[leg]
+                value = quantity * price
+                money -= value + value * commission
+                trades += 1
+
+    equity = money + (quantity * prices[leg][-1] if leg != 0 else 0.0)
+    return {
+        'price_1': float(price_1),
+        'price_2': float(price_2),
+        'equity': float(equity),
+        'trades': trades,
+        'switches': int(len(switches)),
+        'leg': int(leg),
+        'quantity': int(quantity),
+    }
+
+# Данные, общие для всех задач одного процесса пула: передаются один раз при запуске процесса
+_worker_data: Dict[str, object] = {}
+
+def _init_worker(close_Ob, close_Pref, lot_Ob, lot_Pref, money, commission):
+    _worker_data.update(
+        close_Ob=close_Ob,
+        close_Pref=close_Pref,
+        spread=spread_series(close_Ob, close_Pref),
+        lot_Ob=lot_Ob,
+        lot_Pref=lot_Pref,
+        money=money,
+        commission=commission,
+    )
+
+def _run_chunk(thresholds: List[Tuple[float, float]]) -> List[Dict[str, float]]:
+    d = _worker_data
+    return [backtest(d['close_Ob'], d['close_Pref'], price_1, price_2, d['lot_Ob'], d['lot_Pref'],
+                     d['money'], d['commission'], d['spread'])
+            for price_1, price_2 in thresholds]
+
+# Сетка порогов: все сочетания price_1 < price_2
+def grid(prices_1: Iterable[float], prices_2: Iterable[float]) -> List[Tuple[float, float]]:
+    return [(p1, p2) for p1, p2 in itertools.product(prices_1, prices_2) if p1 < p2]
+
+# Случайный перебор: n сочетаний из диапазонов (min, max) с шагом в копейку
+def random_thresholds(n: int, range_1: Tuple[float, float], range_2: Tuple[float, float], seed: Optional[int] = None):
+    rnd = random.Random(seed)
+    result = []
+    while len(result) < n:
+        p1 = round(rnd.uniform(*range_1), 2)
+        p2 = round(rnd.uniform(*range_2), 2)
+        if p1 < p2:
+            result.append((p1, p2))
+    return result
+
+# Значения порога от start до stop включительно с шагом step, округленные до копеек
+def threshold_range(start: float, stop: float, step: float) -> List[float]:
+    return sorted(set(np.round(np.arange(start, stop + step / 2, step), 2).tolist()))
+
+# Прогоняет бэктест по всем порогам в пуле процессов и возвращает результаты от лучшего к худшему
+def optimize(close_Ob: np.ndarray, close_Pref: np.ndarray, thresholds: List[Tuple[float, float]],
+             lot_Ob: int = 1, lot_Pref: int = 1, money: float = MONEY, commission: float = COMMISSION,
+             workers: Optional[int] = None, chunk_size: int = 64) -> List[Dict[str, float]]:
+
+    close_Ob = np.ascontiguousarray(close_Ob, dtype=np.float64)
+    close_Pref = np.ascontiguousarray(close_Pref, dtype=np.float64)
+    chunks = [thresholds[i:i + chunk_size] for i in range(0, len(thresholds), chunk_size)]
+    workers = workers or os.cpu_count() or 1
+
+    if workers == 1 or len(chunks) == 1:
+        _init_worker(close_Ob, close_Pref, lot_Ob, lot_Pref, money, commission)
+        results = [r for chunk in chunks for r in _run_chunk(chunk)]
+    else:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                 initargs=(close_Ob, close_Pref, lot_Ob, lot_Pref, money, commission)) as pool:
+            results = [r for chunk_results in pool.map(_run_chunk, chunks) for r in chunk_results]
+
+    results.sort(key=lambda r: r['equity'], reverse=True)
+    return results
+
+if __name__ == '__main__':
+
+    import argparse, datetime
+
+    from candles import CANDLES_DIR, CandleStore, align
+    from spread_strategy import INSTRUMENTS_CACHE_FILE, InstrumentCatalog
+
+    def parse_date(value: str) -> datetime.datetime:
+        return datetime.datetime.strptime(value, '%Y-%m-%d').replace(tzinfo=datetime.timezone.utc)
+
+    parser = argparse.ArgumentParser(description='Перебор порогов price_1/price_2 на исторических минутных свечах пары')
+    parser.add_argument('ticker_Ob', help='Тикер обычки')
+    parser.add_argument('ticker_Pref', help='Тикер префов')
+    parser.add_argument('--from', dest='from_', type=parse_date, help='Начало периода, ГГГГ-ММ-ДД (UTC)')
+    parser.add_argument('--to', type=parse_date, help='Конец периода, не включая, ГГГГ-ММ-ДД (UTC)')
+    parser.add_argument('--price-1', nargs='+', type=float, default=[0, 3, 0.1], metavar='X',
+                        help='Диапазон нижнего порога: START STOP [STEP]')
+    parser.add_argument('--price-2', nargs='+', type=float, default=[1, 6, 0.1], metavar='X',
+                        help='Диапазон верхнего порога: START STOP [STEP]')
+    parser.add_argument('--random', type=int, default=0, metavar='N',
+                        help='Вместо сетки взять N случайных сочетаний из диапазонов (шаг не нужен)')
+    parser.add_argument('--seed', type=int)
+    parser.add_argument('--top', type=int, default=10, help='Сколько лучших сочетаний показать')
+    parser.add_argument('--money', type=float, default=MONEY)
+    parser.add_argument('--commission', type=float, default=COMMISSION)
+    parser.add_argument('--workers', type=int)
+    parser.add_argument('--dir', default=CANDLES_DIR)
+    args = parser.parse_args()
+
+    if args.random:
+        if len(args.price_1) < 2 or len(args.price_2) < 2:
+            parser.error('для --random нужны диапазоны START STOP')
+        thresholds = random_thresholds(args.random, tuple(args.price_1[:2]), tuple(args.price_2[:2]), args.seed)
+    else:
+        if len(args.price_1) != 3 or len(args.price_2) != 3:
+            parser.error('для сетки нужны диапазоны START STOP STEP')
+        thresholds = grid(threshold_range(*args.price_1), threshold_range(*args.price_2))
+
+    catalog = InstrumentCatalog.load(INSTRUMENTS_CACHE_FILE)
+    info = {}
+    for ticker in (args.ticker_Ob, args.ticker_Pref):
+        info[ticker] = catalog.by_ticker.get(ticker)
+        if info[ticker] is None:
+            parser.error(f'тикер {ticker} не найден в {INSTRUMENTS_CACHE_FILE}: сначала запустите candles.py')
+
+    interval = 'candle_interval_1_min'                      # Интервал, который качает candles.py
+    times, close_Ob, close_Pref = align(CandleStore(args.dir), info[args.ticker_Ob]['figi'],
+                                        info[args.ticker_Pref]['figi'], interval, args.from_, args.to)
+    if not len(times):
+        parser.error(f'нет общих свечей пары в {args.dir}: сначала запустите candles.py')
+
+    first = datetime.datetime.fromtimestamp(int(times[0]), datetime.timezone.utc)
+    last = datetime.datetime.fromtimestamp(int(times[-1]), datetime.timezone.utc)
+    print(f'{args.ticker_Ob}/{args.ticker_Pref}: {len(times)} свечей с {first:%Y-%m-%d} по {last:%Y-%m-%d}, '
+          f'сочетаний порогов: {len(thresholds)}')
+
+    results = optimize(close_Ob, close_Pref, thresholds, info[args.ticker_Ob]['lot_size'], info[args.ticker_Pref]['lot_size'],
+                       args.money, args.commission, args.workers)
+    print(f"{'price_1':>8} {'price_2':>8} {'капитал':>12} {'доход':>8} {'сделок':>7}")
+    for r in results[:args.top]:
+        print(f"{r['price_1']:>8.2f} {r['price_2']:>8.2f} {r['equity']:>12.2f} "
+              f"{r['equity'] / args.money - 1:>8.2%} {r['trades']:>7}")
@@ -0,0 +1,259 @@
+"""Замеры производительности стратегии на локальной заглушке API (fake_invest.py), без токена и денег.
+
+Сценарии:
+    session    - итерация опроса: свой канал на каждый вызов против общей ClientSession
+    loop       - пропускная способность цикла по потоку: тиков в секунду и задержка тик -> решение
+    rebalance  - задержка перекладки от решения до исполнения обеих ног
+    startup    - холодный импорт модуля, время до первого решения и холодный запуск headless.py
+
+    python bench_strategy.py all --pairs 1 4 --json bench.json
+    python bench_strategy.py session --iterations 50 --connect-latency 0.05 --call-latency 0.005
+
+С --json результаты сохраняются в файл; с --baseline сравниваются с прошлым прогоном.
+"""
+
+import argparse, contextlib, functools, io, json, os, statistics, subprocess, sys, tempfile, time
+
+import spread_strategy as strategy
+from fake_invest import FakeClient, FakeMarket, random_walk, spread_cycle
+from metrics import METRICS
+
+FIGI_OB = 'BBG004730N88'
+FIGI_PREF = 'BBG0047315Y7'
+PRICE_OB = 300.0
+PRICE_PREF = 299.5
+COLD_START_TARGET_MS = 1000                             # Цель: от запуска процесса до первого решения
+
+# Холодный запуск в отдельном процессе, как после падения: настройки без диалогов, кэши и снимок состояния
+# на диске, биржа - заглушка. Процесс завершается сразу после первого решения
+COLD_START_SCRIPT = '''
+import functools, json, sys
+import headless
+from fake_invest import FakeClient, FakeMarket
+config, prices, call_latency = json.loads(sys.argv[1]), json.loads(sys.argv[2]), float(sys.argv[3])
+market = FakeMarket(prices, lot_sizes={figi: 1 for figi in prices})
+engine = headless.create_engine(config, functools.partial(FakeClient, market=market, call_latency=call_latency))
+engine.refresh_portfolio()
+engine.poll_once()
+headless.save_state(engine, config['state_file'])
+'''
+
+# Старая схема: каждый запрос открывает свой канал, как with Client(TOKEN) в каждом хелпере
+class ReconnectingSession(strategy.ClientSession):
+
+    @property
+    def client(self):
+        self.reconnect()
+        return self._client
+
+def pair_figis(count: int):
+    if count == 1:
+        return [(FIGI_OB, FIGI_PREF)]
+    return [(f'OB{i:02d}', f'PREF{i:02d}') for i in range(count)]
+
+# Биржа-заглушка с count парами: у каждой пары обычка дороже префа на 0.5 руб
+def make_market(count: int, **kwargs) -> FakeMarket:
+    prices = {}
+    for i, (figi_Ob, figi_Pref) in enumerate(pair_figis(count)):
+        prices[figi_Ob] = PRICE_OB + i
+        prices[figi_Pref] = PRICE_PREF + i
+    kwargs.setdefault('lot_sizes', {figi: 1 for figi in prices})
+    return FakeMarket(prices, **kwargs)
+
+def make_catalog(market: FakeMarket) -> strategy.InstrumentCatalog:
+    catalog = strategy.InstrumentCatalog()
+    catalog.update_type('shares', [{'ticker': i.ticker, 'figi': i.figi, 'type': 'shares', 'name': i.name, 'lot_size': i.lot}
+                                   for i in market.instruments('shares')])
+    return catalog
+
+def make_engine(market: FakeMarket, count: int, price_1: float, price_2: float, session_class=strategy.ClientSession,
+                connect_latency: float = 0.0, call_latency: float = 0.0, catalog=None):
+    factory = functools.partial(FakeClient, market=market, connect_latency=connect_latency, call_latency=call_latency)
+    session = session_class('fake-token', client_factory=factory)
+    catalog = catalog or make_catalog(market)
+    pairs = [strategy.SpreadPair(catalog.by_figi[figi_Ob], catalog.by_figi[figi_Pref], price_1, price_2, 1 / count)
+             for figi_Ob, figi_Pref in pair_figis(count)]
+    return strategy.SpreadEngine(session, 'fake-account', catalog, pairs)
+
+def percentile(values, q: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * q))] if values else 0.0
+
+# Сколько секунд запросы прождали по лимитам брокера (token bucket) с начала процесса
+def throttled_seconds() -> float:
+    return sum(value for (name, labels), value in METRICS.counters.items() if name == 'api_throttled_seconds_total')
+
+# Итерация цикла "ничего не делаем" при опросе
+def bench_session(iterations: int, connect_latency: float, call_latency: float, reconnect_each_call: bool):
+    market = make_market(1, positions={FIGI_OB: 100})
+    session_class = ReconnectingSession if reconnect_each_call else strategy.ClientSession
+    engine = make_engine(market, 1, 1, 3, session_class, connect_latency, call_latency)
+
+    timings = []
+    with contextlib.redirect_stdout(io.StringIO()):
+        for _ in range(iterations):
+            start = time.perf_counter()
+            engine.poll_once()
+            timings.append(time.perf_counter() - start)
+    engine.session.close()
+    return {
+        'median_ms': statistics.median(timings) * 1000,
+        'p95_ms': percentile(timings, 0.95) * 1000,
+        'connects': market.connects,
+    }
+
+# Поток тиков без пересечения порогов: вся работа - обновление цен, стаканов и решение
+def bench_loop(pairs: int, ticks: int):
+    figis = [figi for pair in pair_figis(pairs) for figi in pair]
+    market = make_market(pairs, positions={pair_figis(pairs)[0][0]: 10})
+    market.script = iter(random_walk({figi: market.prices[figi] for figi in figis}, ticks // len(figis), 0.0001, seed=1))
+    engine = make_engine(market, pairs, -100, 100)
+
+    histogram = METRICS.histogram('tick_to_decision_seconds')
+    count_before, sum_before = histogram.count, histogram.sum
+    with contextlib.redirect_stdout(io.StringIO()):
+        engine.poll_once()
+        start = time.perf_counter()
+        engine.run_streaming()
+        elapsed = time.perf_counter() - start
+    messages = histogram.count - count_before
+    engine.session.close()
+    return {
+        'ticks': market.ticks_played,
+        'messages': messages,                               # last_price и стакан на каждый тик
+        'ticks_per_s': market.ticks_played / elapsed,
+        'tick_to_decision_mean_us': (histogram.sum - sum_before) / max(messages, 1) * 1e6,
+    }
+
+# Спред ходит между порогами: каждая половина периода - перекладка. Биржа отвечает с задержкой
+def bench_rebalance(pairs: int, switches: int, call_latency: float, fill_delay: float):
+    period = 20
+    market = make_market(pairs, money=100000.0, fill_delay=fill_delay)
+    script = []
+    for figi_Ob, figi_Pref in pair_figis(pairs):
+        script.extend(spread_cycle(figi_Ob, figi_Pref, market.prices[figi_Pref], -1, 3, switches * period // 2, period))
+    market.script = iter(script)
+    engine = make_engine(market, pairs, 0, 2, call_latency=call_latency)
+    engine.orders.poll_interval = min(engine.orders.poll_interval, max(fill_delay / 4, 0.001))
+
+    throttled_before = throttled_seconds()
+    with contextlib.redirect_stdout(io.StringIO()):
+        engine.poll_once()
+        engine.run_streaming()
+    engine.session.close()
+    latencies = engine.switch_latencies
+    return {
+        'switches': len(latencies),
+        'switch_median_ms': statistics.median(latencies) * 1000 if latencies else 0.0,
+        'switch_p95_ms': percentile(latencies, 0.95) * 1000,
+        'throttled_s': throttled_seconds() - throttled_before,   # Ожидание по лимитам брокера внутри перекладок
+    }
+
+# Холодный импорт в отдельном процессе и путь до первого решения: каталог из кеша, портфель, первые цены
+def bench_startup(pairs: int, call_latency: float, repeats: int = 5):
+    root = os.path.dirname(os.path.abspath(__file__))
+    imports = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, '-c', 'import spread_strategy'], check=True, cwd=root)
+        imports.append(time.perf_counter() - start)
+
+    market = make_market(pairs)
+    with tempfile.TemporaryDirectory() as tmp:
+        cache_path = os.path.join(tmp, 'instruments_cache.json')
+        factory = functools.partial(FakeClient, market=market, call_latency=call_latency)
+        with contextlib.redirect_stdout(io.StringIO()):
+            strategy.create_instruments_catalog(strategy.ClientSession('fake-token', client_factory=factory), cache_path)
+            firsts = []
+            for _ in range(repeats):
+                start = time.perf_counter()
+                session = strategy.ClientSession('fake-token', client_factory=factory)
+                catalog = strategy.create_instruments_catalog(session, cache_path)
+                engine = make_engine(market, pairs, -100, 100, call_latency=call_latency, catalog=catalog)
+                engine.refresh_portfolio()
+                engine.poll_once()
+                firsts.append(time.perf_counter() - start)
+                session.close()
+                engine.session.close()
+
+        # Первый запуск заполняет кэш расписания и снимок состояния, остальные - как перезапуск после падения
+        config = {
+            'token': 'fake-token',
+            'account_id': 'fake-account',
+            'pairs': [{'ticker_Ob': figi_Ob, 'ticker_Pref': figi_Pref, 'price_1': -100, 'price_2': 100, 'allocation': 1 / pairs}
+                      for figi_Ob, figi_Pref in pair_figis(pairs)],
+            'journal': False,
+            'metrics_port': 0,
+            'state_file': 'state.json',
+        }
+        argv = [sys.executable, '-c', COLD_START_SCRIPT, json.dumps(config), json.dumps(market.prices), str(call_latency)]
+        env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [root, os.environ.get('PYTHONPATH')])))
+        colds = []
+        for i in range(repeats + 1):
+            start = time.perf_counter()
+            subprocess.run(argv, check=True, cwd=tmp, env=env, stdout=subprocess.DEVNULL)
+            if i:
+                colds.append(time.perf_counter() - start)
+
+    cold_start = statistics.median(colds) * 1000
+    return {
+        'import_median_ms': statistics.median(imports) * 1000,
+        'first_decision_median_ms': statistics.median(firsts) * 1000,
+        'cold_start_median_ms': cold_start,
+        'cold_start_ok': cold_start <= COLD_START_TARGET_MS,
+    }
+
+def report(title: str, result):
+    values = '   '.join(f'{key} {value:.2f}' if isinstance(value, float) else f'{key} {value}' for key, value in result.items())
+    print(f'{title:<28} {values}')
+
+# Сравнение с прошлым прогоном: изменение каждой метрики в процентах
+def compare(results, baseline):
+    for title, result in results.items():
+        if title not in baseline:
+            continue
+        changes = []
+        for key, value in result.items():
+            old = baseline[title].get(key)
+            if isinstance(value, float) and old:
+                changes.append(f'{key} {(value - old) / old * 100:+.1f}%')
+        print(f'{title:<28} ' + '   '.join(changes))
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('scenario', nargs='?', default='all', choices=('all', 'session', 'loop', 'rebalance', 'startup'))
+    parser.add_argument('--pairs', type=int, nargs='+', default=[1, 4], help='Число пар в прогонах loop/rebalance/startup')
+    parser.add_argument('--iterations', type=int, default=50)
+    parser.add_argument('--ticks', type=int, default=20000, help='Тиков в прогоне loop')
+    parser.add_argument('--switches', type=int, default=5, help='Перекладок на пару в прогоне rebalance')
+    parser.add_argument('--connect-latency', type=float, default=0.05, help='Установка канала, сек')
+    parser.add_argument('--call-latency', type=float, default=0.005, help='Один запрос, сек')
+    parser.add_argument('--fill-delay', type=float, default=0.02, help='Время исполнения заявки на бирже, сек')
+    parser.add_argument('--json', help='Сохранить результаты в файл')
+    parser.add_argument('--baseline', help='Файл с результатами прошлого прогона для сравнения')
+    args = parser.parse_args()
+
+    results = {}
+    def run(title, fn, *fn_args):
+        results[title] = fn(*fn_args)
+        report(title, results[title])
+
+    if args.scenario in ('all', 'session'):
+        run('session reconnect', bench_session, args.iterations, args.connect_latency, args.call_latency, True)
+        run('session shared', bench_session, args.iterations, args.connect_latency, args.call_latency, False)
+    for pairs in args.pairs:
+        if args.scenario in ('all', 'loop'):
+            run(f'loop {pairs} pair(s)', bench_loop, pairs, args.ticks)
+        if args.scenario in ('all', 'rebalance'):
+            run(f'rebalance {pairs} pair(s)', bench_rebalance, pairs, args.switches, args.call_latency, args.fill_delay)
+        if args.scenario in ('all', 'startup'):
+            run(f'startup {pairs} pair(s)', bench_startup, pairs, args.call_latency)
+
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            print('Изменение относительно', args.baseline)
+            compare(results, json.load(f))
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=1)
@@ -0,0 +1,180 @@
+"""Локальное хранилище исторических свечей в колоночных файлах.
+
+Для каждой пары (FIGI, интервал) хранится каталог candles/<FIGI>/<интервал>/ с отдельным
+бинарным файлом на колонку (time, open, high, low, close, volume) и meta.json с числом
+записанных свечей. Файлы читаются через np.memmap, срезы по датам не копируют данные.
+Повторная загрузка докачивает только хвост после последней сохраненной свечи.
+
+Загрузка минутных свечей по всем парам: python candles.py --days 365
+"""
+
+import datetime, json, os
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+
+CANDLES_DIR = 'candles'
+
+# Колонки и их типы: время в секундах UTC, цены в рублях, объем в лотах
+COLUMNS = {
+    'time': np.int64,
+    'open': np.float64,
+    'high': np.float64,
+    'low': np.float64,
+    'close': np.float64,
+    'volume': np.int64,
+}
+
+# Наибольший период одного запроса get_candles для интервала (лимиты API); длинная история
+# качается страницами этого размера, каждая - отдельным вызовом через session.call
+CANDLE_PAGES = {
+    'candle_interval_1_min': datetime.timedelta(days=1),
+    'candle_interval_5_min': datetime.timedelta(days=1),
+    'candle_interval_15_min': datetime.timedelta(days=1),
+    'candle_interval_hour': datetime.timedelta(weeks=1),
+    'candle_interval_day': datetime.timedelta(days=365),
+}
+CANDLE_PAGE = datetime.timedelta(days=1)                # Для интервалов, которых нет в CANDLE_PAGES
+
+def quotation_to_float(quotation) -> float:
+    return quotation.units + quotation.nano * 1e-9
+
+def interval_name(interval) -> str:
+    return getattr(interval, 'name', str(interval)).lower()
+
+# Границы страниц [from_, to) для запросов get_candles
+def candle_pages(from_: datetime.datetime, to: datetime.datetime, interval):
+    step = CANDLE_PAGES.get(interval_name(interval), CANDLE_PAGE)
+    while from_ < to:
+        yield from_, min(from_ + step, to)
+        from_ += step
+
+# Свечи за период постранично. Каждая страница идет через session.call, поэтому загрузка
+# истории подчиняется общему лимиту запросов, повторам и автомату отключения
+def fetch_candles(session, figi: str, from_: datetime.datetime, interval, to: Optional[datetime.datetime] = None):
+    to = to or datetime.datetime.now(datetime.timezone.utc)
+    for page_from, page_to in candle_pages(from_, to, interval):
+        response = session.call('get_candles', lambda client: client.market_data.get_candles(
+            figi=figi, from_=page_from, to=page_to, interval=interval))
+        yield from response.candles
+
+class CandleStore:
+
+    def __init__(self, root: str = CANDLES_DIR):
+        self.root = root
+
+    def path(self, figi: str, interval) -> str:
+        return os.path.join(self.root, figi, interval_name(interval))
+
+    def count(self, figi: str, interval) -> int:
+        try:
+            with open(os.path.join(self.path(figi, interval), 'meta.json'), encoding='utf-8') as f:
+                return json.load(f)['count']
+        except (OSError, ValueError, KeyError):
+            return 0
+
+    def _set_count(self, path: str, count: int):
+        tmp_path = os.path.join(path, 'meta.json.tmp')
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'count': count}, f)
+        os.replace(tmp_path, os.path.join(path, 'meta.json'))
+
+    # Дописываем свечи в конец колонок. meta.json обновляется последним, поэтому
+    # недописанный хвост после сбоя просто обрезается при следующей записи
+    def append(self, figi: str, interval, columns: Dict[str, np.ndarray]):
+
+        size = len(columns['time'])
+        if not size:
+            return
+
+        path = self.path(figi, interval)
+        os.makedirs(path, exist_ok=True)
+        count = self.count(figi, interval)
+
+        last = self.last_time(figi, interval)
+        if last is not None and columns['time'][0] <= last:
+            raise ValueError(f"{figi}: новые свечи должны идти после {last}")
+
+        for name, dtype in COLUMNS.items():
+            with open(os.path.join(path, name), 'ab') as f:
+                f.truncate(count * np.dtype(dtype).itemsize)
+                f.write(np.ascontiguousarray(columns[name], dtype=dtype).tobytes())
+
+        self._set_count(path, count + size)
+
+    def column(self, figi: str, interval, name: str) -> np.ndarray:
+        count = self.count(figi, interval)
+        if not count:
+            return np.empty(0, dtype=COLUMNS[name])
+        return np.memmap(os.path.join(self.path(figi, interval), name), dtype=COLUMNS[name], mode='r', shape=(count,))
+
+    def last_time(self, figi: str, interval) -> Optional[int]:
+        times = self.column(figi, interval, 'time')
+        return int(times[-1]) if len(times) else None
+
+    # Срез по датам [from_, to) без копирования: границы ищутся бинарным поиском по времени
+    def read(self, figi: str, interval, from_: Optional[datetime.datetime] = None,
+             to: Optional[datetime.datetime] = None, columns=('time', 'close')) -> Dict[str, np.ndarray]:
+
+        times = self.column(figi, interval, 'time')
+        start = np.searchsorted(times, int(from_.timestamp())) if from_ else 0
+        stop = np.searchsorted(times, int(to.timestamp())) if to else len(times)
+        return {name: self.column(figi, interval, name)[start:stop] for name in columns}
+
+    # Докачиваем свечи от последней сохраненной (или от start) до текущего момента
+    def update(self, session, figi: str, interval, start: datetime.datetime) -> int:
+
+        last = self.last_time(figi, interval)
+        from_ = datetime.datetime.fromtimestamp(last + 1, datetime.timezone.utc) if last is not None else start
+
+        rows = {name: [] for name in COLUMNS}
+        for candle in fetch_candles(session, figi, from_, interval):
+            if not candle.is_complete:
+                continue                                    # Незакрытая свеча еще изменится
+            rows['time'].append(int(candle.time.timestamp()))
+            rows['open'].append(quotation_to_float(candle.open))
+            rows['high'].append(quotation_to_float(candle.high))
+            rows['low'].append(quotation_to_float(candle.low))
+            rows['close'].append(quotation_to_float(candle.close))
+            rows['volume'].append(candle.volume)
+
+        self.append(figi, interval, {name: np.array(values, dtype=COLUMNS[name]) for name, values in rows.items()})
+        return len(rows['time'])
+
+# Выравнивание двух ног по времени: остаются только свечи, которые есть у обеих бумаг
+def align(store: CandleStore, figi_Ob: str, figi_Pref: str, interval,
+          from_: Optional[datetime.datetime] = None, to: Optional[datetime.datetime] = None) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+
+    Ob = store.read(figi_Ob, interval, from_, to)
+    Pref = store.read(figi_Pref, interval, from_, to)
+    times, index_Ob, index_Pref = np.intersect1d(Ob['time'], Pref['time'], assume_unique=True, return_indices=True)
+    return times, Ob['close'][index_Ob], Pref['close'][index_Pref]
+
+if __name__ == '__main__':
+
+    import argparse
+    from tinkoff.invest import CandleInterval
+
+    import spread_strategy as strategy
+
+    parser = argparse.ArgumentParser(description='Загрузка исторических свечей по парам обычка/преф')
+    parser.add_argument('--days', type=int, default=365, help='Глубина истории при первой загрузке, дней')
+    parser.add_argument('--dir', default=CANDLES_DIR)
+    args = parser.parse_args()
+
+    session, Account_id = strategy.user_input_token()
+    catalog = strategy.create_instruments_catalog(session)
+    start = datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(days=args.days)
+    store = CandleStore(args.dir)
+
+    if os.path.exists(strategy.PAIRS_CONFIG_FILE):
+        tickers = [ticker for pair in strategy.load_pairs(catalog) for ticker in (pair.info_Ob['ticker'], pair.info_Pref['ticker'])]
+    else:
+        tickers = [pair[key] for pair in strategy.PAIRS for key in ('ticker_Ob', 'ticker_Pref')]
+
+    for ticker in tickers:
+        figi = strategy.get_instrument_info(catalog, TICKER=ticker)['figi']
+        loaded = store.update(session, figi, CandleInterval.CANDLE_INTERVAL_1_MIN, start)
+        print(f'{ticker}: загружено {loaded} свечей, всего {store.count(figi, CandleInterval.CANDLE_INTERVAL_1_MIN)}')
+
+    session.close()
@@ -0,0 +1,470 @@
+"""Локальная замена Tinkoff Invest API для проверки и замеров стратегии без токена и реальных денег.
+
+FakeMarket - биржа и счет в памяти: инструменты, стаканы, позиции, заявки с задержкой
+исполнения и частичным исполнением, поток рыночных данных и поток позиций. Цены двигаются
+по заранее заданному сценарию (список тиков figi, цена). Задержку каждого метода и ошибки
+(по счетчику или с вероятностью) можно настроить, чтобы проверить повторы и переподключения.
+
+FakeClient и FakeAsyncClient подставляются вместо Client/AsyncClient через client_factory.
+"""
+
+import asyncio, datetime, enum, math, queue, random, threading, time
+from types import SimpleNamespace
+from typing import Dict, Iterable, List, Optional, Tuple
+
+# Статусы заявки с теми же именами, что у tinkoff.invest.OrderExecutionReportStatus
+class ExecutionStatus(enum.Enum):
+    EXECUTION_REPORT_STATUS_FILL = 1
+    EXECUTION_REPORT_STATUS_REJECTED = 2
+    EXECUTION_REPORT_STATUS_CANCELLED = 3
+    EXECUTION_REPORT_STATUS_NEW = 4
+    EXECUTION_REPORT_STATUS_PARTIALLYFILL = 5
+
+# Ошибка запроса в том же виде, что tinkoff.invest.exceptions.RequestError: code.name, details, metadata
+class FakeRequestError(Exception):
+
+    def __init__(self, code: str = 'UNAVAILABLE', details: str = '', ratelimit_reset: Optional[int] = None):
+        super().__init__(f'{code}: {details}' if details else code)
+        self.code = SimpleNamespace(name=code)
+        self.details = details
+        self.metadata = SimpleNamespace(ratelimit_reset=ratelimit_reset)
+
+# Цена в формате Quotation (units + nano)
+def quotation(price: float):
+    units = int(price)
+    return SimpleNamespace(units=units, nano=int(round((price - units) * 1e9)))
+
+def money_value(amount: float, currency: str = 'rub'):
+    units = int(amount)
+    return SimpleNamespace(currency=currency, units=units, nano=int(round((amount - units) * 1e9)))
+
+def _now():
+    return datetime.datetime.now(datetime.timezone.utc)
+
+# Сценарии цен: списки тиков (figi, цена) для FakeMarket.script
+
+# Случайное блуждание цен нескольких бумаг, тики бумаг чередуются
+def random_walk(prices: Dict[str, float], steps: int, volatility: float = 0.001, seed: Optional[int] = None) -> List[Tuple[str, float]]:
+    rnd = random.Random(seed)
+    prices = dict(prices)
+    ticks = []
+    for _ in range(steps):
+        for figi in prices:
+            prices[figi] = round(prices[figi] * math.exp(rnd.gauss(0, volatility)), 2)
+            ticks.append((figi, prices[figi]))
+    return ticks
+
+# Спред пары ходит по синусоиде между low и high: каждый период дает две перекладки
+def spread_cycle(figi_Ob: str, figi_Pref: str, price_Pref: float, low: float, high: float,
+                 steps: int, period: int = 100) -> List[Tuple[str, float]]:
+    middle = (low + high) / 2
+    amplitude = (high - low) / 2
+    ticks = []
+    for i in range(steps):
+        spread = middle + amplitude * math.sin(2 * math.pi * i / period)
+        ticks.append((figi_Ob, round(price_Pref + spread, 2)))
+        ticks.append((figi_Pref, price_Pref))
+    return ticks
+
+# Подписка-заглушка: запоминает, на что подписались
+class _Subscription:
+
+    def __init__(self):
+        self.instruments = []
+
+    def subscribe(self, instruments):
+        self.instruments.extend(instruments)
+
+    def unsubscribe(self, instruments):
+        self.instruments = [i for i in self.instruments if i not in instruments]
+
+    def figis(self):
+        return {i.figi for i in self.instruments}
+
+# Поток рыночных данных биржи-заглушки: каждый шаг сценария меняет цену и присылает
+# last_price и стакан по бумаге, если на них подписались. Кончился сценарий - кончился поток
+class FakeMarketDataStream:
+
+    def __init__(self, market: 'FakeMarket'):
+        self.market = market
+        self.last_price = _Subscription()
+        self.order_book = _Subscription()
+        self.stopped = False
+
+    def __iter__(self):
+        market = self.market
+        sent = 0
+        last_price_figis = self.last_price.figis()
+        book_depths = {i.figi: i.depth for i in self.order_book.instruments}
+        while not self.stopped:
+            tick = market.next_tick()
+            if tick is None:
+                return
+            if market.stream_break_after is not None and sent >= market.stream_break_after:
+                market.stream_break_after = None            # Обрыв один раз, переподключение уже работает
+                raise FakeRequestError('UNAVAILABLE', 'Stream removed')
+            figi, price = tick
+            if market.tick_interval:
+                time.sleep(market.tick_interval)
+            now = _now()
+            if figi in last_price_figis:
+                sent += 1
+                yield SimpleNamespace(last_price=SimpleNamespace(figi=figi, price=quotation(price), time=now))
+            depth = book_depths.get(figi)
+            if depth is not None:
+                sent += 1
+                book = market.order_book(figi, depth)
+                yield SimpleNamespace(orderbook=SimpleNamespace(figi=figi, depth=depth, bids=book.bids, asks=book.asks, time=now))
+
+    def stop(self):
+        self.stopped = True
+
+# Состояние биржи-заглушки: инструменты, цены, портфель одного счета, сценарий цен и сбои
+class FakeMarket:
+
+    def __init__(self, prices: dict, money: float = 100000.0, positions: dict = None, lot_sizes: dict = None,
+                 fill_delay: float = 0.0, fill_ratio: float = 1.0, commission: float = 0.0,
+                 script: Optional[Iterable[Tuple[str, float]]] = None, tick_interval: float = 0.0,
+                 book_size: int = 100, tick: float = 0.01, seed: Optional[int] = None):
+        self.prices = dict(prices)                          # figi -> последняя цена
+        self.money = money
+        self.positions = dict(positions or {})              # figi -> кол-во бумаг
+        self.lot_sizes = dict(lot_sizes or {})              # figi -> лотность
+        self.fill_delay = fill_delay                        # Через сколько секунд исполняется заявка
+        self.fill_ratio = fill_ratio                        # Какая доля заявки исполняется
+        self.commission = commission                        # Комиссия с оборота сделки
+        self.book_size = book_size                          # Лотов на каждом уровне стакана
+        self.tick = tick                                    # Шаг цены между уровнями стакана
+        self.orders = {}                                    # order_id -> состояние заявки
+        self.connects = 0                                   # Сколько раз открывали канал
+        self.calls = 0                                      # Сколько было unary-запросов
+
+        # Сценарий цен для потока рыночных данных
+        self.script = iter(script or ())
+        self.tick_interval = tick_interval                  # Пауза между тиками сценария, сек
+        self.ticks_played = 0
+
+        # Задержки и сбои
+        self.latency: Dict[str, float] = {}                 # Метод -> задержка ответа, сек (вместо общей задержки клиента)
+        self.failures: Dict[str, List[FakeRequestError]] = {}   # Метод -> ошибки, которые вернут следующие запросы
+        self.error_rate: Dict[str, float] = {}              # Метод -> вероятность ошибки UNAVAILABLE
+        self.stream_break_after: Optional[int] = None       # Поток рыночных данных оборвется после стольких сообщений
+        self.random = random.Random(seed)
+
+        # Торговые сессии (начало, конец) в UTC для trading_schedules; по умолчанию биржа открыта сутки
+        now = _now()
+        self.sessions = [(now - datetime.timedelta(hours=1), now + datetime.timedelta(days=1))]
+
+        self.lock = threading.RLock()                       # Поток позиций читает рынок из другого потока
+        self.position_listeners: List[queue.Queue] = []
+
+    # Следующие count запросов method завершатся ошибкой code
+    def inject_error(self, method: str, code: str = 'UNAVAILABLE', count: int = 1, ratelimit_reset: Optional[int] = None):
+        self.failures.setdefault(method, []).extend(FakeRequestError(code, f'injected {method}', ratelimit_reset) for _ in range(count))
+
+    # Вызывается на каждый запрос: считает запросы и выбрасывает настроенные ошибки
+    def request(self, method: str):
+        self.calls += 1
+        pending = self.failures.get(method)
+        if pending:
+            raise pending.pop(0)
+        rate = self.error_rate.get(method)
+        if rate and self.random.random() < rate:
+            raise FakeRequestError('UNAVAILABLE', f'random {method}')
+
+    def next_tick(self) -> Optional[Tuple[str, float]]:
+        with self.lock:
+            tick = next(self.script, None)
+            if tick is not None:
+                self.prices[tick[0]] = tick[1]
+                self.ticks_played += 1
+            return tick
+
+    # Расписание в виде TradingSchedulesResponse: одна сессия - один торговый день
+    def trading_schedules(self, exchange: str):
+        unset = datetime.datetime(1970, 1, 1, tzinfo=datetime.timezone.utc)
+        days = [SimpleNamespace(date=start, is_trading_day=True, start_time=start, end_time=end,
+                                evening_start_time=unset, evening_end_time=unset,
+                                premarket_start_time=unset, premarket_end_time=unset)
+                for start, end in self.sessions]
+        return SimpleNamespace(exchanges=[SimpleNamespace(exchange=exchange, days=days)])
+
+    def set_price(self, figi: str, price: float):
+        with self.lock:
+            self.prices[figi] = price
+
+    def instruments(self, method: str):
+        if method != 'shares':
+            return []
+        return [SimpleNamespace(ticker=figi, figi=figi, name=figi, lot=self.lot_sizes.get(figi, 1))
+                for figi in self.prices]
+
+    def order_book(self, figi: str, depth: int):
+        price = self.prices[figi]
+        return SimpleNamespace(
+            figi=figi,
+            depth=depth,
+            last_price=quotation(price),
+            bids=[SimpleNamespace(price=quotation(price - self.tick * (i + 1)), quantity=self.book_size) for i in range(depth)],
+            asks=[SimpleNamespace(price=quotation(price + self.tick * (i + 1)), quantity=self.book_size) for i in range(depth)],
+        )
+
+    def portfolio(self):
+        return SimpleNamespace(
+            money=[money_value(self.money)],
+            securities=[SimpleNamespace(figi=figi, balance=balance, blocked=0) for figi, balance in self.positions.items()],
+        )
+
+    # Заявка исполняется через fill_delay секунд по последней цене, на долю fill_ratio от объема.
+    # Неисполненный остаток висит до отмены. Повтор с тем же order_id возвращает уже существующую заявку
+    def post_order(self, order_id: str, figi: str, lots: int, buy: bool):
+        with self.lock:
+            if order_id not in self.orders:
+                self.orders[order_id] = {'figi': figi, 'lots': lots, 'buy': buy, 'executed': 0, 'price': 0.0, 'commission': 0.0,
+                                         'status': ExecutionStatus.EXECUTION_REPORT_STATUS_NEW, 'posted': time.monotonic()}
+            order = self.orders[order_id]
+            self._fill(order)
+            # Как PostOrderResponse: executed_order_price - средняя цена одной бумаги
+            return SimpleNamespace(order_id=order_id, execution_report_status=order['status'], lots_requested=order['lots'],
+                                   lots_executed=order['executed'], executed_order_price=quotation(order['price']),
+                                   executed_commission=quotation(order['commission']))
+
+    def _fill(self, order):
+        if order['status'] != ExecutionStatus.EXECUTION_REPORT_STATUS_NEW or time.monotonic() - order['posted'] < self.fill_delay:
+            return
+        figi = order['figi']
+        lots = int(order['lots'] * self.fill_ratio)
+        quantity = lots * self.lot_sizes.get(figi, 1)
+        amount = quantity * self.prices[figi]
+        sign = 1 if order['buy'] else -1
+        order['commission'] = amount * self.commission
+        self.money -= sign * amount + order['commission']
+        self.positions[figi] = self.positions.get(figi, 0) + sign * quantity
+        if not self.positions[figi]:
+            del self.positions[figi]
+        order['executed'] = lots
+        order['price'] = self.prices[figi]
+        order['status'] = (ExecutionStatus.EXECUTION_REPORT_STATUS_FILL if lots == order['lots']
+                           else ExecutionStatus.EXECUTION_REPORT_STATUS_PARTIALLYFILL)
+        self._publish_position(figi)
+
+    # Как OrderState: executed_order_price - сумма исполненной части, средняя цена - в average_position_price
+    def order_state(self, order_id: str):
+        with self.lock:
+            order = self.orders[order_id]
+            self._fill(order)
+            quantity = order['executed'] * self.lot_sizes.get(order['figi'], 1)
+            return SimpleNamespace(order_id=order_id, execution_report_status=order['status'], lots_requested=order['lots'],
+                                   lots_executed=order['executed'], executed_order_price=quotation(order['price'] * quantity),
+                                   average_position_price=quotation(order['price']),
+                                   executed_commission=quotation(order['commission']))
+
+    def cancel_order(self, order_id: str):
+        with self.lock:
+            order = self.orders[order_id]
+            self._fill(order)
+            if order['status'] in (ExecutionStatus.EXECUTION_REPORT_STATUS_NEW, ExecutionStatus.EXECUTION_REPORT_STATUS_PARTIALLYFILL):
+                order['status'] = ExecutionStatus.EXECUTION_REPORT_STATUS_CANCELLED
+        return SimpleNamespace(time=_now())
+
+    # Поток позиций: после каждого исполнения подписчики получают деньги и остаток по бумаге
+    def _publish_position(self, figi: str):
+        if not self.position_listeners:
+            return
+        position = SimpleNamespace(
+            account_id='fake-account',
+            money=[SimpleNamespace(available_value=money_value(self.money), blocked_value=money_value(0))],
+            securities=[SimpleNamespace(figi=figi, balance=self.positions.get(figi, 0), blocked=0)],
+            date=_now(),
+        )
+        for listener in self.position_listeners:
+            listener.put(SimpleNamespace(position=position))
+
+    def positions_stream(self, close_event: threading.Event):
+        listener = queue.Queue()
+        with self.lock:
+            self.position_listeners.append(listener)
+        try:
+            while not close_event.is_set():
+                try:
+                    yield listener.get(timeout=0.1)
+                except queue.Empty:
+                    continue
+        finally:
+            with self.lock:
+                self.position_listeners.remove(listener)
+
+# Сервис-заглушка: каждый запрос проходит через счетчик, ошибки и задержку клиента
+class _Service:
+
+    def __init__(self, client):
+        self._client = client
+
+    def _call(self, method: str):
+        self._client.market.request(method)
+        latency = self._client.latency(method)
+        if latency and self._client.sleep:
+            time.sleep(latency)
+
+class _Users(_Service):
+
+    def get_accounts(self):
+        self._call('get_accounts')
+        return SimpleNamespace(accounts=[SimpleNamespace(id='fake-account')])
+
+class _Instruments(_Service):
+
+    def trading_schedules(self, exchange='', from_=None, to=None):
+        self._call('trading_schedules')
+        return self._client.market.trading_schedules(exchange)
+
+    def __getattr__(self, method):
+        def request(*args, **kwargs):
+            self._call(method)
+            return SimpleNamespace(instruments=self._client.market.instruments(method))
+        return request
+
+class _MarketData(_Service):
+
+    def get_order_book(self, figi, depth=1):
+        self._call('get_order_book')
+        return self._client.market.order_book(figi, depth)
+
+    def get_last_prices(self, figi=()):
+        self._call('get_last_prices')
+        now = _now()
+        prices = self._client.market.prices
+        return SimpleNamespace(last_prices=[SimpleNamespace(figi=f, price=quotation(prices[f]), time=now) for f in figi])
+
+    # Минутные свечи по текущей цене на каждую минуту [from_, to); interval не учитывается
+    def get_candles(self, figi, from_=None, to=None, interval=None):
+        self._call('get_candles')
+        price = quotation(self._client.market.prices[figi])
+        start = from_.replace(second=0, microsecond=0)
+        if start < from_:
+            start += datetime.timedelta(minutes=1)
+        candles = []
+        while start < to:
+            candles.append(SimpleNamespace(time=start, open=price, high=price, low=price, close=price, volume=1, is_complete=True))
+            start += datetime.timedelta(minutes=1)
+        return SimpleNamespace(candles=candles)
+
+class _Operations(_Service):
+
+    def get_positions(self, account_id=None):
+        self._call('get_positions')
+        with self._client.market.lock:
+            return self._client.market.portfolio()
+
+class _OperationsStream(_Service):
+
+    def positions_stream(self, accounts=()):
+        self._call('positions_stream')
+        return self._client.market.positions_stream(self._client.closed)
+
+class _Orders(_Service):
+
+    def post_order(self, order_id=None, figi=None, quantity=0, account_id=None, direction=None, order_type=None, **kwargs):
+        self._call('post_order')
+        return self._client.market.post_order(order_id, figi, quantity, getattr(direction, 'name', '') == 'ORDER_DIRECTION_BUY')
+
+    def get_order_state(self, account_id=None, order_id=None):
+        self._call('get_order_state')
+        return self._client.market.order_state(order_id)
+
+    def cancel_order(self, account_id=None, order_id=None):
+        self._call('cancel_order')
+        return self._client.market.cancel_order(order_id)
+
+# Заглушка tinkoff.invest.Client: открытие канала стоит connect_latency, каждый запрос - call_latency
+# (или задержку метода из market.latency)
+class FakeClient:
+
+    def __init__(self, token=None, market: FakeMarket = None, connect_latency: float = 0.0, call_latency: float = 0.0):
+        self.market = market
+        self.connect_latency = connect_latency
+        self.call_latency = call_latency
+        self.sleep = True                                   # Асинхронный клиент ждет сам через asyncio.sleep
+        self.closed = threading.Event()                     # Закрытие канала завершает поток позиций
+        self.users = _Users(self)
+        self.instruments = _Instruments(self)
+        self.market_data = _MarketData(self)
+        self.operations = _Operations(self)
+        self.operations_stream = _OperationsStream(self)
+        self.orders = _Orders(self)
+
+    def latency(self, method: str) -> float:
+        return self.market.latency.get(method, self.call_latency)
+
+    def create_market_data_stream(self):
+        self.market.request('market_data_stream')
+        return FakeMarketDataStream(self.market)
+
+    def __enter__(self):
+        self.market.connects += 1
+        if self.connect_latency:
+            time.sleep(self.connect_latency)                # Установка канала и TLS-рукопожатие
+        return self
+
+    def __exit__(self, *exc):
+        self.closed.set()
+        return False
+
+# Асинхронная обертка над сервисом: задержка через asyncio.sleep, ответ - от синхронной заглушки
+class _AsyncService:
+
+    def __init__(self, client: FakeClient, service: _Service):
+        self._client = client
+        self._service = service
+
+    def __getattr__(self, method):
+        request = getattr(self._service, method)
+        async def call(*args, **kwargs):
+            latency = self._client.latency(method)
+            if latency:
+                await asyncio.sleep(latency)
+            return request(*args, **kwargs)
+        return call
+
+# Поток рыночных данных для async for
+class _AsyncMarketDataStream:
+
+    def __init__(self, stream: FakeMarketDataStream):
+        self._stream = stream
+        self.last_price = stream.last_price
+        self.order_book = stream.order_book
+
+    async def __aiter__(self):
+        for marketdata in self._stream:
+            yield marketdata
+            await asyncio.sleep(0)                          # Отдаем управление задачам перекладки
+
+    def stop(self):
+        self._stream.stop()
+
+# Заглушка tinkoff.invest.AsyncClient поверх той же биржи
+class FakeAsyncClient:
+
+    def __init__(self, token=None, market: FakeMarket = None, connect_latency: float = 0.0, call_latency: float = 0.0):
+        self._client = FakeClient(token, market, 0.0, call_latency)
+        self._client.sleep = False
+        self.market = market
+        self.connect_latency = connect_latency
+        self.users = _AsyncService(self._client, self._client.users)
+        self.instruments = _AsyncService(self._client, self._client.instruments)
+        self.market_data = _AsyncService(self._client, self._client.market_data)
+        self.operations = _AsyncService(self._client, self._client.operations)
+        self.orders = _AsyncService(self._client, self._client.orders)
+
+    def create_market_data_stream(self):
+        return _AsyncMarketDataStream(self._client.create_market_data_stream())
+
+    async def __aenter__(self):
+        self.market.connects += 1
+        if self.connect_latency:
+            await asyncio.sleep(self.connect_latency)
+        return self
+
+    async def __aexit__(self, *exc):
+        self._client.closed.set()
+        return False
@@ -0,0 +1,147 @@
+"""Запуск без диалогов: настройки из файла и переменных окружения, продолжение после перезапуска.
+
+    INVEST_TOKEN=t.xxx python headless.py
+    INVEST_TOKEN=t.xxx SPREAD_CONFIG=/etc/spread.json python headless.py
+
+config.json:
+    {
+        "account_id": "2000123456",
+        "pairs": [{"ticker_Ob": "SBER", "ticker_Pref": "SBERP", "price_1": 1, "price_2": 3}],
+        "state_file": "state.json",
+        "journal": true,
+        "metrics_port": 9108
+    }
+
+Вместо "pairs" можно указать "pairs_file" - путь к файлу в формате pairs.json. Переменные окружения
+перекрывают файл: INVEST_TOKEN, SPREAD_ACCOUNT_ID, SPREAD_PAIRS_FILE, SPREAD_STATE_FILE,
+SPREAD_JOURNAL (0/1), SPREAD_METRICS_PORT. Токен лучше держать только в окружении.
+
+Для быстрого запуска: если счет указан, get_accounts не вызывается; справочник инструментов
+и расписание берутся из кэша; окна статистики спреда - из снимка состояния, поэтому минутные
+свечи и numpy при перезапуске не загружаются. Если процесс упал посреди перекладки, снимаются
+только ее заявки, а если продажа успела исполниться, покупка целевой ноги доводится на первом тике пары.
+"""
+
+import functools, json, os, sys
+from typing import Optional
+
+from journal import JOURNAL, Journal
+from metrics import METRICS_PORT
+from spread_strategy import (
+    PAIRS_CONFIG_FILE,
+    ClientSession,
+    SpreadEngine,
+    create_instruments_catalog,
+    create_trading_calendar,
+    load_pairs,
+    parse_pairs,
+)
+from state_snapshot import STATE_FILE, load_state, restore_state, save_state, start_state_saver
+
+CONFIG_FILE = 'config.json'
+CONFIG_ENV = 'SPREAD_CONFIG'                            # Переменная с путем к файлу настроек
+
+# Ключ настроек -> переменная окружения, которая его перекрывает
+ENV_VARS = {
+    'token': 'INVEST_TOKEN',
+    'account_id': 'SPREAD_ACCOUNT_ID',
+    'pairs_file': 'SPREAD_PAIRS_FILE',
+    'state_file': 'SPREAD_STATE_FILE',
+    'journal': 'SPREAD_JOURNAL',
+    'metrics_port': 'SPREAD_METRICS_PORT',
+}
+
+def parse_bool(value) -> bool:
+    if isinstance(value, str):
+        return value.strip().lower() in ('1', 'true', 'yes', 'on')
+    return bool(value)
+
+# Настройки: значения по умолчанию, затем файл, затем переменные окружения
+def load_config(path: Optional[str] = None, environ=os.environ) -> dict:
+
+    explicit = path or environ.get(CONFIG_ENV)
+    path = explicit or CONFIG_FILE
+    config = {
+        'pairs_file': PAIRS_CONFIG_FILE,
+        'state_file': STATE_FILE,
+        'journal': JOURNAL,
+        'metrics_port': METRICS_PORT,
+    }
+
+    if os.path.exists(path):
+        with open(path, encoding='utf-8') as f:
+            config.update(json.load(f))
+    elif explicit:
+        raise ValueError(f"Файл настроек {path} не найден")
+
+    for key, name in ENV_VARS.items():
+        if environ.get(name):
+            config[key] = environ[name]
+
+    if not config.get('token'):
+        raise ValueError(f"Токен не задан: укажите его в переменной {ENV_VARS['token']}")
+    config['journal'] = parse_bool(config['journal'])
+    config['metrics_port'] = int(config['metrics_port'] or 0)
+    return config
+
+def resolve_account(session: ClientSession, config: dict) -> str:
+    if config.get('account_id'):
+        return str(config['account_id'])
+    Account_id = session.call('get_accounts', lambda client: client.users.get_accounts()).accounts[0].id
+    print("Account_id:", Account_id)
+    return Account_id
+
+# Движок по настройкам: без вопросов пользователю, с окнами статистики из снимка прошлого запуска
+def create_engine(config: dict, client_factory=None) -> SpreadEngine:
+
+    session = ClientSession(config['token'], client_factory) if client_factory else ClientSession(config['token'])
+    Account_id = resolve_account(session, config)
+    catalog = create_instruments_catalog(session)
+    calendar = create_trading_calendar(session)
+
+    if config.get('pairs'):
+        pairs = parse_pairs(catalog, config['pairs'], 'настроек')
+    else:
+        pairs = load_pairs(catalog, config['pairs_file'])
+    for pair in pairs:
+        print(f'{pair.name}: спред {pair.describe_thresholds()}, доля капитала {pair.allocation:.0%}')
+
+    journal = Journal() if config['journal'] else None
+    if journal is not None:
+        print('Журнал сессии:', journal.path)
+
+    engine = SpreadEngine(session, Account_id, catalog, pairs, calendar, journal)
+    engine.metrics_port = config['metrics_port']
+
+    state = load_state(config['state_file'])
+    if state is not None and state.get('account_id') == Account_id:
+        restored = restore_state(engine, state)
+        if restored:
+            print('Статистика спреда восстановлена из', config['state_file'], 'для', ', '.join(restored))
+        # Портфель загрузится уже после снятия заявок: run() начинает с полной сверки
+        for switch in state.get('switches', []):
+            engine.recover_switch(switch)
+
+    engine.checkpoint = functools.partial(save_state, engine, config['state_file'])
+    return engine
+
+def main(config_path: Optional[str] = None):
+
+    try:
+        config = load_config(config_path)
+    except (OSError, ValueError) as e:
+        print("Ошибка настроек:", str(e))
+        sys.exit(2)
+
+    engine = create_engine(config)
+    start_state_saver(engine, config['state_file'])
+    try:
+        engine.run()
+    finally:
+        save_state(engine, config['state_file'])
+        if engine.journal is not None:
+            engine.journal.close()
+
+if __name__ == '__main__':
+
+    main(sys.argv[1] if len(sys.argv) > 1 else None)
@@ -0,0 +1,273 @@
+"""Журнал торговой сессии и воспроизведение записанных сессий.
+
+Каждый запуск пишет файл journal/<дата-время>.sqlite: тики (цена и стакан бумаги),
+решения о перекладке, заявки и состояние портфеля. Горячий путь только кладет кортеж
+в очередь, в базу пишет фоновый поток пачками по JOURNAL_BATCH записей или раз в
+JOURNAL_FLUSH_INTERVAL секунд. Стаканы хранятся компактно: уровни упакованы в array('d').
+
+Воспроизведение прогоняет записанные тики через тот же SpreadEngine.check_pair с биржей-заглушкой
+вместо API, без пауз между тиками. Пороги можно переопределить, чтобы проверить изменение стратегии
+на реальной сессии:
+    python journal.py journal/20261018-095500.sqlite --price-1 0.5 --price-2 2.5
+"""
+
+import datetime, json, os, queue, threading, time
+from array import array
+from typing import Dict, List, Optional
+
+JOURNAL = True                                          # Вести журнал сессии
+JOURNAL_DIR = 'journal'
+JOURNAL_BATCH = 500                                     # Записей в одной транзакции
+JOURNAL_FLUSH_INTERVAL = 1.0                            # Не реже чем раз в столько секунд, сек
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+CREATE TABLE IF NOT EXISTS ticks (ts REAL, figi TEXT, price REAL, bids BLOB, asks BLOB);
+CREATE TABLE IF NOT EXISTS decisions (ts REAL, pair TEXT, spread REAL, decision_spread REAL, slippage REAL,
+                                      action TEXT, level_1 REAL, level_2 REAL, KObich INTEGER, KPrefa INTEGER);
+CREATE TABLE IF NOT EXISTS orders (ts REAL, order_id TEXT, figi TEXT, direction TEXT, lots_requested INTEGER,
+                                   lots_executed INTEGER, lot_size INTEGER, price REAL, commission REAL, status TEXT, latency REAL);
+CREATE TABLE IF NOT EXISTS portfolio (ts REAL, money REAL, balances TEXT);
+'''
+
+INSERTS = {
+    'ticks': 'INSERT INTO ticks VALUES (?, ?, ?, ?, ?)',
+    'decisions': 'INSERT INTO decisions VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+    'orders': 'INSERT INTO orders VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+    'portfolio': 'INSERT INTO portfolio VALUES (?, ?, ?)',
+}
+
+# Уровни стакана [(цена, кол-во), ...] <-> плоский массив float64
+def pack_levels(levels) -> bytes:
+    return array('d', [x for level in levels for x in level]).tobytes()
+
+def unpack_levels(blob: bytes):
+    values = array('d')
+    values.frombytes(blob)
+    return [(values[i], values[i + 1]) for i in range(0, len(values), 2)]
+
+def journal_path(directory: str = JOURNAL_DIR) -> str:
+    return os.path.join(directory, datetime.datetime.now().strftime('%Y%m%d-%H%M%S') + '.sqlite')
+
+class Journal:
+
+    def __init__(self, path: Optional[str] = None, batch: int = JOURNAL_BATCH, flush_interval: float = JOURNAL_FLUSH_INTERVAL):
+        self.path = path or journal_path()
+        self.batch = batch
+        self.flush_interval = flush_interval
+        self.queue = queue.SimpleQueue()
+        self.books = {}                                     # figi -> последний записанный стакан (тот же объект не пишем повторно)
+        self.written = 0
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        import sqlite3                                      # Только если журнал включен: не тормозит запуск без него
+        with sqlite3.connect(self.path) as db:
+            db.executescript(SCHEMA)
+        self.thread = threading.Thread(target=self._writer, name='journal', daemon=True)
+        self.thread.start()
+
+    # Запись в базу в своем потоке: соединение sqlite живет только здесь
+    def _writer(self):
+
+        import sqlite3
+        db = sqlite3.connect(self.path)
+        db.execute('PRAGMA journal_mode=WAL')
+        db.execute('PRAGMA synchronous=NORMAL')
+        pending: Dict[str, List[tuple]] = {table: [] for table in INSERTS}
+        count = 0
+        deadline = time.monotonic() + self.flush_interval
+        running = True
+
+        while running:
+            try:
+                item = self.queue.get(timeout=max(0.0, deadline - time.monotonic()))
+                if item is None:
+                    running = False                         # close(): дописываем остаток и выходим
+                else:
+                    table, row = item
+                    if table == 'meta':
+                        db.execute('INSERT OR REPLACE INTO meta VALUES (?, ?)', row)
+                    else:
+                        pending[table].append(row)
+                        count += 1
+            except queue.Empty:
+                pass
+
+            if count >= self.batch or time.monotonic() >= deadline or not running:
+                try:
+                    with db:
+                        for table, rows in pending.items():
+                            if rows:
+                                db.executemany(INSERTS[table], [self._encode(table, row) for row in rows])
+                    self.written += count
+                except sqlite3.Error as e:
+                    print(f"Не удалось записать журнал: {e}")
+                for rows in pending.values():
+                    rows.clear()
+                count = 0
+                deadline = time.monotonic() + self.flush_interval
+
+        db.close()
+
+    # Упаковка стаканов идет в потоке записи, а не на горячем пути
+    @staticmethod
+    def _encode(table: str, row: tuple) -> tuple:
+        if table == 'ticks':
+            ts, figi, price, book = row
+            if book is None:
+                return ts, figi, price, None, None
+            return ts, figi, price, pack_levels(book[0]), pack_levels(book[1])
+        return row
+
+    def meta(self, key: str, value):
+        self.queue.put(('meta', (key, json.dumps(value, ensure_ascii=False))))
+
+    # Тик бумаги: цена и стакан, если он изменился с прошлой записи
+    def tick(self, figi: str, price: float, book=None, ts: Optional[float] = None):
+        if book is not None:
+            if self.books.get(figi) is book:
+                book = None
+            else:
+                self.books[figi] = book
+        self.queue.put(('ticks', (ts or time.time(), figi, price, book)))
+
+    def decision(self, pair, spread, decision_spread, slippage, action, KObich, KPrefa, ts: Optional[float] = None):
+        level_1, level_2 = pair.levels or (None, None)
+        self.queue.put(('decisions', (ts or time.time(), pair.name, spread, decision_spread, slippage, action,
+                                      level_1, level_2, KObich, KPrefa)))
+
+    def order(self, result, ts: Optional[float] = None):
+        self.queue.put(('orders', (ts or time.time(), result.order_id, result.figi, getattr(result.direction, 'name', str(result.direction)),
+                                   result.lots_requested, result.lots_executed, result.lot_size, result.price,
+                                   result.commission, result.status, result.latency)))
+
+    def portfolio(self, money: float, balances: Dict[str, int], ts: Optional[float] = None):
+        self.queue.put(('portfolio', (ts or time.time(), money, json.dumps(balances))))
+
+    def close(self):
+        self.queue.put(None)
+        self.thread.join()
+
+# Настройки пар для журнала: по ним сессия воспроизводится без справочника инструментов
+def pairs_meta(pairs) -> List[dict]:
+    return [{
+        'info_Ob': pair.info_Ob,
+        'info_Pref': pair.info_Pref,
+        'price_1': pair.price_1,
+        'price_2': pair.price_2,
+        'allocation': pair.allocation,
+        'threshold': pair.threshold,
+    } for pair in pairs]
+
+def read_meta(db) -> dict:
+    return {key: json.loads(value) for key, value in db.execute('SELECT key, value FROM meta')}
+
+def replay(path: str, price_1: Optional[float] = None, price_2: Optional[float] = None,
+           threshold: Optional[str] = None, quiet: bool = True) -> dict:
+
+    import contextlib, functools, io, sqlite3
+
+    import spread_strategy as strategy
+    from fake_invest import FakeClient, FakeMarket
+    from resilience import RATE_LIMITS, Resilience
+
+    # Движок без запросов цен: цены и стаканы приходят только из журнала, время - по тикам
+    class ReplayEngine(strategy.SpreadEngine):
+
+        clock = 0.0
+        switches = 0                                        # Решений о перекладке, как в таблице decisions
+
+        def refresh_prices(self, figis=None):
+            pass
+
+        def switch_legs(self, *args):
+            self.switches += 1
+            super().switch_legs(*args)
+
+        def now(self):
+            return self.clock
+
+    db = sqlite3.connect(path)
+    meta = read_meta(db)
+    first = db.execute('SELECT money, balances FROM portfolio ORDER BY rowid LIMIT 1').fetchone()
+    money, balances = (first[0], json.loads(first[1])) if first else (100000.0, {})
+
+    pairs = []
+    lot_sizes = {}
+    catalog = strategy.InstrumentCatalog()
+    catalog.update_type('shares', [dict(info, type='shares') for item in meta['pairs'] for info in (item['info_Ob'], item['info_Pref'])])
+    for item in meta['pairs']:
+        pair = strategy.SpreadPair(item['info_Ob'], item['info_Pref'],
+                                   item['price_1'] if price_1 is None else price_1,
+                                   item['price_2'] if price_2 is None else price_2,
+                                   item['allocation'], threshold or item['threshold'])
+        pairs.append(pair)
+        lot_sizes[pair.figi_Ob] = item['info_Ob']['lot_size']
+        lot_sizes[pair.figi_Pref] = item['info_Pref']['lot_size']
+
+    # Заявки исполняются сразу по последней записанной цене
+    market = FakeMarket({figi: 0.0 for figi in lot_sizes}, money=money, positions=balances, lot_sizes=lot_sizes)
+    # Лимиты брокера при воспроизведении не нужны: заглушка отвечает сразу
+    resilience = Resilience(rate_limits={method: 10 ** 9 for method in RATE_LIMITS})
+    session = strategy.ClientSession('replay', client_factory=functools.partial(FakeClient, market=market), resilience=resilience)
+    engine = ReplayEngine(session, 'replay', catalog, pairs)
+    engine.orders.poll_interval = 0
+    with contextlib.redirect_stdout(io.StringIO()):
+        engine.refresh_portfolio()
+
+    ticks = 0
+    started = time.perf_counter()
+    first_ts = last_ts = None
+    out = io.StringIO() if quiet else None
+    with contextlib.redirect_stdout(out) if quiet else contextlib.nullcontext():
+        for ts, figi, price, bids, asks in db.execute('SELECT ts, figi, price, bids, asks FROM ticks ORDER BY rowid'):
+            if figi not in engine.pairs_by_figi:
+                continue
+            first_ts = first_ts or ts
+            last_ts = ts
+            engine.clock = ts
+            engine.prices[figi] = price
+            engine.price_times[figi] = ts
+            market.prices[figi] = price
+            if bids is not None:
+                engine.books[figi] = (unpack_levels(bids), unpack_levels(asks))
+            if len(engine.prices) < len(engine.figis):
+                continue                                    # Ждем первую цену каждой бумаги
+            engine.check_pair(engine.pairs_by_figi[figi])
+            ticks += 1
+    elapsed = time.perf_counter() - started
+
+    # Сравниваем только перекладки между ногами: первая покупка на деньги перекладкой не считается
+    recorded = db.execute('SELECT COUNT(*) FROM decisions WHERE action IN (?, ?)',
+                          (strategy.SWITCH_TO_OB, strategy.SWITCH_TO_PREF)).fetchone()[0]
+    db.close()
+    engine.refresh_portfolio()
+    equity = engine.money() + sum(engine.balance(figi) * engine.prices.get(figi, 0) for figi in engine.figis)
+    return {
+        'ticks': ticks,
+        'replay_seconds': elapsed,
+        'session_seconds': (last_ts - first_ts) if ticks else 0.0,
+        'speedup': (last_ts - first_ts) / elapsed if ticks and elapsed else 0.0,
+        'switches_recorded': recorded,
+        'switches_replayed': engine.switches,
+        'orders_replayed': len(market.orders),
+        'equity': equity,
+    }
+
+if __name__ == '__main__':
+
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Воспроизведение записанной торговой сессии')
+    parser.add_argument('path', help='Файл журнала journal/*.sqlite')
+    parser.add_argument('--price-1', type=float, help='Переопределить нижний порог всех пар')
+    parser.add_argument('--price-2', type=float, help='Переопределить верхний порог всех пар')
+    parser.add_argument('--threshold', choices=('abs', 'z', 'percentile'), help='Переопределить режим порогов')
+    parser.add_argument('--verbose', action='store_true', help='Печатать вывод стратегии')
+    args = parser.parse_args()
+
+    result = replay(args.path, args.price_1, args.price_2, args.threshold, quiet=not args.verbose)
+    print(f"Тиков: {result['ticks']}, сессия {result['session_seconds']:.0f} с воспроизведена за {result['replay_seconds']:.2f} с "
+          f"(x{result['speedup']:.0f})")
+    print(f"Перекладок в записи: {result['switches_recorded']}, при воспроизведении: {result['switches_replayed']}, "
+          f"заявок: {result['orders_replayed']}")
+    print(f"Капитал в конце: {result['equity']:.2f}")
@@ -0,0 +1,206 @@
+"""Метрики задержек горячего пути стратегии.
+
+Гистограммы с фиксированными границами корзин и счетчики в памяти процесса: запись одного
+значения - бинарный поиск корзины и пара сложений, поэтому метрики можно держать включенными
+в бою. Наружу метрики отдаются в текстовом формате Prometheus по HTTP (/metrics) и/или
+периодически сбрасываются в JSON-файл.
+"""
+
+import bisect, json, os, threading, time
+from contextlib import contextmanager
+from typing import Dict, Optional, Tuple
+
+METRICS_PORT = 9108                                     # Порт HTTP-экспорта метрик, 0 - не запускать
+METRICS_DUMP_FILE = None                                # Файл для периодического сброса метрик в JSON
+METRICS_DUMP_INTERVAL = 60                              # Период сброса в JSON, сек
+
+# Границы корзин задержек, сек: от 10 мкс (решение по спреду) до 2 минут (перекладка с ожиданием исполнения)
+LATENCY_BUCKETS = (0.00001, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+INF_LABEL = 'le="+Inf"'
+
+def _key(name: str, labels: Dict[str, str]) -> Tuple[str, Tuple[Tuple[str, str], ...]]:
+    return name, tuple(sorted(labels.items()))
+
+def _render_labels(labels, extra: str = '') -> str:
+    items = [f'{k}="{v}"' for k, v in labels]
+    if extra:
+        items.append(extra)
+    return '{' + ','.join(items) + '}' if items else ''
+
+class Histogram:
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)         # Последняя корзина - все, что больше верхней границы
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+        self.lock = threading.Lock()
+
+    def observe(self, value: float):
+        i = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            self.counts[i] += 1
+            self.count += 1
+            self.sum += value
+            if value > self.max:
+                self.max = value
+
+    # Оценка квантиля по корзинам: верхняя граница корзины, в которую он попал
+    def quantile(self, q: float) -> Optional[float]:
+        if not self.count:
+            return None
+        rank = q * self.count
+        total = 0
+        for bound, count in zip(self.buckets, self.counts):
+            total += count
+            if total >= rank:
+                return bound
+        return self.max
+
+    def snapshot(self) -> Dict[str, object]:
+        return {
+            'count': self.count,
+            'sum': round(self.sum, 6),
+            'max': round(self.max, 6),
+            'p50': self.quantile(0.5),
+            'p90': self.quantile(0.9),
+            'p99': self.quantile(0.99),
+        }
+
+class Metrics:
+
+    def __init__(self):
+        self.histograms: Dict[tuple, Histogram] = {}
+        self.counters: Dict[tuple, float] = {}
+        self.lock = threading.Lock()
+        self.started = time.time()
+
+    def histogram(self, name: str, **labels) -> Histogram:
+        key = _key(name, labels)
+        histogram = self.histograms.get(key)
+        if histogram is None:
+            with self.lock:
+                histogram = self.histograms.setdefault(key, Histogram())
+        return histogram
+
+    def observe(self, name: str, value: float, **labels):
+        self.histogram(name, **labels).observe(value)
+
+    def inc(self, name: str, value: float = 1, **labels):
+        key = _key(name, labels)
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    # Замер длительности блока: with METRICS.timer('refresh_prices_seconds'): ...
+    @contextmanager
+    def timer(self, name: str, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - started, **labels)
+
+    # Текстовый формат Prometheus
+    def render(self) -> str:
+        lines = []
+        with self.lock:
+            counters = sorted(self.counters.items())
+            histograms = sorted(self.histograms.items())
+        typed = set()
+        for (name, labels), value in counters:
+            if name not in typed:
+                typed.add(name)
+                lines.append(f'# TYPE {name} counter')
+            lines.append(f'{name}{_render_labels(labels)} {value}')
+        for (name, labels), histogram in histograms:
+            if name not in typed:
+                typed.add(name)
+                lines.append(f'# TYPE {name} histogram')
+            total = 0
+            for bound, count in zip(histogram.buckets, histogram.counts):
+                total += count
+                le = 'le="%s"' % bound
+                lines.append(f'{name}_bucket{_render_labels(labels, le)} {total}')
+            lines.append(f'{name}_bucket{_render_labels(labels, INF_LABEL)} {histogram.count}')
+            lines.append(f'{name}_sum{_render_labels(labels)} {histogram.sum}')
+            lines.append(f'{name}_count{_render_labels(labels)} {histogram.count}')
+        return '\n'.join(lines) + '\n'
+
+    # Сводка для JSON и печати: по гистограммам - число замеров, сумма, максимум и квантили
+    def snapshot(self) -> Dict[str, object]:
+        with self.lock:
+            counters = list(self.counters.items())
+            histograms = list(self.histograms.items())
+        return {
+            'time': time.time(),
+            'uptime': round(time.time() - self.started, 1),
+            'counters': {name + _render_labels(labels): value for (name, labels), value in counters},
+            'histograms': {name + _render_labels(labels): h.snapshot() for (name, labels), h in histograms},
+        }
+
+    def dump(self, path: str):
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.snapshot(), f, ensure_ascii=False, indent=1)
+        os.replace(tmp_path, path)
+
+    # HTTP-сервер метрик в фоновом потоке: GET /metrics - Prometheus, GET /metrics.json - сводка
+    def serve(self, port: int = METRICS_PORT, host: str = '127.0.0.1'):
+
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer   # ~30 мс импорта, нужен только с экспортом
+
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+
+            def do_GET(self):
+                if self.path == '/metrics.json':
+                    body = json.dumps(metrics.snapshot(), ensure_ascii=False).encode('utf-8')
+                    content_type = 'application/json; charset=utf-8'
+                else:
+                    body = metrics.render().encode('utf-8')
+                    content_type = 'text/plain; version=0.0.4; charset=utf-8'
+                self.send_response(200)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass                                        # Не засоряем вывод стратегии запросами сборщика
+
+        server = ThreadingHTTPServer((host, port), Handler)
+        threading.Thread(target=server.serve_forever, name='metrics-http', daemon=True).start()
+        return server
+
+    # Периодический сброс в JSON в фоновом потоке
+    def start_dump(self, path: str, interval: float = METRICS_DUMP_INTERVAL) -> threading.Thread:
+
+        def loop():
+            while True:
+                time.sleep(interval)
+                try:
+                    self.dump(path)
+                except OSError as e:
+                    print(f"Не удалось сохранить метрики: {e}")
+
+        thread = threading.Thread(target=loop, name='metrics-dump', daemon=True)
+        thread.start()
+        return thread
+
+# Метрики процесса: общие для всех модулей стратегии
+METRICS = Metrics()
+
+# Запуск экспорта по настройкам модуля; ошибка запуска (порт занят) не останавливает торговлю
+def start_export(port: int = METRICS_PORT, dump_file: Optional[str] = METRICS_DUMP_FILE,
+                 dump_interval: float = METRICS_DUMP_INTERVAL):
+    if port:
+        try:
+            METRICS.serve(port)
+            print(f'Метрики: http://127.0.0.1:{port}/metrics')
+        except OSError as e:
+            print(f"Не удалось запустить сервер метрик на порту {port}: {e}")
+    if dump_file:
+        METRICS.start_dump(dump_file, dump_interval)
@@ -0,0 +1,253 @@
+"""Отслеживание заявок от выставления до исполнения.
+
+Вместо фиксированной паузы после post_order состояние заявки опрашивается через get_order_state
+с коротким интервалом, пока она не исполнится, не будет отклонена или отменена. Если заявка
+не исполнилась за отведенное время, остаток снимается, а частичное исполнение учитывается.
+"""
+
+import time, uuid
+from typing import Dict, Optional
+
+from tinkoff.invest import OrderDirection, OrderType, Quotation
+
+from metrics import METRICS
+
+ORDER_POLL_INTERVAL = 0.2                               # Период опроса состояния заявки, сек
+ORDER_TIMEOUT = 10                                      # Сколько ждем исполнения, потом снимаем остаток, сек
+
+# Итоговые статусы: дальше заявка уже не изменится
+FINAL_STATUSES = (
+    'EXECUTION_REPORT_STATUS_FILL',
+    'EXECUTION_REPORT_STATUS_REJECTED',
+    'EXECUTION_REPORT_STATUS_CANCELLED',
+)
+
+def money_to_float(money) -> float:
+    return money.units + money.nano * 1e-9 if money is not None else 0.0
+
+def float_to_quotation(price: float) -> Quotation:
+    units = int(price)
+    return Quotation(units=units, nano=int(round((price - units) * 1e9)))
+
+# Результат заявки: сколько исполнилось, по какой средней цене и за какое время
+class OrderResult:
+
+    def __init__(self, order_id, figi, direction, lots_requested, lot_size):
+        self.order_id = order_id
+        self.figi = figi
+        self.direction = direction
+        self.lots_requested = lots_requested
+        self.lot_size = lot_size
+        self.lots_executed = 0
+        self.price = 0.0                                    # Средняя цена одной бумаги
+        self.commission = 0.0
+        self.status = 'EXECUTION_REPORT_STATUS_NEW'
+        self.started = time.perf_counter()
+        self.finished = None
+
+    @property
+    def quantity(self):
+        return self.lots_executed * self.lot_size
+
+    # Сумма сделки без комиссии
+    @property
+    def amount(self):
+        return self.quantity * self.price
+
+    @property
+    def filled(self):
+        return self.lots_requested > 0 and self.lots_executed == self.lots_requested
+
+    @property
+    def latency(self):
+        return (self.finished or time.perf_counter()) - self.started
+
+    # state - ответ post_order или get_order_state. В ответе post_order executed_order_price - средняя
+    # цена одной бумаги, а в OrderState - сумма всей заявки; средняя цена там в average_position_price
+    def update(self, state):
+        self.status = getattr(state.execution_report_status, 'name', str(state.execution_report_status))
+        self.lots_executed = state.lots_executed
+        if hasattr(state, 'average_position_price'):
+            price = money_to_float(state.average_position_price)
+            if not price and self.quantity:
+                price = money_to_float(state.executed_order_price) / self.quantity
+        else:
+            price = money_to_float(getattr(state, 'executed_order_price', None))
+        if price:
+            self.price = price
+        self.commission = money_to_float(getattr(state, 'executed_commission', None))
+
+class OrderManager:
+
+    def __init__(self, session, Account_id, poll_interval: float = ORDER_POLL_INTERVAL, timeout: float = ORDER_TIMEOUT):
+        self.session = session
+        self.Account_id = Account_id
+        self.poll_interval = poll_interval
+        self.timeout = timeout
+
+    # Повторы идут с тем же order_id: если заявка уже дошла до биржи, второй не будет
+    def post(self, order_id, figi, lots, direction, price: Optional[float] = None):
+        try:
+            return self.session.call('post_order', lambda client: client.orders.post_order(
+                order_id=order_id,
+                figi=figi,
+                quantity=int(lots),
+                account_id=self.Account_id,
+                direction=direction,
+                price=float_to_quotation(price) if price else None,
+                order_type=OrderType.ORDER_TYPE_LIMIT if price else OrderType.ORDER_TYPE_BESTPRICE
+            ))
+        except Exception as e:
+            print(f"Не удалось создать ордер: {e}")
+
+    def state(self, order_id):
+        try:
+            return self.session.call('get_order_state', lambda client: client.orders.get_order_state(account_id=self.Account_id, order_id=order_id))
+        except Exception as e:
+            print(f"Ошибка при получении состояния заявки: {e}")
+
+    def cancel(self, order_id):
+        try:
+            self.session.call('cancel_order', lambda client: client.orders.cancel_order(account_id=self.Account_id, order_id=order_id))
+        except Exception as e:
+            # Заявка могла успеть исполниться: итог все равно берем из get_order_state
+            print(f"Ошибка при отмене заявки: {e}")
+
+    # Снимает заявки order_ids, которые еще не в итоговом статусе: после падения процесса посреди
+    # перекладки ее остаток не должен исполниться без нашего ведома. Другие заявки счета не трогаем.
+    # Возвращает, сколько лотов каждой заявки исполнилось (None - состояние получить не удалось)
+    def cancel_orders(self, order_ids) -> Dict[str, Optional[int]]:
+        executed = {}
+        for order_id in order_ids:
+            state = self.state(order_id)
+            status = getattr(state.execution_report_status, 'name', str(state.execution_report_status)) if state is not None else None
+            if status not in FINAL_STATUSES:
+                if state is not None:
+                    print(f'Снимаем заявку {order_id}, оставшуюся с прошлого запуска: исполнено {state.lots_executed} из {state.lots_requested} лотов')
+                self.cancel(order_id)
+                state = self.state(order_id)
+            executed[order_id] = state.lots_executed if state is not None else None
+        return executed
+
+    # Выставляет заявку и ждет ее итогового статуса. price - лимитная цена, без нее заявка по лучшей цене.
+    # order_id можно выдать заранее, чтобы запомнить его до выставления заявки
+    def execute(self, figi, lots, direction, lot_size: int = 1, price: Optional[float] = None,
+                order_id: Optional[str] = None) -> OrderResult:
+
+        order_id = order_id or str(uuid.uuid4())
+        result = OrderResult(order_id, figi, direction, int(lots), lot_size)
+        if result.lots_requested <= 0:
+            result.status = 'EXECUTION_REPORT_STATUS_REJECTED'
+            result.finished = time.perf_counter()
+            return result
+
+        response = self.post(order_id, figi, result.lots_requested, direction, price)
+        if response is None:
+            # Ответ мог потеряться, а заявка - дойти до биржи: проверяем по тому же order_id
+            response = self.state(order_id)
+        if response is None:
+            result.status = 'EXECUTION_REPORT_STATUS_REJECTED'
+            result.finished = time.perf_counter()
+            return result
+        result.update(response)
+
+        deadline = result.started + self.timeout
+        while result.status not in FINAL_STATUSES:
+
+            if time.perf_counter() >= deadline:
+                # Не дождались: снимаем остаток и фиксируем то, что успело исполниться
+                self.cancel(order_id)
+                state = self.state(order_id)
+                if state is not None:
+                    result.update(state)
+                break
+
+            time.sleep(self.poll_interval)
+            state = self.state(order_id)
+            if state is not None:
+                result.update(state)
+
+        return finish(result)
+
+# Итог заявки: метрики и сообщение об исполнении
+def finish(result: OrderResult) -> OrderResult:
+    result.finished = time.perf_counter()
+    METRICS.observe('order_seconds', result.latency)
+    METRICS.inc('orders_total', status=result.status)
+
+    action = 'Купили' if result.direction == OrderDirection.ORDER_DIRECTION_BUY else 'Продали'
+    print(f'{action} {result.quantity} шт. из {result.lots_requested * result.lot_size} по средней цене {result.price:.2f} '
+          f'за {result.latency:.2f} с ({result.status})')
+    return result
+
+# То же для асинхронного ядра: session - AsyncClientSession, ожидание исполнения не держит цикл событий
+class AsyncOrderManager:
+
+    def __init__(self, session, Account_id, poll_interval: float = ORDER_POLL_INTERVAL, timeout: float = ORDER_TIMEOUT):
+        self.session = session
+        self.Account_id = Account_id
+        self.poll_interval = poll_interval
+        self.timeout = timeout
+
+    async def post(self, order_id, figi, lots, direction, price: Optional[float] = None):
+        try:
+            return await self.session.call('post_order', lambda client: client.orders.post_order(
+                order_id=order_id,
+                figi=figi,
+                quantity=int(lots),
+                account_id=self.Account_id,
+                direction=direction,
+                price=float_to_quotation(price) if price else None,
+                order_type=OrderType.ORDER_TYPE_LIMIT if price else OrderType.ORDER_TYPE_BESTPRICE
+            ))
+        except Exception as e:
+            print(f"Не удалось создать ордер: {e}")
+
+    async def state(self, order_id):
+        try:
+            return await self.session.call('get_order_state', lambda client: client.orders.get_order_state(account_id=self.Account_id, order_id=order_id))
+        except Exception as e:
+            print(f"Ошибка при получении состояния заявки: {e}")
+
+    async def cancel(self, order_id):
+        try:
+            await self.session.call('cancel_order', lambda client: client.orders.cancel_order(account_id=self.Account_id, order_id=order_id))
+        except Exception as e:
+            print(f"Ошибка при отмене заявки: {e}")
+
+    async def execute(self, figi, lots, direction, lot_size: int = 1, price: Optional[float] = None) -> OrderResult:
+
+        import asyncio                                      # Нужен только асинхронному ядру: синхронный запуск его не грузит
+
+        order_id = str(uuid.uuid4())
+        result = OrderResult(order_id, figi, direction, int(lots), lot_size)
+        if result.lots_requested <= 0:
+            result.status = 'EXECUTION_REPORT_STATUS_REJECTED'
+            result.finished = time.perf_counter()
+            return result
+
+        response = await self.post(order_id, figi, result.lots_requested, direction, price)
+        if response is None:
+            response = await self.state(order_id)
+        if response is None:
+            result.status = 'EXECUTION_REPORT_STATUS_REJECTED'
+            result.finished = time.perf_counter()
+            return result
+        result.update(response)
+
+        deadline = result.started + self.timeout
+        while result.status not in FINAL_STATUSES:
+
+            if time.perf_counter() >= deadline:
+                await self.cancel(order_id)
+                state = await self.state(order_id)
+                if state is not None:
+                    result.update(state)
+                break
+
+            await asyncio.sleep(self.poll_interval)
+            state = await self.state(order_id)
+            if state is not None:
+                result.update(state)
+
+        return finish(result)
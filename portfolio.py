@@ -0,0 +1,100 @@
+"""Состояние портфеля в памяти: деньги и остатки по бумагам.
+
+Портфель один раз загружается через get_positions, дальше обновляется по потоку позиций
+(operations_stream.positions_stream) и по исполнениям наших же заявок. Остаток по ноге
+берется из словаря за O(1). Полная сверка с get_positions идет редко по таймеру или сразу,
+если модель могла разойтись с брокером: заявка с неизвестным итогом, отрицательный остаток,
+обрыв потока позиций.
+"""
+
+import threading, time
+from typing import Dict, Optional
+
+from tinkoff.invest import OrderDirection
+
+from order_manager import FINAL_STATUSES, money_to_float
+
+PORTFOLIO_RESYNC_INTERVAL = 600                         # Период полной сверки с get_positions, сек
+MONEY_CURRENCY = 'rub'                                  # Валюта, в которой торгуем
+
+class PortfolioState:
+
+    def __init__(self, resync_interval: float = PORTFOLIO_RESYNC_INTERVAL):
+        self.resync_interval = resync_interval
+        self.balances: Dict[str, int] = {}                  # figi -> кол-во бумаг
+        self.money = 0.0                                    # Свободные деньги в рублях
+        self.synced_at: Optional[float] = None              # Когда была последняя полная сверка
+        self.dirty = True                                   # Модель могла разойтись с брокером
+        self.drifts = 0                                     # Сколько раз сверка нашла расхождение
+        self.lock = threading.Lock()                        # Поток позиций обновляет модель из своего потока
+
+    def balance(self, figi: str) -> int:
+        return self.balances.get(figi, 0)
+
+    # Нужна ли полная сверка: модель помечена как недостоверная или давно не сверялась
+    def needs_sync(self) -> bool:
+        return self.dirty or self.synced_at is None or time.monotonic() - self.synced_at >= self.resync_interval
+
+    def invalidate(self, reason: str):
+        if not self.dirty:
+            print(f'Портфель будет сверен с брокером: {reason}')
+        self.dirty = True
+
+    # Полная загрузка из ответа get_positions. Возвращает True, если модель расходилась с брокером
+    def load(self, PositionResponse) -> bool:
+
+        money = 0.0
+        for item in PositionResponse.money:
+            if getattr(item, 'currency', MONEY_CURRENCY) == MONEY_CURRENCY:
+                money = money_to_float(item)
+        balances = {security.figi: security.balance for security in PositionResponse.securities if security.balance}
+
+        with self.lock:
+            drift = self.synced_at is not None and (balances != self.balances or abs(money - self.money) >= 1)
+            if drift:
+                self.drifts += 1
+                print(f'Расхождение портфеля: деньги {self.money:.2f} -> {money:.2f}, бумаги {self.balances} -> {balances}')
+            self.balances = balances
+            self.money = money
+            self.synced_at = time.monotonic()
+            self.dirty = False
+        return drift
+
+    # Сообщение потока позиций: в нем текущие (не приращения) остатки изменившихся позиций
+    def apply_stream(self, position):
+
+        with self.lock:
+            for item in getattr(position, 'money', None) or []:
+                value = item.available_value
+                if value.currency == MONEY_CURRENCY:
+                    self.money = money_to_float(value)
+            for security in getattr(position, 'securities', None) or []:
+                if security.balance:
+                    self.balances[security.figi] = security.balance
+                else:
+                    self.balances.pop(security.figi, None)
+
+    # Остатки до заявки: исполнение накладывается на них, а не на текущее значение,
+    # поэтому если поток позиций уже прислал итог той же сделки, он не учтется дважды
+    def snapshot(self, figi: str):
+        with self.lock:
+            return self.balance(figi), self.money
+
+    # Исполнение нашей заявки (OrderResult) поверх остатков до нее
+    def apply_fill(self, result, before):
+
+        balance, money = before
+        sign = 1 if result.direction == OrderDirection.ORDER_DIRECTION_BUY else -1
+        with self.lock:
+            balance += sign * result.quantity
+            money -= sign * result.amount + result.commission
+            if balance:
+                self.balances[result.figi] = balance
+            else:
+                self.balances.pop(result.figi, None)
+            self.money = money
+
+        if balance < 0 or money < 0:
+            self.invalidate(f'отрицательный остаток по {result.figi}')
+        elif result.status not in FINAL_STATUSES:
+            self.invalidate(f'итог заявки {result.order_id} неизвестен')
@@ -0,0 +1,181 @@
+"""Общий слой устойчивости для всех запросов к API.
+
+Экспоненциальная задержка с джиттером между повторами, ограничение частоты запросов
+по каждому методу (token bucket по лимитам брокера) и автомат-предохранитель на каждый
+сервис: после серии ошибок подряд запросы сразу отклоняются, пока сервис не остынет.
+"""
+
+import random, threading, time
+from typing import Callable, Dict, Optional
+
+from metrics import METRICS
+
+# Лимиты брокера, запросов в минуту на метод (лимитная политика Tinkoff Invest API)
+RATE_LIMITS = {
+    'get_accounts': 100,
+    'shares': 200,
+    'bonds': 200,
+    'etfs': 200,
+    'currencies': 200,
+    'futures': 200,
+    'trading_schedules': 200,
+    'get_order_book': 600,
+    'get_last_prices': 600,
+    'get_candles': 300,
+    'get_positions': 200,
+    'post_order': 300,
+    'get_order_state': 200,
+    'cancel_order': 100,
+}
+DEFAULT_RATE_LIMIT = 100
+
+# Сервис, к которому относится метод: предохранитель срабатывает на весь сервис
+SERVICES = {
+    'get_accounts': 'users',
+    'shares': 'instruments',
+    'bonds': 'instruments',
+    'etfs': 'instruments',
+    'currencies': 'instruments',
+    'futures': 'instruments',
+    'trading_schedules': 'instruments',
+    'get_order_book': 'market_data',
+    'get_last_prices': 'market_data',
+    'get_candles': 'market_data',
+    'get_positions': 'operations',
+    'post_order': 'orders',
+    'get_order_state': 'orders',
+    'cancel_order': 'orders',
+}
+
+# Ошибки, которые имеет смысл повторять: сеть, перегрузка, превышение лимита
+RETRYABLE_CODES = ('UNAVAILABLE', 'UNKNOWN', 'INTERNAL', 'CANCELLED', 'DEADLINE_EXCEEDED', 'RESOURCE_EXHAUSTED')
+
+MAX_ATTEMPTS = 8
+BACKOFF_BASE = 0.05                                     # Первая задержка, сек
+BACKOFF_MAX = 5.0                                       # Потолок задержки, сек
+FAILURE_THRESHOLD = 5                                   # Ошибок подряд до размыкания предохранителя
+RESET_TIMEOUT = 30.0                                    # Сколько сервис "остывает", сек
+
+class CircuitOpenError(Exception):
+    pass
+
+def error_code(e: Exception) -> Optional[str]:
+    code = getattr(e, 'code', None)
+    code = code() if callable(code) else code
+    return getattr(code, 'name', None)
+
+def is_retryable(e: Exception) -> bool:
+    return error_code(e) in RETRYABLE_CODES or 'Stream removed' in str(e)
+
+# Полный джиттер: случайная задержка от 0 до base * 2^attempt, не больше потолка
+def backoff_delay(attempt: int, base: float = BACKOFF_BASE, max_delay: float = BACKOFF_MAX) -> float:
+    return random.uniform(0, min(max_delay, base * 2 ** attempt))
+
+class TokenBucket:
+
+    def __init__(self, rate_per_minute: float, capacity: Optional[float] = None):
+        self.rate = rate_per_minute / 60.0                  # Токенов в секунду
+        self.capacity = capacity if capacity is not None else max(1.0, rate_per_minute / 10)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    # Забирает токен и возвращает, сколько нужно подождать перед запросом (0 - можно сразу)
+    def reserve(self) -> float:
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= 1
+            return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+class CircuitBreaker:
+
+    def __init__(self, failure_threshold: int = FAILURE_THRESHOLD, reset_timeout: float = RESET_TIMEOUT):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self.lock = threading.Lock()
+
+    # Пока предохранитель разомкнут, запросы не идут; по истечении reset_timeout пропускаем пробный
+    def allow(self, name: str):
+        with self.lock:
+            if self.opened_at is None:
+                return
+            if time.monotonic() - self.opened_at < self.reset_timeout:
+                raise CircuitOpenError(f"Сервис {name} временно недоступен, запросы приостановлены")
+            self.opened_at = time.monotonic()               # Следующий пробный запрос - только через reset_timeout
+
+    def success(self):
+        with self.lock:
+            self.failures = 0
+            self.opened_at = None
+
+    def failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+
+class Resilience:
+
+    def __init__(self, rate_limits: Dict[str, int] = RATE_LIMITS, max_attempts: int = MAX_ATTEMPTS):
+        self.rate_limits = rate_limits
+        self.max_attempts = max_attempts
+        self.buckets: Dict[str, TokenBucket] = {}
+        self.breakers: Dict[str, CircuitBreaker] = {}
+        self.retries = 0                                    # Всего повторов за время работы
+
+    def bucket(self, method: str) -> TokenBucket:
+        if method not in self.buckets:
+            self.buckets[method] = TokenBucket(self.rate_limits.get(method, DEFAULT_RATE_LIMIT))
+        return self.buckets[method]
+
+    def breaker(self, method: str) -> CircuitBreaker:
+        service = SERVICES.get(method, method)
+        if service not in self.breakers:
+            self.breakers[service] = CircuitBreaker()
+        return self.breakers[service]
+
+    # Перед запросом: проверка предохранителя и сколько подождать по лимиту
+    def before_call(self, method: str) -> float:
+        try:
+            self.breaker(method).allow(SERVICES.get(method, method))
+        except CircuitOpenError:
+            METRICS.inc('api_circuit_open_total', method=method)
+            raise
+        wait = self.bucket(method).reserve()
+        if wait:
+            METRICS.inc('api_throttled_seconds_total', wait, method=method)
+        return wait
+
+    # После ошибки: задержка до повтора или исключение, если повторять нельзя
+    def after_failure(self, method: str, e: Exception, attempt: int) -> float:
+        if not is_retryable(e):
+            raise e
+        self.breaker(method).failure()
+        if attempt + 1 >= self.max_attempts:
+            raise e
+        self.retries += 1
+        METRICS.inc('api_retries_total', method=method, code=error_code(e))
+        # При превышении лимита брокер сообщает, через сколько секунд лимит обновится
+        reset = getattr(getattr(e, 'metadata', None), 'ratelimit_reset', None)
+        if error_code(e) == 'RESOURCE_EXHAUSTED' and reset:
+            return float(reset) + backoff_delay(0)
+        return backoff_delay(attempt)
+
+    def call(self, method: str, fn: Callable, on_error: Optional[Callable] = None):
+        for attempt in range(self.max_attempts):
+            wait = self.before_call(method)
+            if wait:
+                time.sleep(wait)
+            try:
+                result = fn()
+            except Exception as e:
+                if on_error is not None:
+                    on_error(e)
+                time.sleep(self.after_failure(method, e, attempt))
+                continue
+            self.breaker(method).success()
+            return result
@@ -0,0 +1,268 @@
+"""Скользящая статистика спреда пары за последние наблюдения.
+
+Наблюдения хранятся в кольцевом буфере array('d') фиксированного размера, поэтому память
+не растет, сколько бы недель ни работал скрипт. Среднее и стандартное отклонение считаются
+по накопленным суммам за O(1) на тик. Для квантилей значения раскладываются по корзинам
+шириной в копейку, счетчики корзин лежат в дереве Фенвика: добавление, удаление, квантиль
+и перцентиль текущего спреда - за O(log корзин), то есть за константу.
+
+Диапазон корзин (+-20 руб при шаге в копейку) сдвигается за спредом: если новое значение
+выходит за него, корзины перестраиваются по буферу за O(окна + корзин). Такая перестройка
+делается не чаще раза на count наблюдений, а до нее выходящие значения попадают в крайнюю
+корзину, поэтому в среднем на тик по-прежнему O(log корзин).
+
+Пороги пары можно задавать не в рублях, а в z-score (отклонение от среднего в сигмах)
+или в перцентилях скользящего распределения спреда.
+"""
+
+import base64, math, time
+from array import array
+from typing import Dict, Iterable, Optional
+
+SPREAD_WINDOW = 30000                                   # Наблюдений в окне (~неделя торгов при замере раз в 10 с)
+SPREAD_SAMPLE_INTERVAL = 10                             # Не чаще одного наблюдения в столько секунд
+SPREAD_MIN_SAMPLES = 360                                # Пока наблюдений меньше, пороги в z-score и перцентилях не работают
+SPREAD_RESOLUTION = 0.01                                # Ширина корзины для квантилей, руб
+QUANTILE_BINS = 4096                                    # Корзин для квантилей: диапазон +-20 руб при шаге в копейку
+
+# Режимы порогов пары
+THRESHOLD_ABS = 'abs'                                   # price_1/price_2 в рублях
+THRESHOLD_Z = 'z'                                       # price_1/price_2 в сигмах от скользящего среднего
+THRESHOLD_PERCENTILE = 'percentile'                     # price_1/price_2 - перцентили скользящего распределения, 0-100
+THRESHOLD_MODES = (THRESHOLD_ABS, THRESHOLD_Z, THRESHOLD_PERCENTILE)
+
+# Дерево Фенвика: счетчики корзин с префиксными суммами за O(log n)
+class FenwickTree:
+
+    def __init__(self, size: int):
+        self.size = size
+        self.tree = array('q', [0]) * (size + 1)
+        self.top = 1 << (size.bit_length() - 1)             # Старший бит размера для спуска по дереву
+
+    def add(self, i: int, delta: int):
+        i += 1
+        tree = self.tree
+        while i <= self.size:
+            tree[i] += delta
+            i += i & -i
+
+    # Сумма счетчиков корзин [0, i]
+    def prefix(self, i: int) -> int:
+        i += 1
+        total = 0
+        tree = self.tree
+        while i > 0:
+            total += tree[i]
+            i -= i & -i
+        return total
+
+    # Первая корзина, на которой префиксная сумма достигает target
+    def search(self, target: float) -> int:
+        pos = 0
+        step = self.top
+        tree = self.tree
+        while step:
+            nxt = pos + step
+            if nxt <= self.size and tree[nxt] < target:
+                pos = nxt
+                target -= tree[nxt]
+            step >>= 1
+        return min(pos, self.size - 1)
+
+    # Дерево по готовым счетчикам корзин за O(n), без n вызовов add
+    @classmethod
+    def from_counts(cls, counts) -> 'FenwickTree':
+        tree = cls(len(counts))
+        data = tree.tree
+        data[1:] = array('q', counts)
+        for i in range(1, tree.size + 1):
+            j = i + (i & -i)
+            if j <= tree.size:
+                data[j] += data[i]
+        return tree
+
+class RollingSpreadStats:
+
+    def __init__(self, size: int = SPREAD_WINDOW, sample_interval: float = SPREAD_SAMPLE_INTERVAL,
+                 resolution: float = SPREAD_RESOLUTION, bins: int = QUANTILE_BINS, min_samples: int = SPREAD_MIN_SAMPLES):
+        self.size = size
+        self.min_samples = min_samples
+        self.sample_interval = sample_interval
+        self.resolution = resolution
+        self.bins = bins
+        self.buffer = array('d', [0.0]) * size              # Кольцевой буфер наблюдений
+        self.count = 0
+        self.head = 0                                       # Куда запишется следующее наблюдение
+        self.shift = None                                   # Суммы считаются от первого наблюдения: меньше ошибка округления
+        self.sum = 0.0
+        self.sumsq = 0.0
+        self.evicted = 0                                    # Вытеснений с последнего точного пересчета сумм
+        self.origin = 0.0                                   # Центр первой корзины
+        self.since_recenter = 0                             # Наблюдений с последней перестройки корзин
+        self.histogram = FenwickTree(bins)
+        self.sampled_at = None                              # Когда было последнее наблюдение в окне
+        self.last = None                                    # Последний спред, в том числе не попавший в окно
+
+    # Корзины центрированы на сетке resolution: спред в копейках попадает в свою корзину точно
+    def _bin(self, value: float) -> int:
+        i = round((value - self.origin) / self.resolution)
+        return 0 if i < 0 else self.bins - 1 if i >= self.bins else i
+
+    def _in_range(self, value: float, origin: Optional[float] = None) -> bool:
+        origin = self.origin if origin is None else origin
+        return 0 <= round((value - origin) / self.resolution) < self.bins
+
+    # Центр первой корзины для диапазона с серединой в center
+    def _origin(self, center: float) -> float:
+        return round(center / self.resolution - self.bins // 2) * self.resolution
+
+    # Диапазон корзин переносится в origin и заполняется заново из буфера за O(окна + корзин)
+    def _recenter(self, origin: float):
+        self.origin = origin
+        counts = array('q', [0]) * self.bins
+        for item in self.values():
+            counts[self._bin(item)] += 1
+        self.histogram = FenwickTree.from_counts(counts)
+        self.since_recenter = 0
+
+    # Точный пересчет сумм по буферу раз в size вытеснений, чтобы не копилась ошибка округления
+    def _resum(self):
+        values = [value - self.shift for value in self.values()]
+        self.sum = math.fsum(values)
+        self.sumsq = math.fsum(v * v for v in values)
+        self.evicted = 0
+
+    # Значения в окне от старого к новому
+    def values(self) -> Iterable[float]:
+        start = (self.head - self.count) % self.size
+        for i in range(self.count):
+            yield self.buffer[(start + i) % self.size]
+
+    def add(self, value: float):
+
+        # Значение за диапазоном корзин: центрируем диапазон на среднем окна, а если и так не
+        # помещается - на самом значении. Чаще раза на count наблюдений не перестраиваем
+        if self.shift is None:
+            self.shift = value
+            self._recenter(self._origin(value))
+        elif not self._in_range(value) and self.since_recenter >= self.count:
+            origin = self._origin(self.mean())
+            self._recenter(origin if self._in_range(value, origin) else self._origin(value))
+        self.since_recenter += 1
+
+        if self.count == self.size:
+            old = self.buffer[self.head]
+            d = old - self.shift
+            self.sum -= d
+            self.sumsq -= d * d
+            self.histogram.add(self._bin(old), -1)
+            self.evicted += 1
+        else:
+            self.count += 1
+
+        self.buffer[self.head] = value
+        self.head = (self.head + 1) % self.size
+        d = value - self.shift
+        self.sum += d
+        self.sumsq += d * d
+        self.histogram.add(self._bin(value), 1)
+
+        if self.evicted >= self.size:
+            self._resum()
+
+    # Наблюдение спреда с тика: в окно попадает не чаще раза в sample_interval секунд,
+    # чтобы окно покрывало время, а не число тиков
+    def observe(self, value: float, now: Optional[float] = None) -> bool:
+        now = time.monotonic() if now is None else now
+        self.last = value
+        if self.sampled_at is not None and now - self.sampled_at < self.sample_interval:
+            return False
+        self.sampled_at = now
+        self.add(value)
+        return True
+
+    # Заполнение окна историей (например, спредом по минутным свечам) без учета sample_interval
+    def seed(self, values: Iterable[float]):
+        for value in values:
+            self.add(float(value))
+
+    # Состояние окна для снимка на диске: значения от старого к новому и сколько секунд назад было наблюдение.
+    # Читается без блокировки из другого потока: в худшем случае одно значение окажется не на своем месте
+    def state(self, now: Optional[float] = None) -> Dict[str, object]:
+        now = time.monotonic() if now is None else now
+        head, count = self.head, self.count
+        buffer = self.buffer[:]
+        start = (head - count) % self.size
+        values = buffer[start:start + count] if start + count <= self.size else buffer[start:] + buffer[:head]
+        return {
+            'values': base64.b64encode(values.tobytes()).decode('ascii'),
+            'sampled_ago': None if self.sampled_at is None else now - self.sampled_at,
+            'last': self.last,
+        }
+
+    # Восстановление из снимка. elapsed - сколько секунд прошло с сохранения снимка
+    def restore(self, state: Dict[str, object], elapsed: float = 0.0, now: Optional[float] = None):
+        values = array('d')
+        values.frombytes(base64.b64decode(state['values']))
+        self.seed(values[-self.size:])
+        self.last = state.get('last')
+        if state.get('sampled_ago') is not None:
+            self.sampled_at = (time.monotonic() if now is None else now) - state['sampled_ago'] - elapsed
+
+    @property
+    def ready(self) -> bool:
+        return self.count >= self.min_samples
+
+    def mean(self) -> Optional[float]:
+        return self.shift + self.sum / self.count if self.count else None
+
+    def std(self) -> Optional[float]:
+        if self.count < 2:
+            return None
+        mean = self.sum / self.count
+        return math.sqrt(max(0.0, self.sumsq / self.count - mean * mean))
+
+    def zscore(self, value: Optional[float] = None) -> Optional[float]:
+        value = self.last if value is None else value
+        std = self.std()
+        if value is None or not std:
+            return None
+        return (value - self.mean()) / std
+
+    # Приближенный квантиль q (0-1) с точностью до ширины корзины
+    def quantile(self, q: float) -> Optional[float]:
+        if not self.count:
+            return None
+        i = self.histogram.search(max(q * self.count, 1))
+        return round(self.origin + i * self.resolution, 10)
+
+    # Доля наблюдений в окне не больше value, в процентах
+    def percentile(self, value: Optional[float] = None) -> Optional[float]:
+        value = self.last if value is None else value
+        if value is None or not self.count:
+            return None
+        return 100.0 * self.histogram.prefix(self._bin(value)) / self.count
+
+    # Пороги пары в рублях по режиму: в сигмах или перцентилях пересчитываются по текущему окну.
+    # None, пока наблюдений недостаточно
+    def thresholds(self, mode: str, price_1: float, price_2: float):
+        if mode == THRESHOLD_ABS:
+            return price_1, price_2
+        if not self.ready:
+            return None
+        if mode == THRESHOLD_Z:
+            mean, std = self.mean(), self.std()
+            return round(mean + price_1 * std, 2), round(mean + price_2 * std, 2)
+        return round(self.quantile(price_1 / 100), 2), round(self.quantile(price_2 / 100), 2)
+
+    def snapshot(self) -> Dict[str, Optional[float]]:
+        return {
+            'count': self.count,
+            'mean': self.mean(),
+            'std': self.std(),
+            'z': self.zscore(),
+            'percentile': self.percentile(),
+            'p5': self.quantile(0.05),
+            'p50': self.quantile(0.5),
+            'p95': self.quantile(0.95),
+        }
@@ -1,75 +1,210 @@
-import time, uuid, datetime
+import threading, time, datetime, json, os, uuid
 
-from pandas import DataFrame
 from typing import Optional, Dict, Any, Union
-import requests
-from tinkoff.invest.services import InstrumentsService
+from journal import JOURNAL, Journal, pairs_meta
+from metrics import METRICS, METRICS_PORT, start_export
+from order_manager import OrderManager
+from portfolio import PortfolioState
+from resilience import Resilience
+from spread_stats import THRESHOLD_ABS, THRESHOLD_MODES, THRESHOLD_PERCENTILE, THRESHOLD_Z, RollingSpreadStats
+from trading_calendar import WARMUP, TradingCalendar, create_trading_calendar, fallback_sessions, now_utc, sleep_until
 from tinkoff.invest import (
     Client,
-    OrderDirection,
-    OrderType
+    LastPriceInstrument,
+    OrderBookInstrument,
+    OrderDirection
 )
 
-MAX_RETRIES = 100
-
-# Функция для проверки, находится ли текущее время внутри интервала [start_time, end_time]
-def is_within_time_interval(start_time, end_time):
-    now = datetime.datetime.now().time()
-    return start_time <= now <= end_time
-
-# Функция для проверки, является ли текущий день недели будним (понедельник - пятница)
-def is_weekday():
-    now = datetime.datetime.now().weekday()
-    return now >= 0 and now <= 4  # Понедельник - 0, Пятница - 4
+STREAM_MODE = True                                      # Торговать по потоку рыночных данных, опрос - запасной вариант
+STREAM_RETRY_DELAY = 300                                # Через сколько секунд опроса снова подключаться к потоку
+MAX_TICK_AGE = datetime.timedelta(seconds=5)            # Тики старше этого не запускают перекладку
+CONNECTION_ERROR_CODES = ('UNAVAILABLE', 'UNKNOWN', 'INTERNAL', 'CANCELLED')
+EXECUTABLE_SPREAD = True                                # Пороги сравниваются с исполнимым по стакану спредом, а не с последними сделками
+BOOK_DEPTH = 20                                         # Глубина стакана для расчета исполнимого спреда
+BOOK_FETCH_WORKERS = 8                                  # Сколько стаканов запрашивать одновременно
+STATUS_INTERVAL = 30                                    # Как часто печатать состояние пары без сделок, сек
+PAIRS_CONFIG_FILE = 'pairs.json'                        # Настройки пар для одновременной торговли
+POSITIONS_STREAM = True                                 # Обновлять портфель по потоку позиций, а не запросами
+
+# Реестр пар обычка/преф для интерактивного выбора. Любую другую пару можно задать в pairs.json
+PAIRS = [
+    {'name': 'Сбербанк', 'ticker_Ob': 'SBER', 'ticker_Pref': 'SBERP'},
+    {'name': 'Татнефть', 'ticker_Ob': 'TATN', 'ticker_Pref': 'TATNP'},
+    {'name': 'Ростелеком', 'ticker_Ob': 'RTKM', 'ticker_Pref': 'RTKMP'},
+]
+
+# Одно долгоживущее подключение к API на все вызовы стратегии.
+# Канал открывается при первом обращении и пересоздается после ошибок соединения ("Stream removed" и т.п.).
+# Сессией пользуются из нескольких потоков: открытие и закрытие канала идут под блокировкой
+class ClientSession:
+
+    def __init__(self, TOKEN, client_factory=Client, resilience: Optional[Resilience] = None):
+        self.TOKEN = TOKEN
+        self.client_factory = client_factory
+        self.resilience = resilience or Resilience()
+        self._manager = None
+        self._client = None
+        self.lock = threading.RLock()
+
+    @property
+    def client(self):
+        client = self._client
+        if client is None:
+            with self.lock:
+                if self._client is None:                    # Другой поток мог открыть канал, пока ждали блокировку
+                    self.connect()
+                client = self._client
+        return client
+
+    def connect(self):
+        with self.lock:
+            self._manager = self.client_factory(self.TOKEN)
+            self._client = self._manager.__enter__()
+
+    def close(self):
+        with self.lock:
+            manager, self._manager, self._client = self._manager, None, None
+        if manager is not None:
+            try:
+                manager.__exit__(None, None, None)
+            except Exception:
+                pass                                        # Канал уже разорван, закрывать нечего
+
+    def reconnect(self):
+        with self.lock:
+            self.close()
+            self.connect()
+
+    # Вызывается из обработчиков ошибок: при обрыве соединения следующий запрос пойдет по новому каналу
+    def handle_error(self, e: Exception):
+        if is_connection_error(e):
+            self.close()
+
+    # Запрос с повторами, ограничением частоты и предохранителем: fn получает клиента
+    def call(self, method: str, fn):
+        with METRICS.timer('api_call_seconds', method=method):
+            return self.resilience.call(method, lambda: fn(self.client), on_error=self._on_error(method))
+
+    def _on_error(self, method: str):
+        def on_error(e: Exception):
+            print(f"Ошибка запроса {method}: {e}")
+            self.handle_error(e)
+        return on_error
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+# Ошибки, после которых канал нужно открыть заново
+def is_connection_error(e: Exception) -> bool:
+    code = getattr(e, 'code', None)
+    code = code() if callable(code) else code
+    return getattr(code, 'name', None) in CONNECTION_ERROR_CODES or 'Stream removed' in str(e)
 
 # Получаем информацию об инструментах
-def create_instruments_dataframe() -> DataFrame:
-
-    with Client(TOKEN) as client:
-
-        instruments: InstrumentsService = client.instruments
-
-        data = []
+INSTRUMENT_TYPES = ['shares', 'bonds', 'etfs', 'currencies', 'futures']
+INSTRUMENTS_CACHE_FILE = 'instruments_cache.json'
+INSTRUMENTS_CACHE_TTL = 24 * 60 * 60  # Время жизни кэша инструментов, сек
+
+# Справочник инструментов с индексами по тикеру и FIGI
+class InstrumentCatalog:
+
+    def __init__(self, types: Optional[Dict[str, Dict[str, Any]]] = None):
+        # types: тип инструмента -> {'updated': время загрузки, 'items': [...]}
+        self.types = types or {}
+        self.by_ticker: Dict[str, Dict[str, Any]] = {}
+        self.by_figi: Dict[str, Dict[str, Any]] = {}
+        self._reindex()
+
+    def _reindex(self):
+        self.by_ticker = {}
+        self.by_figi = {}
+        # Порядок типов как в исходной таблице: при совпадении тикеров побеждает акция
+        for method in INSTRUMENT_TYPES:
+            for item in self.types.get(method, {}).get('items', []):
+                self.by_ticker.setdefault(item['ticker'], item)
+                self.by_figi.setdefault(item['figi'], item)
+
+    def stale_types(self, ttl: float = INSTRUMENTS_CACHE_TTL):
+        now = time.time()
+        return [method for method in INSTRUMENT_TYPES
+                if now - self.types.get(method, {}).get('updated', 0) > ttl]
+
+    def update_type(self, method: str, items):
+        self.types[method] = {'updated': time.time(), 'items': items}
+        self._reindex()
+
+    @classmethod
+    def load(cls, path: str = INSTRUMENTS_CACHE_FILE) -> 'InstrumentCatalog':
         try:
-            for method in ['shares', 'bonds', 'etfs', 'currencies', 'futures']:
-                for item in getattr(instruments, method)().instruments:
-                    data.append({
-                        'ticker': item.ticker,
-                        'figi': item.figi,
-                        'type': method,
-                        'name': item.name,
-                        'lot_size': item.lot
-                    })
-
-        except requests.exceptions.RequestException as e:
-
+            with open(path, encoding='utf-8') as f:
+                return cls(json.load(f))
+        except (OSError, ValueError):
+            return cls()
+
+    def save(self, path: str = INSTRUMENTS_CACHE_FILE):
+        # Пишем во временный файл и подменяем, чтобы не оставить битый кэш при падении
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.types, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+# Загружаем справочник из кэша и докачиваем только устаревшие типы инструментов
+def create_instruments_catalog(session, path: str = INSTRUMENTS_CACHE_FILE, ttl: float = INSTRUMENTS_CACHE_TTL) -> InstrumentCatalog:
+
+    catalog = InstrumentCatalog.load(path)
+    stale = catalog.stale_types(ttl)
+    if not stale:
+        return catalog
+
+    try:
+        for method in stale:
+            items = []
+            for item in session.call(method, lambda client: getattr(client.instruments, method)()).instruments:
+                items.append({
+                    'ticker': item.ticker,
+                    'figi': item.figi,
+                    'type': method,
+                    'name': item.name,
+                    'lot_size': item.lot
+                })
+            catalog.update_type(method, items)
+
+    except Exception as e:
+
+        # Если кэш есть, работаем по устаревшим данным
+        if not catalog.by_figi:
             raise Exception(f"Ошибка запроса: {e}")
+        print(f"Не удалось обновить справочник инструментов, используем кэш: {e}")
 
-    return DataFrame(data)
+    catalog.save(path)
+    return catalog
 
-def get_instrument_info(df: DataFrame, TICKER: Optional[str] = None, FIGI: Optional[str] = None) -> Union[str, Dict[str, Any]]:
+def get_instrument_info(catalog: InstrumentCatalog, TICKER: Optional[str] = None, FIGI: Optional[str] = None) -> Union[str, Dict[str, Any]]:
 
     if TICKER:
-        filtered_df = df[df['ticker'] == TICKER]
-        if not filtered_df.empty:
+        item = catalog.by_ticker.get(TICKER)
+        if item is not None:
             return {
-                'ticker': filtered_df.iloc[0]['ticker'],
-                'figi': filtered_df.iloc[0]['figi'],
-                'name': filtered_df.iloc[0]['name'],
-                'lot_size': filtered_df.iloc[0]['lot_size']
+                'ticker': item['ticker'],
+                'figi': item['figi'],
+                'name': item['name'],
+                'lot_size': item['lot_size']
             }
         else:
             print(f"Тикер {TICKER} не найден.")
             time.sleep(300)
 
     elif FIGI:
-        filtered_df = df[df['figi'] == FIGI]
-        if not filtered_df.empty:
+        item = catalog.by_figi.get(FIGI)
+        if item is not None:
             return {
-                'ticker': filtered_df.iloc[0]['ticker'],
-                'figi': filtered_df.iloc[0]['figi'],
-                'name': filtered_df.iloc[0]['name'],
-                'lot_size': filtered_df.iloc[0]['lot_size']
+                'ticker': item['ticker'],
+                'figi': item['figi'],
+                'name': item['name'],
+                'lot_size': item['lot_size']
             }
         else:
             print(f"FIGI {FIGI} не найден.")
@@ -80,54 +215,35 @@ def user_input_token():
     while True:
 
         TOKEN = input("Введите ваш токен Tinkoff API: ")
+        session = ClientSession(TOKEN)
 
         try:
-            with Client(TOKEN) as client:
-                Account_id = client.users.get_accounts().accounts[0].id
-                print("Account_id:", Account_id)
-                print("----------------------------------------------")
-                return TOKEN, Account_id
+            Account_id = session.call('get_accounts', lambda client: client.users.get_accounts()).accounts[0].id
+            print("Account_id:", Account_id)
+            print("----------------------------------------------")
+            return session, Account_id
         except Exception as e:
+            session.close()
             print("ОШИБКА ТОКЕНА:", str(e))
             print("----------------------------------------------")
             print("Пожалуйста, проверьте правильность введенного токена и попробуйте еще раз.")
             time.sleep(0.1)
             print("----------------------------------------------")
     
-def user_input_tiker(df):
+def user_input_tiker(catalog):
 
     while True:
 
-        tiker_number = input("Выберите компанию:\n1 - Сбербанк\n2 - Татнефть\n3 - Ростелеком\n")
+        menu = "\n".join(f"{number} - {pair['name']}" for number, pair in enumerate(PAIRS, 1))
+        tiker_number = input(f"Выберите компанию:\n{menu}\n")
 
         # Обрабатываем выбор пользователя
-        if tiker_number == '1':
-
-            print("Вы выбрали Сбербанк. Запрашиваю информацию о портфеле...")
-            info_Ob = get_instrument_info(df, TICKER="SBER")
-            info_Pref = get_instrument_info(df, TICKER="SBERP")
-
-            figi_Ob = info_Ob.get('figi', 'Информация не найдена')
-            figi_Pref = info_Pref.get('figi', 'Информация не найдена')
-
-            return figi_Ob, figi_Pref
+        if tiker_number.isdigit() and 1 <= int(tiker_number) <= len(PAIRS):
 
-        elif tiker_number == '2':
-
-            print("Вы выбрали Татнефть. Запрашиваю информацию о портфеле...")
-            info_Ob = get_instrument_info(df, TICKER="TATN")
-            info_Pref = get_instrument_info(df, TICKER="TATNP")
-
-            figi_Ob = info_Ob.get('figi', 'Информация не найдена')
-            figi_Pref = info_Pref.get('figi', 'Информация не найдена')
-
-            return figi_Ob, figi_Pref
-
-        elif tiker_number == '3':
-
-            print("Вы выбрали Ростелеком. Запрашиваю информацию о портфеле...")
-            info_Ob = get_instrument_info(df, TICKER="RTKM")
-            info_Pref = get_instrument_info(df, TICKER="RTKMP")
+            pair = PAIRS[int(tiker_number) - 1]
+            print(f"Вы выбрали {pair['name']}. Запрашиваю информацию о портфеле...")
+            info_Ob = get_instrument_info(catalog, TICKER=pair['ticker_Ob'])
+            info_Pref = get_instrument_info(catalog, TICKER=pair['ticker_Pref'])
 
             figi_Ob = info_Ob.get('figi', 'Информация не найдена')
             figi_Pref = info_Pref.get('figi', 'Информация не найдена')
@@ -136,7 +252,7 @@ def user_input_tiker(df):
 
         else:
 
-            print("Некорректный выбор. Пожалуйста, выберите 1, 2 или 3.")
+            print(f"Некорректный выбор. Пожалуйста, выберите число от 1 до {len(PAIRS)}.")
             time.sleep(0.1)
             print("Попробуйте еще раз.")
 
@@ -153,288 +269,772 @@ def user_input_spread():
             time.sleep(5)
             print("Некорректные значения. Первое число должно быть меньше второго")
             
-# Функция показывающая кол-во обычки и префов в портфеле и состав портфеля
-def get_portfolio_info(TOKEN, df):
-
-    with Client(TOKEN) as client:
+# Функция показывающая состав портфеля
+def get_portfolio_info(session, Account_id, catalog):
+
+    PositionResponse = session.call('get_positions', lambda client: client.operations.get_positions(account_id=Account_id))
+
+    # Извлекаем информацию о деньгах
+    money_info = PositionResponse.money
+    for money in money_info:
+        currency = money.currency
+        units = money.units
+        print(f"Денег: {units} {currency}")
+
+    # Извлекаем информацию о ценных бумагах
+    securities_info = PositionResponse.securities
+    for security in securities_info:
+        figi = security.figi
+        balance = security.balance
+        # Используем функцию get_instrument_info для получения тикера и имени по FIGI
+        instrument_info = get_instrument_info(catalog, FIGI=figi)
+        if isinstance(instrument_info, dict):
+            print(f"Акции: Тикер: Название: '{instrument_info['name']}', '{instrument_info['ticker']}' - {balance} шт.")
+        else:
+            print(instrument_info)
 
-        retries = 0
+    return PositionResponse
 
-        while retries < MAX_RETRIES:
+# Последние цены сразу всех бумаг одним запросом
+def get_last_prices(session, figis) -> Dict[str, float]:
+    
+    LastPrices = session.call('get_last_prices', lambda client: client.market_data.get_last_prices(figi=list(figis))).last_prices
+    return {LastPrice.figi: LastPrice.price.units + LastPrice.price.nano * 1e-9 for LastPrice in LastPrices}
+
+# Стакан в виде списков (цена, кол-во бумаг) от лучшей цены к худшей
+def book_levels(orders, lot_size):
+    return [(order.price.units + order.price.nano * 1e-9, order.quantity * lot_size) for order in orders]
+
+# Средняя цена исполнения quantity бумаг по уровням стакана. Для нулевого объема - лучшая цена,
+# если глубины стакана не хватает - None
+def book_vwap(levels, quantity):
+
+    if quantity <= 0:
+        return levels[0][0] if levels else None
+
+    left = quantity
+    cost = 0.0
+    for price, size in levels:
+        take = size if size < left else left
+        cost += take * price
+        left -= take
+        if left <= 0:
+            return cost / quantity
+    return None
+
+# Цена самого дальнего уровня, который заденет заявка на quantity бумаг: лимит для заявки,
+# исполнимой сразу, но не хуже учтенного в исполнимом спреде. None, если глубины не хватает
+def book_limit_price(levels, quantity):
+
+    left = quantity
+    for price, size in levels:
+        left -= size
+        if left <= 0:
+            return price
+    return None
+
+_book_pool = None
+
+def book_pool():
+    global _book_pool
+    if _book_pool is None:
+        from concurrent.futures import ThreadPoolExecutor
+        _book_pool = ThreadPoolExecutor(max_workers=BOOK_FETCH_WORKERS, thread_name_prefix='books')
+    return _book_pool
+
+# Стаканы и последние цены бумаг: figi -> (bids, asks). Пакетного запроса стаканов в API нет,
+# поэтому стаканы всех бумаг запрашиваются одновременно: итерация длится один запрос, а не N,
+# и стаканы обеих ног сняты почти в один момент
+def get_order_books(session, figis, lot_sizes: Dict[str, int], depth: int = BOOK_DEPTH):
+
+    def fetch(figi):
+        return figi, session.call('get_order_book', lambda client: client.market_data.get_order_book(figi=figi, depth=depth))
+
+    figis = list(figis)
+    responses = [fetch(figis[0])] if len(figis) == 1 else book_pool().map(fetch, figis)
+
+    books = {}
+    prices = {}
+    for figi, OrderBook in responses:
+        books[figi] = (book_levels(OrderBook.bids, lot_sizes[figi]), book_levels(OrderBook.asks, lot_sizes[figi]))
+        prices[figi] = OrderBook.last_price.units + OrderBook.last_price.nano * 1e-9
+
+    return books, prices
+
+# Действия стратегии
+HOLD = 'hold'                                           # Ничего не делаем
+BUY_OB = 'buy_ob'                                       # Покупаем обычку на все деньги
+BUY_PREF = 'buy_pref'                                   # Покупаем префы на все деньги
+SWITCH_TO_OB = 'switch_to_ob'                           # Продаем префы и покупаем обычку
+SWITCH_TO_PREF = 'switch_to_pref'                       # Продаем обычку и покупаем префы
+
+# Решение по спреду и текущим остаткам обеих ног, без обращений к API
+def decide(spread, price_1, price_2, KObich, KPrefa):
+
+    # Спред меньше price_1: держим обычку
+    if spread < price_1:
+        if KPrefa > 0:
+            return SWITCH_TO_OB
+        if KObich > 0:
+            return HOLD
+        return BUY_OB
+
+    # Спред больше price_2: держим префы
+    if spread > price_2:
+        if KObich > 0:
+            return SWITCH_TO_PREF
+        if KPrefa > 0:
+            return HOLD
+        return BUY_PREF
+
+    return HOLD
+
+# Решение по исполнимым спредам: каждое направление сравнивается со своим порогом.
+# В обычку - только если спред перехода в обычку (ask обычки - bid префа) ниже price_1,
+# в префы - только если спред перехода в префы (bid обычки - ask префа) выше price_2.
+# None - на это направление не хватает глубины стакана
+def decide_executable(spread_to_Ob, spread_to_Pref, price_1, price_2, KObich, KPrefa):
+
+    if spread_to_Ob is not None and spread_to_Ob < price_1:
+        return decide(spread_to_Ob, price_1, price_2, KObich, KPrefa)
+    if spread_to_Pref is not None and spread_to_Pref > price_2:
+        return decide(spread_to_Pref, price_1, price_2, KObich, KPrefa)
+    return HOLD
+
+# Пара обычка/преф со своими порогами и долей капитала
+class SpreadPair:
+
+    def __init__(self, info_Ob, info_Pref, price_1, price_2, allocation: float = 1.0, threshold: str = THRESHOLD_ABS):
+        self.info_Ob = info_Ob
+        self.info_Pref = info_Pref
+        self.figi_Ob = info_Ob['figi']
+        self.figi_Pref = info_Pref['figi']
+        self.name_Ob = info_Ob.get('name', 'Неизвестное название')
+        self.name_Pref = info_Pref.get('name', 'Неизвестное название')
+        self.name = info_Ob['ticker'] + '/' + info_Pref['ticker']
+        self.price_1 = price_1
+        self.price_2 = price_2
+        self.allocation = allocation                        # Доля капитала стратегии, которую занимает пара
+        self.threshold = threshold                          # В чем заданы price_1/price_2: рубли, z-score или перцентили
+        self.stats = RollingSpreadStats()                   # Скользящая статистика спреда последних сделок
+        self.levels = self.stats.thresholds(threshold, price_1, price_2)   # Текущие пороги в рублях, None - статистики мало
+        self.last_status = 0.0                              # Когда последний раз печатали состояние пары
+
+    # Новое значение спреда: в окно статистики и пересчет порогов, если они заданы не в рублях
+    def observe(self, spread, now: Optional[float] = None):
+        if self.stats.observe(spread, now) and self.threshold != THRESHOLD_ABS:
+            self.levels = self.stats.thresholds(self.threshold, self.price_1, self.price_2)
+
+    # Заполнение окна статистики историческим спредом
+    def seed(self, spreads):
+        self.stats.seed(spreads)
+        self.levels = self.stats.thresholds(self.threshold, self.price_1, self.price_2)
+
+    # Окно статистики из снимка состояния прошлого запуска
+    def restore_stats(self, state, elapsed: float = 0.0):
+        self.stats.restore(state, elapsed)
+        self.levels = self.stats.thresholds(self.threshold, self.price_1, self.price_2)
+
+    # Пороги в том виде, как их задали
+    def describe_thresholds(self):
+        if self.threshold == THRESHOLD_Z:
+            return f'z-score {self.price_1} - {self.price_2}'
+        if self.threshold == THRESHOLD_PERCENTILE:
+            return f'перцентили {self.price_1} - {self.price_2}'
+        return f'{self.price_1} - {self.price_2}'
+
+    def spread(self, prices: Dict[str, float]):
+        LastPrice_Ob = prices[self.figi_Ob]
+        LastPrice_Pref = prices[self.figi_Pref]
+        return round(LastPrice_Ob - LastPrice_Pref, 2), LastPrice_Ob, LastPrice_Pref
+
+    # Спреды, которые реально получатся при перекладке нашего объема по текущим стаканам в каждую сторону,
+    # с проскальзыванием перекладки в рублях относительно последних цен:
+    # в обычку - продаем префы по bid, покупаем обычку по ask; в префы - продаем обычку по bid, покупаем префы по ask.
+    # Возвращает ((спред, проскальзывание) в обычку, (спред, проскальзывание) в префы);
+    # для направления, на которое не хватает глубины стакана, - (None, None)
+    def executable_spreads(self, books, prices: Dict[str, float], KObich, KPrefa, budget):
+
+        LastPrice_Ob = prices[self.figi_Ob]
+        LastPrice_Pref = prices[self.figi_Pref]
+        bids_Ob, asks_Ob = books[self.figi_Ob]
+        bids_Pref, asks_Pref = books[self.figi_Pref]
+
+        # В обычку: деньги от продажи префов (или доля капитала, если ничего нет) уходят в обычку
+        to_Ob = (None, None)
+        Money = KPrefa * LastPrice_Pref or budget
+        sell = book_vwap(bids_Pref, KPrefa)
+        buy = book_vwap(asks_Ob, Money / LastPrice_Ob)
+        if sell is not None and buy is not None:
+            slippage = KPrefa * (LastPrice_Pref - sell) + Money / LastPrice_Ob * (buy - LastPrice_Ob)
+            to_Ob = (round(buy - sell, 2), slippage)
+
+        # В префы
+        to_Pref = (None, None)
+        Money = KObich * LastPrice_Ob or budget
+        sell = book_vwap(bids_Ob, KObich)
+        buy = book_vwap(asks_Pref, Money / LastPrice_Pref)
+        if sell is not None and buy is not None:
+            slippage = KObich * (LastPrice_Ob - sell) + Money / LastPrice_Pref * (buy - LastPrice_Pref)
+            to_Pref = (round(sell - buy, 2), slippage)
+
+        return to_Ob, to_Pref
+
+# Пары из файла настроек: [{"ticker_Ob": "SBER", "ticker_Pref": "SBERP", "price_1": 1, "price_2": 3, "allocation": 0.5}, ...]
+# "threshold": "z" или "percentile" - пороги в сигмах от скользящего среднего или в перцентилях спреда
+def load_pairs(catalog: InstrumentCatalog, path: str = PAIRS_CONFIG_FILE):
+
+    with open(path, encoding='utf-8') as f:
+        config = json.load(f)
+    return parse_pairs(catalog, config, path)
+
+# Пары из списка настроек в формате pairs.json; source - откуда настройки, для сообщений об ошибках
+def parse_pairs(catalog: InstrumentCatalog, config, source: str = PAIRS_CONFIG_FILE):
+
+    pairs = []
+    for item in config:
+        infos = []
+        for ticker in (item['ticker_Ob'], item['ticker_Pref']):
+            if ticker not in catalog.by_ticker:
+                raise ValueError(f"Тикер {ticker} из {source} не найден.")
+            infos.append(get_instrument_info(catalog, TICKER=ticker))
+        if item['price_1'] >= item['price_2']:
+            raise ValueError(f"{item['ticker_Ob']}: price_1 должен быть меньше price_2")
+        threshold = item.get('threshold', THRESHOLD_ABS)
+        if threshold not in THRESHOLD_MODES:
+            raise ValueError(f"{item['ticker_Ob']}: threshold должен быть одним из {', '.join(THRESHOLD_MODES)}")
+        if threshold == THRESHOLD_PERCENTILE and not 0 <= item['price_1'] < item['price_2'] <= 100:
+            raise ValueError(f"{item['ticker_Ob']}: перцентили должны быть от 0 до 100")
+        pairs.append(SpreadPair(*infos, item['price_1'], item['price_2'], item.get('allocation', 1 / len(config)), threshold))
+
+    if sum(pair.allocation for pair in pairs) > 1 + 1e-9:
+        raise ValueError(f"Сумма allocation в {source} больше 1")
+
+    return pairs
+
+# Обновления из потока рыночных данных: отдает FIGI бумаги, у которой изменилась цена или стакан.
+# prices и books обновляются на месте, prices должен заранее содержать все бумаги, на которые подписались.
+# В times - время наблюдения каждой бумаги по часам биржи (unix, сек)
+def stream_market_data(stream, prices: Dict[str, float], books=None, lot_sizes: Optional[Dict[str, int]] = None,
+                       times: Optional[Dict[str, float]] = None, journal: Optional[Journal] = None):
+
+    for marketdata in stream:
+
+        last_price = getattr(marketdata, 'last_price', None)
+        orderbook = getattr(marketdata, 'orderbook', None)
+
+        if last_price is not None and last_price.figi in prices:
+            prices[last_price.figi] = last_price.price.units + last_price.price.nano * 1e-9
+            figi, tick_time = last_price.figi, last_price.time
+        elif orderbook is not None and books is not None and orderbook.figi in prices:
+            lot_size = lot_sizes[orderbook.figi]
+            books[orderbook.figi] = (book_levels(orderbook.bids, lot_size), book_levels(orderbook.asks, lot_size))
+            figi, tick_time = orderbook.figi, orderbook.time
+        else:
+            continue                                        # Служебные сообщения (ping, подтверждения подписки)
+
+        if times is not None:
+            times[figi] = tick_time.timestamp() if tick_time else time.time()
+        if journal is not None:
+            journal.tick(figi, prices[figi], books.get(figi) if books is not None else None)
+
+        # Тики, накопившиеся в очереди пока шла сделка, только обновляют данные, но не запускают перекладку
+        if tick_time and datetime.datetime.now(datetime.timezone.utc) - tick_time > MAX_TICK_AGE:
+            continue
+
+        yield figi
+
+# Движок стратегии: все пары одного счета в одном процессе, общий канал, общий поток цен и общий портфель
+class SpreadEngine:
+
+    def __init__(self, session: ClientSession, Account_id, catalog: InstrumentCatalog, pairs,
+                 calendar: Optional[TradingCalendar] = None, journal: Optional[Journal] = None):
+        self.session = session
+        self.Account_id = Account_id
+        self.catalog = catalog
+        self.pairs = pairs
+        self.calendar = calendar or TradingCalendar(fallback_sessions())
+        self.pairs_by_figi = {}                             # FIGI любой из ног -> пара
+        for pair in pairs:
+            self.pairs_by_figi[pair.figi_Ob] = pair
+            self.pairs_by_figi[pair.figi_Pref] = pair
+        self.figis = list(self.pairs_by_figi)
+        self.lot_sizes = {}
+        for pair in pairs:
+            self.lot_sizes[pair.figi_Ob] = pair.info_Ob['lot_size']
+            self.lot_sizes[pair.figi_Pref] = pair.info_Pref['lot_size']
+        self.prices: Dict[str, float] = {}
+        self.price_times: Dict[str, float] = {}             # figi -> когда наблюдалась цена (unix, сек)
+        self.books = {}                                     # figi -> (bids, asks)
+        self.portfolio = PortfolioState()
+        self.positions_thread: Optional[threading.Thread] = None
+        self.orders = OrderManager(session, Account_id)
+        self.switch_latencies = []                          # Длительность перекладок от решения до покупки, сек
+        self.switch = None                                  # Идущая перекладка: пара, целевая нога, номера заявок
+        self.pending_switch = None                          # Перекладка, прерванная падением прошлого процесса
+        self.checkpoint = None                              # Сохранение снимка состояния в начале и конце перекладки
+        self.journal = journal                              # Журнал тиков, решений и заявок для воспроизведения
+        self.metrics_port = METRICS_PORT                    # Порт экспорта метрик, 0 - не запускать
+        if journal is not None:
+            journal.meta('pairs', pairs_meta(pairs))
+
+    # Часы для окна статистики спреда; при воспроизведении журнала - время записанного тика
+    def now(self):
+        return time.monotonic()
+
+    # С исполнимым спредом берем стаканы: в них есть и последняя цена, лишний запрос не нужен
+    def refresh_prices(self, figis=None):
+        figis = figis or self.figis
+        with METRICS.timer('refresh_prices_seconds'):
+            if EXECUTABLE_SPREAD:
+                books, prices = get_order_books(self.session, figis, self.lot_sizes)
+                self.books.update(books)
+                self.prices.update(prices)
+            else:
+                self.prices.update(get_last_prices(self.session, figis))
+        now = time.time()
+        for figi in figis:
+            self.price_times[figi] = now
+            if self.journal is not None and figi in self.prices:
+                self.journal.tick(figi, self.prices[figi], self.books.get(figi), now)
+
+    # Полная сверка портфеля с брокером. Состав печатаем только при первой загрузке
+    def refresh_portfolio(self):
+        with METRICS.timer('portfolio_refresh_seconds'):
+            if self.portfolio.synced_at is None:
+                print('Портфель:')
+                PositionResponse = get_portfolio_info(self.session, self.Account_id, self.catalog)
+            else:
+                PositionResponse = self.session.call('get_positions', lambda client: client.operations.get_positions(account_id=self.Account_id))
+        if self.portfolio.load(PositionResponse):
+            METRICS.inc('portfolio_drift_total')
+        self.journal_portfolio()
+
+    def journal_portfolio(self):
+        if self.journal is not None:
+            self.journal.portfolio(self.portfolio.money, dict(self.portfolio.balances))
+
+    # Сверка только по таймеру или если модель портфеля могла разойтись с брокером
+    def sync_portfolio(self):
+        if self.portfolio.needs_sync():
+            self.refresh_portfolio()
+
+    # Поток позиций в отдельном потоке выполнения: сделки вне стратегии и зачисления видны без запросов.
+    # У потока своя сессия: переподключение основного канала после ошибки не обрывает поток позиций
+    def positions_loop(self):
+        session = ClientSession(self.session.TOKEN, self.session.client_factory, self.session.resilience)
+        while True:
+            try:
+                for response in session.client.operations_stream.positions_stream(accounts=[self.Account_id]):
+                    position = getattr(response, 'position', None)
+                    if position is not None:
+                        self.portfolio.apply_stream(position)
+            except Exception as e:
+                print("Поток позиций прервался:", str(e))
+                session.handle_error(e)
+            self.portfolio.invalidate('поток позиций недоступен')
+            time.sleep(STREAM_RETRY_DELAY)
+
+    def start_positions_stream(self):
+        if self.positions_thread is None:
+            self.positions_thread = threading.Thread(target=self.positions_loop, name='positions', daemon=True)
+            self.positions_thread.start()
+
+    def balance(self, figi):
+        return self.portfolio.balance(figi)
+
+    def money(self):
+        return int(self.portfolio.money)
+
+    # Капитал стратегии: свободные деньги плюс стоимость бумаг всех пар
+    def capital(self):
+        return self.money() + sum(self.balance(figi) * self.prices.get(figi, 0) for figi in self.figis)
+
+    # Стоимость обеих ног пары по последним ценам
+    def pair_value(self, pair):
+        return sum(self.balance(figi) * self.prices.get(figi, 0) for figi in (pair.figi_Ob, pair.figi_Pref))
+
+    def print_status(self, pair, spread, LastPrice_Ob, LastPrice_Pref, decision_spread=None, slippage=None):
+        print ('Пара', pair.name)
+        print ('Текущий спред', spread)
+        stats = pair.stats
+        if stats.count >= 2:
+            print (f'Спред за окно ({stats.count} набл.): среднее {stats.mean():.2f}, сигма {stats.std():.2f}, '
+                   f'z-score {stats.zscore(spread):+.2f}, перцентиль {stats.percentile(spread):.0f}')
+        if pair.levels is not None and pair.threshold != THRESHOLD_ABS:
+            print ('Пороги', pair.describe_thresholds(), '=', pair.levels[0], '-', pair.levels[1], 'руб.')
+        if slippage is not None:
+            print ('Исполнимый спред', decision_spread, f'проскальзывание перекладки {slippage:.2f} руб.')
+        print ('Цена обычки =', LastPrice_Ob)
+        print ('Цена префов =', LastPrice_Pref)
+        print ('Дата:', datetime.datetime.now()) 
+
+    # Лимитная цена заявки по текущему стакану; None - заявка по лучшей цене
+    def limit_price(self, figi, quantity, buy: bool):
+        if figi not in self.books:
+            return None
+        bids, asks = self.books[figi]
+        return book_limit_price(asks if buy else bids, quantity)
+
+    # Заявка с учетом ее исполнения в модели портфеля
+    def execute(self, figi, lots, direction, lot_size, price=None, order_id=None):
+        before = self.portfolio.snapshot(figi)
+        result = self.orders.execute(figi, lots, direction, lot_size, price, order_id)
+        self.portfolio.apply_fill(result, before)
+        if self.journal is not None:
+            self.journal.order(result)
+            self.journal_portfolio()
+        return result
+
+    # Покупаем бумагу на долю капитала пары (98% - запас на комиссию и движение цены).
+    # Из доли вычитается то, что пара уже держит: после частичной продажи непроданный остаток
+    # другой ноги занимает свою часть доли, и деньги других пар не тратятся
+    def buy_on_all_money(self, pair, figi, info, order_id=None):
+
+        # Свежий стакан нужен только по покупаемой бумаге
+        self.refresh_prices([figi])
+        LastPrice = self.prices[figi]
+        Money = max(0, min(self.money(), int(pair.allocation * self.capital() - self.pair_value(pair))))
+        lot_size = info.get('lot_size', 'Информация о лотности не найдена')
+        KolVo = int(Money/LastPrice/lot_size*0.98)
+        print(f'Денег {Money}, можем купить {KolVo} лотов по цене {LastPrice}')
+        return self.execute(figi, KolVo, OrderDirection.ORDER_DIRECTION_BUY, lot_size,
+                            self.limit_price(figi, KolVo * lot_size, buy=True), order_id)
+
+    def save_checkpoint(self):
+        if self.checkpoint is not None:
             try:
+                self.checkpoint()
+            except OSError as e:
+                print(f"Не удалось сохранить состояние: {e}")
+
+    # sell - номер заявки на продажу; у доводимой после перезапуска перекладки он из прошлого запуска
+    def begin_switch(self, pair, figi_buy, sell=None):
+        self.switch = {'pair': pair.name, 'buy': figi_buy, 'sell': sell, 'order_ids': []}
+
+    # Номер заявки перекладки попадает в снимок до выставления: после падения снимем именно ее
+    def switch_order_id(self, sell: bool = False):
+        order_id = str(uuid.uuid4())
+        self.switch['order_ids'].append(order_id)
+        if sell:
+            self.switch['sell'] = order_id
+        self.save_checkpoint()
+        return order_id
+
+    def end_switch(self):
+        self.switch = None
+        self.save_checkpoint()
+
+    # Перекладка из снимка прошлого процесса: снимаем только ее заявки (ручные заявки на те же
+    # бумаги не трогаем). Если продажа успела исполниться хотя бы частично, покупку целевой ноги
+    # доводим на первом тике пары в торговую сессию; если нет - пару дальше ведет decide()
+    def recover_switch(self, switch):
+        sell = switch.get('sell')
+        order_ids = list(dict.fromkeys(switch['order_ids'] + ([sell] if sell else [])))
+        executed = self.orders.cancel_orders(order_ids)
+        if not sell or not executed.get(sell):
+            print(f"Перекладка {switch['pair']} прервана прошлым запуском до продажи, ее заявки сняты")
+            return
+        print(f"Перекладка {switch['pair']} прервана прошлым запуском после продажи, ее заявки сняты")
+        if any(pair.name == switch['pair'] for pair in self.pairs):
+            self.pending_switch = dict(switch, order_ids=[])
+
+    # Докупаем целевую ногу прерванной перекладки на освободившиеся деньги. Непроданный остаток
+    # другой ноги продастся обычным порядком, пока спред за порогом
+    def finish_switch(self, pair):
+        figi_buy = self.pending_switch['buy']
+        info_buy = pair.info_Ob if figi_buy == pair.figi_Ob else pair.info_Pref
+        print(f"Доводим перекладку {pair.name}: покупаем {info_buy['ticker']} на освободившиеся деньги")
+        self.refresh_portfolio()
+        self.begin_switch(pair, figi_buy, self.pending_switch['sell'])
+        self.pending_switch = None
+        self.buy_on_all_money(pair, figi_buy, info_buy, self.switch_order_id())
+        self.end_switch()
+        print("---------------------------------------------")
+
+    # Продаем всю позицию по одной ноге и, как только известна выручка, покупаем другую
+    def switch_legs(self, pair, figi_sell, info_sell, KolVo_sell, figi_buy, info_buy):
+
+        started = time.perf_counter()
+        self.begin_switch(pair, figi_buy)
+        lot_size = info_sell.get('lot_size', 'Информация о лотности не найдена')
+        sell = self.execute(figi_sell, KolVo_sell // lot_size, OrderDirection.ORDER_DIRECTION_SELL, lot_size,
+                            self.limit_price(figi_sell, KolVo_sell, buy=False), self.switch_order_id(sell=True))
+        if not sell.lots_executed:
+            print('Продажа не исполнилась, перекладку не продолжаем')
+            self.end_switch()
+            return
+
+        # Портфель не запрашиваем: выручка от продажи уже учтена в модели портфеля.
+        # При частичном исполнении остаток продастся на следующем тике, пока спред за порогом
+        self.buy_on_all_money(pair, figi_buy, info_buy, self.switch_order_id())
+        self.end_switch()
+
+        latency = time.perf_counter() - started
+        self.switch_latencies.append(latency)
+        print(f'Перекладка заняла {latency:.2f} с')
+
+    # Спреды, с которыми сравниваются пороги: исполнимые по стакану для нашего объема в обе стороны, если стаканы есть,
+    # иначе спред последних сделок для обеих сторон. К каждому - оценка проскальзывания перекладки
+    def decision_spreads(self, pair, spread):
+        if not EXECUTABLE_SPREAD or pair.figi_Ob not in self.books or pair.figi_Pref not in self.books:
+            return (spread, None), (spread, None)
+        budget = pair.allocation * self.capital()
+        return pair.executable_spreads(self.books, self.prices, self.balance(pair.figi_Ob), self.balance(pair.figi_Pref), budget)
+
+    # Решение и спред того направления, по которому оно принято. Внутри коридора -
+    # спред перехода, которого ждем из текущей позиции
+    def decision(self, pair, spread):
+        with METRICS.timer('decision_seconds'):
+            if pair.levels is None:
+                return spread, None, HOLD                   # Порогов в рублях еще нет: статистики мало
+            KObich, KPrefa = self.balance(pair.figi_Ob), self.balance(pair.figi_Pref)
+            (to_Ob, slippage_Ob), (to_Pref, slippage_Pref) = self.decision_spreads(pair, spread)
+            price_1, price_2 = pair.levels
+            action = decide_executable(to_Ob, to_Pref, price_1, price_2, KObich, KPrefa)
+        if to_Ob is not None and to_Ob < price_1:
+            return to_Ob, slippage_Ob, action
+        if to_Pref is not None and to_Pref > price_2:
+            return to_Pref, slippage_Pref, action
+        if KPrefa > 0:
+            return to_Ob, slippage_Ob, action
+        return to_Pref, slippage_Pref, action
+
+    # Логика перекладки по текущему спреду пары: вызывается на каждое новое значение спреда.
+    # received - когда получен тик, запустивший проверку (time.perf_counter)
+    def check_pair(self, pair, received: Optional[float] = None):
+
+        spread, LastPrice_Ob, LastPrice_Pref = pair.spread(self.prices)
+        pair.observe(spread, self.now())
+
+        if self.pending_switch is not None and self.pending_switch['pair'] == pair.name:
+            self.finish_switch(pair)
+            return
+
+        # Возраст спреда - по более старой из двух цен
+        observed = min(self.price_times.get(pair.figi_Ob, 0), self.price_times.get(pair.figi_Pref, 0))
+        if observed:
+            METRICS.observe('spread_age_seconds', max(0.0, time.time() - observed))
+
+        # Решаем по модели портфеля; сверяемся с брокером перед сделкой, только если модели нельзя доверять
+        decision_spread, slippage, action = self.decision(pair, spread)
+        if action != HOLD and self.portfolio.needs_sync():
+            self.refresh_portfolio()
+            decision_spread, slippage, action = self.decision(pair, spread)
+        decided = time.perf_counter()
+        if received is not None:
+            METRICS.observe('tick_to_decision_seconds', decided - received)
+
+        if action == HOLD:
+            if time.time() - pair.last_status >= STATUS_INTERVAL:
+                pair.last_status = time.time()
+                self.print_status(pair, spread, LastPrice_Ob, LastPrice_Pref, decision_spread, slippage)
+                if pair.levels is None:
+                    print(f'Статистики спреда пока мало: {pair.stats.count} из {pair.stats.min_samples} наблюдений, перекладку не делаем.')
+                elif decision_spread is None:
+                    print('Глубины стакана не хватает на наш объем, перекладку не делаем.')
+                elif decision_spread < pair.levels[0]:
+                    print('У нас в портфеле обычки', self.balance(pair.figi_Ob), 'шт. Ждем роста обычки.')
+                elif decision_spread > pair.levels[1]:
+                    print('У нас в портфеле префов', self.balance(pair.figi_Pref), 'шт. Ждем роста префов.')
+                print("---------------------------------------------")
+            return
+
+        if self.journal is not None:
+            self.journal.decision(pair, spread, decision_spread, slippage, action,
+                                  self.balance(pair.figi_Ob), self.balance(pair.figi_Pref))
+        if decision_spread < pair.levels[0]:
+            print ('Спред меньше', pair.levels[0], 'делаем соотношение 100% в обычке и 0% в префе')
+        else:
+            print ('Спред больше', pair.levels[1], 'делаем соотношение 0% в обычке и 100% в префе')
+        self.print_status(pair, spread, LastPrice_Ob, LastPrice_Pref, decision_spread, slippage)
+
+        if action == SWITCH_TO_OB:
+            KPrefa = self.balance(pair.figi_Pref)
+            print('У нас в портфеле префа', KPrefa, 'шт. нужно их продать и купить обычку')
+            self.switch_legs(pair, pair.figi_Pref, pair.info_Pref, KPrefa, pair.figi_Ob, pair.info_Ob)
+
+        elif action == SWITCH_TO_PREF:
+            KObich = self.balance(pair.figi_Ob)
+            print('У нас в портфеле обычка', KObich, 'шт. нужно ее продать и купить префа')
+            self.switch_legs(pair, pair.figi_Ob, pair.info_Ob, KObich, pair.figi_Pref, pair.info_Pref)
+
+        elif action == BUY_OB:
+            print(f'В портфеле нет акций {pair.name_Ob}, нужно купить обычку')
+            self.buy_on_all_money(pair, pair.figi_Ob, pair.info_Ob)
+
+        elif action == BUY_PREF:
+            print(f'В портфеле нет акций {pair.name_Pref}, нужно купить префа')
+            self.buy_on_all_money(pair, pair.figi_Pref, pair.info_Pref)
+
+        METRICS.observe('decision_to_fill_seconds', time.perf_counter() - decided, action=action)
+        print("---------------------------------------------")
+
+    # Одна итерация опроса: один запрос цен по всем бумагам, сверка портфеля при необходимости, проверка всех пар
+    def poll_once(self):
+        self.refresh_prices()
+        self.sync_portfolio()
+        for pair in self.pairs:
+            self.check_pair(pair)
+
+    # Торговля по общему потоку последних цен: тик любой бумаги проверяет только ее пару.
+    # until - конец торговой сессии: в этот момент поток останавливается по таймеру
+    def run_streaming(self, until: Optional[datetime.datetime] = None):
+
+        # Начальные цены берем запросом, чтобы не ждать первой сделки по каждой бумаге
+        self.poll_once()
+
+        stream = self.session.client.create_market_data_stream()
+        stream.last_price.subscribe([LastPriceInstrument(figi=figi) for figi in self.figis])
+        if EXECUTABLE_SPREAD:
+            stream.order_book.subscribe([OrderBookInstrument(figi=figi, depth=BOOK_DEPTH) for figi in self.figis])
+
+        closer = None
+        if until is not None:
+            closer = threading.Timer(max(0.0, (until - now_utc()).total_seconds()), stream.stop)
+            closer.daemon = True
+            closer.start()
 
-                PositionResponse = client.operations.get_positions(account_id=Account_id)
-
-                # Извлекаем информацию о деньгах
-                money_info = PositionResponse.money
-                for money in money_info:
-                    currency = money.currency
-                    units = money.units
-                    print(f"Денег: {units} {currency}")
-
-                # Извлекаем информацию о ценных бумагах
-                securities_info = PositionResponse.securities
-                for security in securities_info:
-                    figi = security.figi
-                    balance = security.balance
-                    # Используем функцию get_instrument_info для получения тикера и имени по FIGI
-                    instrument_info = get_instrument_info(df, FIGI=figi)
-                    if isinstance(instrument_info, dict):
-                        print(f"Акции: Тикер: Название: '{instrument_info['name']}', '{instrument_info['ticker']}' - {balance} шт.")
-                    else:
-                        print(instrument_info)
-                break
+        try:
+            for figi in stream_market_data(stream, self.prices, self.books, self.lot_sizes, self.price_times, self.journal):
+                self.check_pair(self.pairs_by_figi[figi], time.perf_counter())
+        except Exception as e:
+            self.session.handle_error(e)
+            raise
+        finally:
+            if closer is not None:
+                closer.cancel()
+            stream.stop()
+
+    # Окно статистики спреда заполняем по сохраненным минутным свечам (python candles.py),
+    # чтобы пороги в z-score и перцентилях работали сразу после запуска
+    def seed_spread_stats(self):
+
+        # Окна, восстановленные из снимка состояния, уже заполнены: свечи и numpy не нужны
+        pairs = [pair for pair in self.pairs if pair.threshold != THRESHOLD_ABS and not pair.stats.count]
+        if not pairs:
+            return
+
+        from candles import CANDLES_DIR, CandleStore, align   # numpy нужен только здесь
+        from tinkoff.invest import CandleInterval
+        if not os.path.isdir(CANDLES_DIR):
+            return
+
+        store = CandleStore(CANDLES_DIR)
+        for pair in pairs:
+            times, close_Ob, close_Pref = align(store, pair.figi_Ob, pair.figi_Pref, CandleInterval.CANDLE_INTERVAL_1_MIN)
+            spreads = (close_Ob - close_Pref)[-pair.stats.size:].round(2)
+            if len(spreads):
+                pair.seed(spreads.tolist())
+                print(f'{pair.name}: статистика спреда по {len(spreads)} минутным свечам')
+
+    def refresh_calendar(self):
+        if self.calendar.is_stale():
+            self.calendar = create_trading_calendar(self.session)
+
+    # Прогрев перед открытием: канал, портфель и котировки готовы к первому тику
+    def warm_up(self):
+        print('Прогрев перед открытием биржи')
+        try:
+            self.refresh_portfolio()
+            self.refresh_prices()
+        except Exception as e:
+            print("Не удалось прогреть подключение:", str(e))
 
-            except Exception as e:
+    # Спим до начала следующей сессии, за WARMUP секунд до него прогреваемся
+    def wait_for_open(self):
 
-                print(f"Ошибка при получении информации о портфеле: {e}")
-                print("----------------------------------------------")
-                retries += 1
-                time.sleep(10)  # Подождать перед повторным запросом
-        else:
+        upcoming = self.calendar.next_session()
+        if upcoming is None:
+            print('В расписании торгов нет следующей сессии, проверим через час')
+            time.sleep(3600)
+            return
 
-            print("Не удалось получить информацию о портфеле после", MAX_RETRIES, "попыток.")
-            print("----------------------------------------------")
+        start = upcoming[0]
+        print(f'Биржа не работает, следующая сессия {start.astimezone():%d.%m.%Y %H:%M}')
+        print("------------------------------------------")
+        sleep_until(start - datetime.timedelta(seconds=WARMUP))
+        self.warm_up()
+        sleep_until(start)
 
-        Securities = PositionResponse.securities
+    def run(self):
 
-        KObich = 0
-        KPrefa = 0
+        stream_retry_at = 0.0                               # Когда снова пробовать подключиться к потоку
+        start_export(self.metrics_port)
+        self.seed_spread_stats()
+        self.refresh_portfolio()
+        if POSITIONS_STREAM:
+            self.start_positions_stream()
 
-        for security in Securities:
-            if security.figi == figi_Pref:
-                KPrefa = security.balance
-            if security.figi == figi_Ob:
-                KObich = security.balance
+        while True:
 
-        return KPrefa, KObich, Securities, PositionResponse
+                try:
 
-# Функция для вычисления последней цены
-def get_last_prices(TOKEN, figi_Ob, figi_Pref):
-    
-    with Client(TOKEN) as client:
-        # Если произошла ошибка "Stream removed" или другие ошибки, связанные с соединением, можно попробовать повторить запрос через некоторый промежуток времени.
-        retries = 0
-        while retries < MAX_RETRIES:
-            try:
-                LastPriceObich = client.market_data.get_order_book(figi=figi_Ob, depth=5).last_price
-                LastPricePrefa = client.market_data.get_order_book(figi=figi_Pref, depth=5).last_price
-                break
-            except Exception as e:
-                print(f"Ошибка при получении цены акции: {e}")
-                retries += 1
-                time.sleep(10)  # Подождать перед повторным запросом
-        else:
-            print("Не удалось получить цену акции после", MAX_RETRIES, "попыток.")
+                    self.refresh_calendar()
+                    trading = self.calendar.current()
+
+                    if trading is not None:
 
-        LastPrice_Ob = LastPriceObich.units + LastPriceObich.nano * 1e-9
-        LastPrice_Pref = LastPricePrefa.units + LastPricePrefa.nano * 1e-9
+                        start, end = trading
+                        if STREAM_MODE and time.time() >= stream_retry_at:
+                            try:
+                                self.run_streaming(end)
+                                continue
+                            except Exception as e:
+                                # Поток упал: до следующей попытки работаем опросом раз в 30 секунд
+                                print("Поток рыночных данных прервался, переходим на опрос:", str(e))
+                                print("------------------------------------------")
+                                stream_retry_at = time.time() + STREAM_RETRY_DELAY
 
-        spread = round(LastPrice_Ob - LastPrice_Pref, 2)
+                        self.poll_once()
+                        time.sleep(max(0.0, min(30, (end - now_utc()).total_seconds())))
 
-        return spread, LastPrice_Ob, LastPrice_Pref
+                    else:
 
-# Функция покупки/продажи
-def trade (TOKEN, Order, Account_id, KolVo, FigiStock, OrderDirection):
+                        self.wait_for_open()
 
-    with Client(TOKEN) as client:
-        # Если произошла ошибка "Stream removed" или другие ошибки, связанные с соединением, можно попробовать повторить запрос через некоторый промежуток времени.
-        retries = 0
-        while retries < MAX_RETRIES:
-            try:
-                client.orders.post_order(                           # Создаем заявку
-                order_id=Order,                                     # id заявки - текущее время
-                figi=FigiStock,                                     # Бумага
-                quantity=int(KolVo),                                     # Для бумаг где в лоте 1 шт.
-                account_id=Account_id,
-                direction=OrderDirection,                           # Заявка на покупку или продажу
-                order_type=OrderType.ORDER_TYPE_BESTPRICE           # По лучшей цене
-                )
-                if OrderDirection == OrderDirection.ORDER_DIRECTION_BUY: 
-                    print('Купили', KolVo, 'шт.')                   # Для бумаг где в лоте 1 шт.
-                else: 
-                    print('Продали', KolVo, 'шт.')                  # Для бумаг где в лоте 1 шт.
-                time.sleep(10)                                      # Даем время на покупку/продажу
-                break                                               # Выходим из цикла, если выставили заявку
-            except Exception as e:  
-                print(f"Ошибка при создании ордера: {e}")
-                retries += 1
-                time.sleep(10)  # Подождать перед повторным запросом
-        else:
-            print("Не удалось создать ордер после", MAX_RETRIES,"попыток.")
+                except Exception as e:
+
+                    print("Произошла ошибка:", str(e))
+                    print("------------------------------------------")
 
 if __name__ == '__main__':
 
     print("---------------------------------------------")
     print('Скрипт торговли по спреду обычка/преф запущен')
     print("---------------------------------------------")
-    TOKEN, Account_id = user_input_token()
+    session, Account_id = user_input_token()
     print('Запрашиваю информацию об инструментах...')
-    df = create_instruments_dataframe()
-    print("---------------------------------------------")
-    figi_Ob, figi_Pref = user_input_tiker(df)
-    info_Ob = get_instrument_info(df, FIGI=figi_Ob)
-    info_Pref = get_instrument_info(df, FIGI=figi_Pref)
-    name_Ob = info_Ob.get('name', 'Неизвестное название')
-    name_Pref = info_Pref.get('name', 'Неизвестное название')
-    print("---------------------------------------------")
-    print('Портфель:')
-    KPrefa, KObich, Securities, PositionResponse = get_portfolio_info(TOKEN, df)
-    print("---------------------------------------------")
-    price_1, price_2 = user_input_spread()
+    catalog = create_instruments_catalog(session)
+    calendar = create_trading_calendar(session)
     print("---------------------------------------------")
 
-    while True:
-
-            try:
+    if os.path.exists(PAIRS_CONFIG_FILE):
 
-                if is_weekday() and (is_within_time_interval(datetime.time(10, 0), datetime.time(18, 45)) or is_within_time_interval(datetime.time(19, 0), datetime.time(23, 59))):
-
-                    spread, LastPrice_Ob, LastPrice_Pref = get_last_prices(TOKEN, figi_Ob, figi_Pref)
-
-                    # Спред меньше price_1 покупаем обычку если ничего нет, или продаем префа и покупаем обычку
-                    if spread < price_1:
-                        
-                        print ('Спред меньше 1 делаем соотношение 0% в обычке и 100% в префе') 
-                        print ('Текущий спред', spread)
-                        print ('Цена обычки =', LastPrice_Ob)
-                        print ('Цена префов =', LastPrice_Pref)
-                        print ('Дата:', datetime.datetime.now()) 
-                        print('Портфель:')
-                        KPrefa, KObich, Securities, PositionResponse = get_portfolio_info(TOKEN, df)
-
-                        KolVo_Ob = 0
-                        KolVo_Pref = 0
-                        figi_Ob_found = 0
-                        figi_Pref_found = 0
-
-                        # Пробегаемся циклом по массиву акций
-                        for security in Securities:
-                            # Проверяем есть ли в портфеле обычка
-                            if security.figi == figi_Ob:
-                                KolVo_Ob = security.balance
-                                figi_Ob_found = 1
-                            elif security.figi == figi_Pref:
-                                KolVo_Pref = security.balance
-                                figi_Pref_found = 1
-
-                        # Если у нас в портфеле префа мы их продаем и покупаем обычку
-                        if figi_Pref_found > 0:
-                            
-                            # Совершаем продажу
-                            print('У нас в портфеле префа', KolVo_Pref, 'шт. нужно их продать и купить обычку')
-                            lot_size = info_Pref.get('lot_size', 'Информация о лотности не найдена')
-                            KolVo_Pref = KolVo_Pref/lot_size 
-                            trade (TOKEN, str(uuid.uuid4()), Account_id, KolVo_Pref, figi_Pref, OrderDirection.ORDER_DIRECTION_SELL)
-                            
-                            # Получаем информацию для покупки
-                            KPrefa, KObich, Securities, PositionResponse = get_portfolio_info(TOKEN, df)
-                            spread, LastPrice_Ob, LastPrice_Pref = get_last_prices(TOKEN, figi_Ob, figi_Pref)
-                            Money =  int(PositionResponse.money[0].units)
-                            lot_size = info_Ob.get('lot_size', 'Информация о лотности не найдена')
-                            KolVo = int(Money/LastPrice_Ob/lot_size*0.98)
-                            print(f'Денег {Money}, можем купить {KolVo} шт. по цене {LastPrice_Ob}')
-                            trade (TOKEN, str(uuid.uuid4()), Account_id, KolVo, figi_Ob, OrderDirection.ORDER_DIRECTION_BUY)
-
-                        elif figi_Ob_found > 0:
-
-                            print('У нас в портфеле обычки', KolVo_Ob, 'шт. Ждем роста обычки.')
-                            
-                        elif figi_Ob_found == 0 and figi_Pref_found == 0:
-
-                            print(f'В портфеле нет акций {name_Ob}, нужно купить обычку')
-
-                            # Получаем информацию для покупки
-                            spread, LastPrice_Ob, LastPrice_Pref = get_last_prices(TOKEN, figi_Ob, figi_Pref)
-                            Money =  int(PositionResponse.money[0].units)
-                            lot_size = info_Ob.get('lot_size', 'Информация о лотности не найдена')
-                            print(f'Денег {Money}, можем купить {KolVo} шт. по цене {LastPrice_Ob}')
-                            KolVo = int(Money/LastPrice_Ob/lot_size*0.98)
-                            trade (TOKEN, str(uuid.uuid4()), Account_id, KolVo, figi_Ob, OrderDirection.ORDER_DIRECTION_BUY)
-                                
-                        print("---------------------------------------------")
-
-                    # Спред больше price_2 покупаем префа если ничего нет, или продаем обычку и покупаем префа
-                    elif spread > price_2:
-                        
-
-                        print ('Спред меньше 1 делаем соотношение 0% в обычке и 100% в префе') 
-                        print ('Текущий спред', spread)
-                        print ('Цена обычки =', LastPrice_Ob)
-                        print ('Цена префов =', LastPrice_Pref)
-                        print ('Дата:', datetime.datetime.now()) 
-                        print('Портфель:')
-                        KPrefa, KObich, Securities, PositionResponse = get_portfolio_info(TOKEN, df)
-
-                        KolVo_Ob = 0
-                        KolVo_Pref = 0
-                        figi_Ob_found = 0
-                        figi_Pref_found = 0
-
-                        # Пробегаемся циклом по массиву акций
-                        for security in Securities:
-                            # Проверяем есть ли в портфеле обычка
-                            if security.figi == figi_Ob:
-                                KolVo_Ob = security.balance
-                                figi_Ob_found = 1
-                            elif security.figi == figi_Pref:
-                                KolVo_Pref = security.balance
-                                figi_Pref_found = 1
-
-                        # Если у нас в портфеле обычка мы ее продаем и покупаем префа
-                        if figi_Ob_found > 0:
-
-                            # Совершаем продажу
-                            print('У нас в портфеле обычка', KolVo_Ob, 'шт. нужно ее продать и купить префа')
-                            lot_size = info_Ob.get('lot_size', 'Информация о лотности не найдена')
-                            KolVo_Ob = KolVo_Ob/lot_size
-                            trade (TOKEN, str(uuid.uuid4()), Account_id, KolVo_Ob, figi_Ob, OrderDirection.ORDER_DIRECTION_SELL)
-
-                            # Получаем информацию для покупки
-                            KPrefa, KObich, Securities, PositionResponse = get_portfolio_info(TOKEN, df)
-                            spread, LastPrice_Ob, LastPrice_Pref = get_last_prices(TOKEN, figi_Ob, figi_Pref)
-                            Money =  int(PositionResponse.money[0].units)
-                            lot_size = info_Pref.get('lot_size', 'Информация о лотности не найдена')
-                            KolVo = int(Money/LastPrice_Pref/lot_size*0.98)
-                            print(f'Денег {Money}, можем купить {KolVo} шт. по цене {LastPrice_Pref}')
-                            trade (TOKEN, str(uuid.uuid4()), Account_id, KolVo, figi_Pref, OrderDirection.ORDER_DIRECTION_BUY)
-
-                        elif figi_Pref_found > 0:
-
-                            print('У нас в портфеле префов', KolVo_Pref, 'шт. Ждем роста префов.')
-
-                        elif figi_Ob_found == 0 and figi_Pref_found == 0:
-
-                            print(f'В портфеле нет акций {name_Pref}, нужно купить обычку')
-
-                            # Получаем информацию для покупки
-                            spread, LastPrice_Ob, LastPrice_Pref = get_last_prices(TOKEN, figi_Ob, figi_Pref)
-                            Money =  int(PositionResponse.money[0].units)
-                            lot_size = info_Pref.get('lot_size', 'Информация о лотности не найдена')
-                            KolVo = int(Money/LastPrice_Pref/lot_size*0.98)
-                            print(f'Денег {Money}, можем купить {KolVo} шт. по цене {LastPrice_Pref}')
-                            trade (TOKEN, str(uuid.uuid4()), Account_id, KolVo, figi_Pref, OrderDirection.ORDER_DIRECTION_BUY)
-
-                        print("---------------------------------------------")
-                        
-                    else:
+        # Все пары из файла настроек торгуются одновременно
+        pairs = load_pairs(catalog)
+        for pair in pairs:
+            print(f'{pair.name}: спред {pair.describe_thresholds()}, доля капитала {pair.allocation:.0%}')
 
-                        print ('Текущий спред', spread)
-                        print ('Цена обычки =', LastPrice_Ob)
-                        print ('Цена префов =', LastPrice_Pref)
-                        print ('Дата:', datetime.datetime.now()) 
-                        print('Портфель:')
-                        KPrefa, KObich, Securities, PositionResponse = get_portfolio_info(TOKEN, df)
-                        print("---------------------------------------------")
-                        
-                    time.sleep(30)
+    else:
 
-                else:
+        figi_Ob, figi_Pref = user_input_tiker(catalog)
+        info_Ob = get_instrument_info(catalog, FIGI=figi_Ob)
+        info_Pref = get_instrument_info(catalog, FIGI=figi_Pref)
+        print("---------------------------------------------")
+        print('Портфель:')
+        get_portfolio_info(session, Account_id, catalog)
+        print("---------------------------------------------")
+        price_1, price_2 = user_input_spread()
+        pairs = [SpreadPair(info_Ob, info_Pref, price_1, price_2)]
 
-                    print('Биржа не работает ')
-                    time.sleep(300)
-
-            except Exception as e:
+    print("---------------------------------------------")
 
-                print("Произошла ошибка:", str(e))
-                print("------------------------------------------")
+    journal = Journal() if JOURNAL else None
+    if journal is not None:
+        print('Журнал сессии:', journal.path)
+    try:
+        SpreadEngine(session, Account_id, catalog, pairs, calendar, journal).run()
+    finally:
+        if journal is not None:
+            journal.close()
@@ -0,0 +1,80 @@
+"""Снимок состояния стратегии на диске, чтобы после перезапуска продолжить с того же места.
+
+В снимке - окна статистики спреда всех пар: без них пороги в z-score и перцентилях снова
+ждали бы сотни наблюдений или загрузки минутных свечей. Снимок пишется атомарно раз в
+STATE_INTERVAL секунд фоновым потоком и при остановке.
+
+Кроме окон, в снимке идущая перекладка: пара, целевая нога, номер заявки на продажу и номера
+всех ее заявок. Снимок сохраняется перед выставлением каждой заявки перекладки и после ее
+завершения, поэтому после падения снимаются только заявки перекладки, а покупка целевой ноги
+доводится, если продажа успела исполниться. Портфель в снимок не входит: после перезапуска он все равно сверяется с брокером.
+"""
+
+import json, os, threading, time
+from typing import List, Optional
+
+STATE_FILE = 'state.json'
+STATE_INTERVAL = 60                                     # Как часто сохранять снимок, сек
+STATE_VERSION = 1
+
+_save_lock = threading.Lock()                           # Снимок пишут и фоновый поток, и перекладка
+
+# Перекладки, которые нужно довести после перезапуска: идущая и еще не доведенная с прошлого запуска
+def engine_switches(engine) -> List[dict]:
+    return [dict(switch, order_ids=list(switch['order_ids']))
+            for switch in (engine.switch, engine.pending_switch) if switch is not None]
+
+def engine_state(engine) -> dict:
+    return {
+        'version': STATE_VERSION,
+        'saved': time.time(),
+        'account_id': engine.Account_id,
+        'pairs': {pair.name: {
+            'threshold': pair.threshold,
+            'price_1': pair.price_1,
+            'price_2': pair.price_2,
+            'stats': pair.stats.state(),
+        } for pair in engine.pairs},
+        'switches': engine_switches(engine),
+    }
+
+def save_state(engine, path: str = STATE_FILE):
+    tmp_path = path + '.tmp'
+    with _save_lock:
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(engine_state(engine), f)
+        os.replace(tmp_path, path)
+
+def load_state(path: str = STATE_FILE) -> Optional[dict]:
+    try:
+        with open(path, encoding='utf-8') as f:
+            state = json.load(f)
+    except (OSError, ValueError):
+        return None
+    return state if state.get('version') == STATE_VERSION else None
+
+# Окна статистики пар из снимка; пары, которых в снимке нет, начинают с пустого окна.
+# Возвращает названия восстановленных пар
+def restore_state(engine, state: dict) -> List[str]:
+    elapsed = max(0.0, time.time() - state['saved'])
+    restored = []
+    for pair in engine.pairs:
+        item = state['pairs'].get(pair.name)
+        if item is not None:
+            pair.restore_stats(item['stats'], elapsed)
+            restored.append(pair.name)
+    return restored
+
+def start_state_saver(engine, path: str = STATE_FILE, interval: float = STATE_INTERVAL) -> threading.Thread:
+
+    def loop():
+        while True:
+            time.sleep(interval)
+            try:
+                save_state(engine, path)
+            except OSError as e:
+                print(f"Не удалось сохранить состояние: {e}")
+
+    thread = threading.Thread(target=loop, name='state-saver', daemon=True)
+    thread.start()
+    return thread
@@ -0,0 +1,4 @@
+import os, sys
+
+# Модули стратегии лежат в корне репозитория, а не в пакете
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,34 @@
+import contextlib, functools, io
+
+import spread_strategy as strategy
+from fake_invest import FakeClient, FakeMarket
+from resilience import RATE_LIMITS, Resilience
+
+def make_engine(market, figis):
+    resilience = Resilience(rate_limits={method: 10 ** 9 for method in RATE_LIMITS})
+    session = strategy.ClientSession('token', client_factory=functools.partial(FakeClient, market=market), resilience=resilience)
+    catalog = strategy.InstrumentCatalog()
+    catalog.update_type('shares', [{'ticker': i.ticker, 'figi': i.figi, 'type': 'shares', 'name': i.name, 'lot_size': i.lot}
+                                   for i in market.instruments('shares')])
+    pairs = [strategy.SpreadPair(catalog.by_figi[ob], catalog.by_figi[pref], 1, 3, 0.5) for ob, pref in figis]
+    engine = strategy.SpreadEngine(session, 'account', catalog, pairs)
+    engine.orders.poll_interval = 0
+    engine.orders.timeout = 0.05
+    with contextlib.redirect_stdout(io.StringIO()):
+        engine.refresh_portfolio()
+        engine.refresh_prices()
+    return engine
+
+# Две пары по половине капитала. Продажа префов пары A исполнилась наполовину: покупка обычки
+# идет только на свободную часть доли пары, а не на всю долю поверх непроданного остатка
+def test_partial_sell_buys_only_rest_of_allocation():
+    market = FakeMarket({'A': 100.0, 'AP': 100.0, 'B': 100.0, 'BP': 100.0}, money=100000.0,
+                        positions={'AP': 1000}, fill_ratio=0.5)
+    engine = make_engine(market, [('A', 'AP'), ('B', 'BP')])
+    pair = engine.pairs[0]
+    with contextlib.redirect_stdout(io.StringIO()):
+        engine.switch_legs(pair, 'AP', pair.info_Pref, 1000, 'A', pair.info_Ob)
+    assert market.positions['AP'] == 500
+    requested = [order['lots'] for order in market.orders.values() if order['figi'] == 'A']
+    assert len(requested) == 1
+    assert 0 < requested[0] * 100.0 <= 0.5 * 200000 - 500 * 100.0
@@ -0,0 +1,75 @@
+import asyncio, functools, time
+
+import async_strategy
+import spread_strategy as strategy
+from fake_invest import FakeAsyncClient, FakeMarket
+
+def make_strategy(market, price_1, price_2, connect_latency=0.0):
+    catalog = strategy.InstrumentCatalog()
+    catalog.update_type('shares', [{'ticker': i.ticker, 'figi': i.figi, 'type': 'shares', 'name': i.name, 'lot_size': i.lot}
+                                   for i in market.instruments('shares')])
+    session = async_strategy.AsyncClientSession('token', functools.partial(FakeAsyncClient, market=market, connect_latency=connect_latency))
+    return async_strategy.AsyncSpreadStrategy(session, 'account', catalog, 'OB', 'PREF', price_1, price_2)
+
+# Перекладка ждет исполнения заявок по их статусу, а не фиксированные 10 секунд
+def test_switch_waits_for_fill_not_fixed_sleep():
+    market = FakeMarket({'OB': 300.0, 'PREF': 296.0}, positions={'OB': 100}, lot_sizes={'OB': 10, 'PREF': 10}, fill_delay=0.05)
+    st = make_strategy(market, 1, 3)
+    st.orders.poll_interval = 0.01
+
+    async def main():
+        await st.refresh()
+        started = time.perf_counter()
+        st.on_spread(*st.spread())
+        await st.rebalance_task
+        return time.perf_counter() - started
+
+    elapsed = asyncio.run(main())
+    assert elapsed < 2
+    assert market.positions.get('OB', 0) == 0
+    assert market.positions['PREF'] > 0
+    assert st.KPrefa == market.positions['PREF']
+
+# Спред последних сделок ниже price_1, но по стакану переход в обычку исполнился бы выше порога
+def test_wide_book_holds():
+    market = FakeMarket({'OB': 300.0, 'PREF': 299.2}, positions={'PREF': 100}, lot_sizes={'OB': 1, 'PREF': 1}, tick=0.5)
+    st = make_strategy(market, 1, 3)
+
+    async def main():
+        await st.refresh()
+        spread = st.spread()
+        st.on_spread(*spread)
+        return spread[0]
+
+    assert asyncio.run(main()) < 1
+    assert st.rebalance_task is None
+
+# Расписание идет через асинхронную сессию, а пустое расписание не перечитывается на каждом проходе
+def test_calendar_update_uses_async_session(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    market = FakeMarket({'OB': 300.0, 'PREF': 296.0})
+    market.sessions = []
+    st = make_strategy(market, 1, 3)
+
+    async def main():
+        for _ in range(3):
+            if st.calendar.is_stale():
+                await st.update_calendar()
+        await st.session.close()
+
+    asyncio.run(main())
+    assert market.connects == 1                             # Отдельный синхронный канал не открывался
+    assert market.calls == 1
+    assert st.calendar.next_session() is None
+
+# Цены и портфель запрашиваются через gather: канал открывается один раз
+def test_concurrent_requests_open_one_channel():
+    market = FakeMarket({'OB': 300.0, 'PREF': 296.0}, positions={'OB': 100})
+    st = make_strategy(market, 1, 3, connect_latency=0.01)
+
+    async def main():
+        await st.refresh()
+        await st.session.close()
+
+    asyncio.run(main())
+    assert market.connects == 1
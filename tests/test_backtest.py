@@ -0,0 +1,58 @@
+import numpy as np
+
+import backtest
+from spread_strategy import BUY_OB, HOLD, SWITCH_TO_OB, decide
+
+def make_closes(n=5000, seed=1):
+    rng = np.random.default_rng(seed)
+    close_Pref = np.round(250 + np.cumsum(rng.normal(0, 0.3, n)), 2)
+    close_Ob = np.round(close_Pref + 2 + 2.5 * np.sin(np.arange(n) / 150) + rng.normal(0, 0.3, n), 2)
+    return close_Ob, close_Pref
+
+# Прямой перебор свечей с decide() из торгового скрипта: эталон для векторного бэктеста
+def bar_by_bar(close_Ob, close_Pref, price_1, price_2, lot_Ob, lot_Pref, money=backtest.MONEY, commission=backtest.COMMISSION):
+    spread = backtest.spread_series(close_Ob, close_Pref)
+    prices = {1: close_Ob, -1: close_Pref}
+    lots = {1: lot_Ob, -1: lot_Pref}
+    quantity = {1: 0, -1: 0}
+    trades = 0
+    for i in range(len(spread)):
+        action = decide(spread[i], price_1, price_2, quantity[1], quantity[-1])
+        if action == HOLD:
+            continue
+        leg = 1 if action in (BUY_OB, SWITCH_TO_OB) else -1
+        if quantity[-leg]:
+            value = quantity[-leg] * prices[-leg][i]
+            money += value - value * commission
+            quantity[-leg] = 0
+            trades += 1
+        KolVo = int(int(money) / prices[leg][i] / lots[leg] * backtest.BUY_FRACTION)
+        if KolVo > 0:
+            quantity[leg] = KolVo * lots[leg]
+            value = quantity[leg] * prices[leg][i]
+            money -= value + value * commission
+            trades += 1
+    equity = money + quantity[1] * close_Ob[-1] + quantity[-1] * close_Pref[-1]
+    return equity, trades
+
+def test_backtest_matches_bar_by_bar():
+    close_Ob, close_Pref = make_closes()
+    for price_1, price_2 in [(0.5, 3.5), (1.0, 3.0), (-0.5, 4.0), (1.9, 2.1)]:
+        result = backtest.backtest(close_Ob, close_Pref, price_1, price_2, 10, 10)
+        equity, trades = bar_by_bar(close_Ob, close_Pref, price_1, price_2, 10, 10)
+        assert trades > 2
+        assert result['trades'] == trades
+        assert abs(result['equity'] - equity) < 1e-6
+
+def test_optimize_sorted_and_same_in_pool():
+    close_Ob, close_Pref = make_closes(2000)
+    thresholds = backtest.grid(backtest.threshold_range(0, 2, 0.5), backtest.threshold_range(2, 4, 0.5))
+    single = backtest.optimize(close_Ob, close_Pref, thresholds, 10, 10, workers=1)
+    pooled = backtest.optimize(close_Ob, close_Pref, thresholds, 10, 10, workers=2, chunk_size=4)
+    assert [r['equity'] for r in single] == sorted((r['equity'] for r in single), reverse=True)
+    assert {(r['price_1'], r['price_2']): r['equity'] for r in single} == {(r['price_1'], r['price_2']): r['equity'] for r in pooled}
+    assert all(p1 < p2 for p1, p2 in thresholds)
+
+def test_threshold_range_includes_stop():
+    assert backtest.threshold_range(0, 1, 0.25) == [0.0, 0.25, 0.5, 0.75, 1.0]
+    assert backtest.threshold_range(0.1, 0.3, 0.1) == [0.1, 0.2, 0.3]
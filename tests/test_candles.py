@@ -0,0 +1,21 @@
+import datetime, functools
+
+import spread_strategy as strategy
+from candles import CandleStore
+from fake_invest import FakeClient, FakeMarket
+
+def test_update_pages_history_through_session(tmp_path):
+    market = FakeMarket({'A': 100.0})
+    session = strategy.ClientSession('token', client_factory=functools.partial(FakeClient, market=market))
+    market.inject_error('get_candles')                      # Первая страница повторится через Resilience
+    store = CandleStore(str(tmp_path))
+    start = datetime.datetime.now(datetime.timezone.utc).replace(second=0, microsecond=0) - datetime.timedelta(days=3)
+
+    loaded = store.update(session, 'A', 'candle_interval_1_min', start)
+    assert 3 * 1440 <= loaded <= 3 * 1440 + 1
+    assert market.calls == 1 + 4                           # Ошибка + по странице на сутки и хвост
+
+    times = store.column('A', 'candle_interval_1_min', 'time')
+    assert (times[1:] - times[:-1] == 60).all()
+    assert store.update(session, 'A', 'candle_interval_1_min', start) <= 1
+    session.close()
@@ -0,0 +1,48 @@
+import functools, json, time
+
+import pytest
+
+import spread_strategy as strategy
+from fake_invest import FakeClient, FakeMarket
+
+def make_session(market):
+    return strategy.ClientSession('token', client_factory=functools.partial(FakeClient, market=market))
+
+def write_cache(path, updated):
+    types = {method: {'updated': updated.get(method, time.time()), 'items': []} for method in strategy.INSTRUMENT_TYPES}
+    types['shares']['items'] = [{'ticker': 'OLD', 'figi': 'OLD', 'type': 'shares', 'name': 'OLD', 'lot_size': 1}]
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(types, f)
+
+def test_fresh_cache_makes_no_calls(tmp_path):
+    path = str(tmp_path / 'instruments.json')
+    write_cache(path, {})
+    market = FakeMarket({'A': 100.0})
+    catalog = strategy.create_instruments_catalog(make_session(market), path)
+    assert market.calls == 0
+    assert 'OLD' in catalog.by_ticker
+
+def test_only_stale_types_are_refetched(tmp_path):
+    path = str(tmp_path / 'instruments.json')
+    write_cache(path, {'shares': 0})
+    market = FakeMarket({'A': 100.0})
+    catalog = strategy.create_instruments_catalog(make_session(market), path)
+    assert market.calls == 1
+    assert 'A' in catalog.by_ticker and 'OLD' not in catalog.by_ticker
+    with open(path, encoding='utf-8') as f:
+        assert time.time() - json.load(f)['shares']['updated'] < 60
+
+def test_failed_refresh_falls_back_to_cache(tmp_path):
+    path = str(tmp_path / 'instruments.json')
+    write_cache(path, {method: 0 for method in strategy.INSTRUMENT_TYPES})
+    market = FakeMarket({'A': 100.0})
+    market.inject_error('shares', 'PERMISSION_DENIED')
+    catalog = strategy.create_instruments_catalog(make_session(market), path)
+    assert 'OLD' in catalog.by_ticker
+
+def test_cold_start_with_failing_api_raises(tmp_path):
+    market = FakeMarket({'A': 100.0})
+    market.inject_error('shares', 'PERMISSION_DENIED')
+    with pytest.raises(Exception):
+        strategy.create_instruments_catalog(make_session(market), str(tmp_path / 'instruments.json'))
+    assert not (tmp_path / 'instruments.json').exists()
@@ -0,0 +1,52 @@
+import spread_strategy as strategy
+from spread_strategy import BUY_OB, HOLD, SWITCH_TO_OB, SWITCH_TO_PREF, SpreadPair, decide, decide_executable
+
+INFO_OB = {'ticker': 'OB', 'figi': 'OB', 'name': 'OB', 'lot_size': 1}
+INFO_PREF = {'ticker': 'PREF', 'figi': 'PREF', 'name': 'PREF', 'lot_size': 1}
+
+def make_books(bid_Ob, ask_Ob, bid_Pref, ask_Pref, size=1000):
+    return {
+        'OB': ([(bid_Ob, size)], [(ask_Ob, size)]),
+        'PREF': ([(bid_Pref, size)], [(ask_Pref, size)]),
+    }
+
+def test_decide_thresholds():
+    assert decide(0.5, 1, 3, 0, 100) == SWITCH_TO_OB
+    assert decide(0.5, 1, 3, 100, 0) == HOLD
+    assert decide(0.5, 1, 3, 0, 0) == BUY_OB
+    assert decide(3.5, 1, 3, 100, 0) == SWITCH_TO_PREF
+    assert decide(2.0, 1, 3, 0, 100) == HOLD
+
+def test_executable_spreads_use_opposite_sides_of_the_book():
+    pair = SpreadPair(INFO_OB, INFO_PREF, 1, 3)
+    prices = {'OB': 100.2, 'PREF': 99.4}
+    (to_Ob, _), (to_Pref, _) = pair.executable_spreads(make_books(100.0, 100.5, 99.2, 99.6), prices, 0, 100, 10000)
+    assert to_Ob == 1.3                                     # ask обычки - bid префа
+    assert to_Pref == 0.4                                   # bid обычки - ask префа
+
+# Спред перехода в префы ниже price_1, но переход в обычку исполнился бы по 1.3 - выше порога
+def test_wide_book_does_not_switch_to_ob():
+    pair = SpreadPair(INFO_OB, INFO_PREF, 1, 3)
+    prices = {'OB': 100.2, 'PREF': 99.4}
+    (to_Ob, _), (to_Pref, _) = pair.executable_spreads(make_books(100.0, 100.5, 99.2, 99.6), prices, 0, 100, 10000)
+    assert decide_executable(to_Ob, to_Pref, 1, 3, 0, 100) == HOLD
+
+def test_engine_decision_holds_on_wide_book():
+    pair = SpreadPair(INFO_OB, INFO_PREF, 1, 3)
+    engine = strategy.SpreadEngine(None, 'account', strategy.InstrumentCatalog(), [pair])
+    engine.prices.update({'OB': 100.2, 'PREF': 99.4})
+    engine.books.update(make_books(100.0, 100.5, 99.2, 99.6))
+    engine.portfolio.balances = {'PREF': 100}
+    decision_spread, _, action = engine.decision(pair, 0.8)
+    assert action == HOLD
+    assert decision_spread == 1.3
+
+def test_engine_decision_switches_when_executable_spread_crosses():
+    pair = SpreadPair(INFO_OB, INFO_PREF, 1, 3)
+    engine = strategy.SpreadEngine(None, 'account', strategy.InstrumentCatalog(), [pair])
+    engine.prices.update({'OB': 100.2, 'PREF': 99.4})
+    engine.books.update(make_books(100.0, 100.3, 99.5, 99.6))
+    engine.portfolio.balances = {'PREF': 100}
+    decision_spread, _, action = engine.decision(pair, 0.8)
+    assert action == SWITCH_TO_OB
+    assert decision_spread == 0.8
@@ -0,0 +1,95 @@
+import functools
+
+import pytest
+from tinkoff.invest import OrderDirection
+
+import headless
+from fake_invest import ExecutionStatus, FakeClient, FakeMarket
+
+class Crash(Exception):
+    pass
+
+def make_config(tmp_path):
+    return {
+        'token': 'token',
+        'account_id': 'account',
+        'pairs': [{'ticker_Ob': 'OB', 'ticker_Pref': 'PREF', 'price_1': 1, 'price_2': 3}],
+        'state_file': str(tmp_path / 'state.json'),
+        'journal': False,
+        'metrics_port': 0,
+    }
+
+# Процесс падает, когда продажа исполнилась, а покупка выставлена: после перезапуска снимается только
+# заявка перекладки, ручная заявка остается, а целевая нога докупается на первом тике пары
+def test_restart_finishes_interrupted_switch(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    market = FakeMarket({'OB': 300.0, 'PREF': 296.0}, positions={'OB': 100}, lot_sizes={'OB': 10, 'PREF': 10})
+    factory = functools.partial(FakeClient, market=market)
+    market.fill_delay = 100                                 # Заявки висят, пока тест не разрешит исполнение
+    market.post_order('manual', 'PREF', 1, buy=True)
+
+    engine = headless.create_engine(make_config(tmp_path), factory)
+    engine.orders.poll_interval = 0
+    engine.refresh_portfolio()
+    execute = engine.orders.execute
+
+    def crashing_execute(figi, lots, direction, lot_size=1, price=None, order_id=None):
+        if direction != OrderDirection.ORDER_DIRECTION_BUY:
+            market.fill_delay = 0
+            result = execute(figi, lots, direction, lot_size, price, order_id)
+            market.fill_delay = 100
+            return result
+        engine.orders.post(order_id, figi, lots, direction, price)
+        raise Crash
+
+    engine.orders.execute = crashing_execute
+    engine.refresh_prices()
+    with pytest.raises(Crash):
+        engine.check_pair(engine.pairs[0])
+    assert market.positions.get('OB', 0) == 0
+    buy_id = engine.switch['order_ids'][1]
+    engine.session.close()
+
+    restarted = headless.create_engine(make_config(tmp_path), factory)
+    assert market.orders[buy_id]['status'] == ExecutionStatus.EXECUTION_REPORT_STATUS_CANCELLED
+    assert market.orders['manual']['status'] == ExecutionStatus.EXECUTION_REPORT_STATUS_NEW
+    assert restarted.pending_switch['buy'] == 'PREF'
+
+    market.fill_delay = 0
+
+    restarted.orders.poll_interval = 0
+    restarted.refresh_portfolio()
+    restarted.refresh_prices()
+    restarted.check_pair(restarted.pairs[0])
+    assert restarted.pending_switch is None and restarted.switch is None
+    assert market.positions['PREF'] == 430
+    assert market.orders['manual']['executed'] == 0
+    assert headless.load_state(make_config(tmp_path)['state_file'])['switches'] == []
+    restarted.session.close()
+
+# Процесс упал сразу после выставления продажи: после перезапуска продажа снимается,
+# а другая нога не докупается - пара остается в прежней ноге, дальше решает decide()
+def test_restart_drops_switch_when_sell_did_not_fill(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    market = FakeMarket({'OB': 300.0, 'PREF': 296.0}, positions={'OB': 100}, lot_sizes={'OB': 10, 'PREF': 10}, fill_delay=100)
+    factory = functools.partial(FakeClient, market=market)
+
+    engine = headless.create_engine(make_config(tmp_path), factory)
+    engine.refresh_portfolio()
+
+    def crashing_execute(figi, lots, direction, lot_size=1, price=None, order_id=None):
+        engine.orders.post(order_id, figi, lots, direction, price)
+        raise Crash
+
+    engine.orders.execute = crashing_execute
+    engine.refresh_prices()
+    with pytest.raises(Crash):
+        engine.check_pair(engine.pairs[0])
+    sell_id = engine.switch['sell']
+    engine.session.close()
+
+    restarted = headless.create_engine(make_config(tmp_path), factory)
+    assert market.orders[sell_id]['status'] == ExecutionStatus.EXECUTION_REPORT_STATUS_CANCELLED
+    assert restarted.pending_switch is None
+    assert market.positions == {'OB': 100}
+    restarted.session.close()
@@ -0,0 +1,48 @@
+import contextlib, functools, io, sqlite3
+
+import journal
+import spread_strategy as strategy
+from fake_invest import FakeClient, FakeMarket, spread_cycle
+
+# Записываем сессию на бирже-заглушке, где спред ходит по синусоиде, и прогоняем ее заново
+def record_session(path):
+    market = FakeMarket({'A': 300.0, 'B': 296.0}, positions={'A': 100}, lot_sizes={'A': 10, 'B': 10},
+                        script=spread_cycle('A', 'B', 296, -1, 3, 100, 20))
+    session = strategy.ClientSession('token', client_factory=functools.partial(FakeClient, market=market))
+    catalog = strategy.InstrumentCatalog()
+    catalog.update_type('shares', [{'ticker': i.ticker, 'figi': i.figi, 'type': 'shares', 'name': i.name, 'lot_size': i.lot}
+                                   for i in market.instruments('shares')])
+    recorder = journal.Journal(path)
+    engine = strategy.SpreadEngine(session, 'account', catalog, [strategy.SpreadPair(catalog.by_figi['A'], catalog.by_figi['B'], 0, 2)],
+                                   journal=recorder)
+    engine.orders.poll_interval = 0
+    with contextlib.redirect_stdout(io.StringIO()):
+        engine.refresh_portfolio()
+        engine.run_streaming()
+    recorder.close()
+    session.close()
+    return engine, market
+
+def test_replay_reproduces_recorded_switches(tmp_path):
+    path = str(tmp_path / 'session.sqlite')
+    engine, market = record_session(path)
+    assert len(engine.switch_latencies) > 4
+
+    db = sqlite3.connect(path)
+    assert db.execute('SELECT COUNT(*) FROM ticks').fetchone()[0] > 0
+    assert db.execute('SELECT COUNT(*) FROM orders').fetchone()[0] == len(market.orders)
+    db.close()
+
+    result = journal.replay(path)
+    assert result['switches_recorded'] == len(engine.switch_latencies)
+    assert result['switches_replayed'] == result['switches_recorded']
+    assert result['orders_replayed'] == len(market.orders)
+    assert abs(result['equity'] - (market.money + sum(q * market.prices[f] for f, q in market.positions.items()))) < 1.0
+
+# Пороги за пределами спреда: при воспроизведении перекладок нет
+def test_replay_with_other_thresholds(tmp_path):
+    path = str(tmp_path / 'session.sqlite')
+    record_session(path)
+    result = journal.replay(path, price_1=-5, price_2=10)
+    assert result['switches_replayed'] == 0
+    assert result['orders_replayed'] == 0
@@ -0,0 +1,70 @@
+import json
+
+from metrics import LATENCY_BUCKETS, Histogram, Metrics
+
+def samples(text):
+    result = {}
+    for line in text.splitlines():
+        if line and not line.startswith('#'):
+            name, value = line.rsplit(' ', 1)
+            result[name] = float(value)
+    return result
+
+# Корзины в выводе накопительные, +Inf и _count равны числу замеров, _sum - их сумме
+def test_render_histogram():
+    metrics = Metrics()
+    for value in (0.003, 0.003, 0.02, 500):
+        metrics.observe('order_seconds', value, method='post_order')
+    text = metrics.render()
+    assert '# TYPE order_seconds histogram' in text
+    data = samples(text)
+    assert data['order_seconds_bucket{method="post_order",le="0.0025"}'] == 0
+    assert data['order_seconds_bucket{method="post_order",le="0.005"}'] == 2
+    assert data['order_seconds_bucket{method="post_order",le="0.01"}'] == 2
+    assert data['order_seconds_bucket{method="post_order",le="0.025"}'] == 3
+    assert data['order_seconds_bucket{method="post_order",le="120"}'] == 3      # 500 сек - только в +Inf
+    assert data['order_seconds_bucket{method="post_order",le="+Inf"}'] == 4
+    assert data['order_seconds_count{method="post_order"}'] == 4
+    assert abs(data['order_seconds_sum{method="post_order"}'] - 500.026) < 1e-9
+    buckets = [v for k, v in data.items() if k.startswith('order_seconds_bucket')]
+    assert len(buckets) == len(LATENCY_BUCKETS) + 1
+    assert buckets == sorted(buckets)
+
+def test_render_counters_and_labels():
+    metrics = Metrics()
+    metrics.inc('requests_total', method='get_last_prices', code='OK')
+    metrics.inc('requests_total', 2, code='OK', method='get_last_prices')                      # Порядок меток не важен
+    metrics.inc('requests_total', method='post_order', code='RESOURCE_EXHAUSTED')
+    metrics.inc('switches_total')
+    metrics.observe('refresh_seconds', 0.001)
+    text = metrics.render()
+    assert text.count('# TYPE requests_total counter') == 1
+    data = samples(text)
+    assert data['requests_total{code="OK",method="get_last_prices"}'] == 3
+    assert data['requests_total{code="RESOURCE_EXHAUSTED",method="post_order"}'] == 1
+    assert data['switches_total'] == 1
+    assert data['refresh_seconds_bucket{le="0.001"}'] == 1
+    assert data['refresh_seconds_count'] == 1
+
+# Квантиль - верхняя граница корзины, в которую он попал; за последней границей - максимум
+def test_histogram_quantile():
+    histogram = Histogram(buckets=(1, 2, 5))
+    assert histogram.quantile(0.5) is None
+    for value in (0.5, 1, 1.5, 3, 4, 4, 4, 4, 4, 9):
+        histogram.observe(value)
+    assert histogram.quantile(0.1) == 1
+    assert histogram.quantile(0.2) == 1                             # Граница входит в корзину
+    assert histogram.quantile(0.3) == 2
+    assert histogram.quantile(0.9) == 5
+    assert histogram.quantile(0.99) == 9
+
+def test_snapshot():
+    metrics = Metrics()
+    metrics.inc('switches_total', pair='SBER/SBERP')
+    for value in (0.002, 0.004, 0.2):
+        metrics.observe('switch_seconds', value, pair='SBER/SBERP')
+    snapshot = json.loads(json.dumps(metrics.snapshot()))
+    assert snapshot['counters'] == {'switches_total{pair="SBER/SBERP"}': 1}
+    assert snapshot['histograms']['switch_seconds{pair="SBER/SBERP"}'] == {
+        'count': 3, 'sum': 0.206, 'max': 0.2, 'p50': 0.005, 'p90': 0.25, 'p99': 0.25}
+    assert snapshot['uptime'] >= 0
@@ -0,0 +1,73 @@
+import functools
+
+import spread_strategy as strategy
+from fake_invest import ExecutionStatus, FakeClient, FakeMarket
+from order_manager import OrderManager
+from tinkoff.invest import OrderDirection
+
+def make_manager(market, timeout=0.2):
+    session = strategy.ClientSession('token', client_factory=functools.partial(FakeClient, market=market))
+    return OrderManager(session, 'account', poll_interval=0.01, timeout=timeout)
+
+def test_filled_order():
+    market = FakeMarket({'A': 100.0}, lot_sizes={'A': 10})
+    result = make_manager(market).execute('A', 5, OrderDirection.ORDER_DIRECTION_BUY, 10)
+    assert result.filled
+    assert result.quantity == 50
+    assert result.price == 100.0
+    assert market.positions['A'] == 50
+
+# Исполнилась половина: остаток снимается по таймауту, исполненная часть учитывается
+def test_partial_fill_cancels_rest():
+    market = FakeMarket({'A': 100.0}, lot_sizes={'A': 10}, fill_ratio=0.5)
+    result = make_manager(market).execute('A', 4, OrderDirection.ORDER_DIRECTION_BUY, 10)
+    assert result.status == 'EXECUTION_REPORT_STATUS_CANCELLED'
+    assert result.lots_executed == 2
+    assert not result.filled
+    assert market.positions['A'] == 20
+    assert market.orders[result.order_id]['status'] == ExecutionStatus.EXECUTION_REPORT_STATUS_CANCELLED
+
+def test_unfilled_order_is_cancelled_on_timeout():
+    market = FakeMarket({'A': 100.0}, positions={'A': 10}, fill_delay=10)
+    result = make_manager(market, timeout=0.05).execute('A', 10, OrderDirection.ORDER_DIRECTION_SELL)
+    assert result.status == 'EXECUTION_REPORT_STATUS_CANCELLED'
+    assert result.lots_executed == 0
+    assert market.positions['A'] == 10
+
+# Потерянный ответ на post_order: повтор с тем же order_id не создает вторую заявку
+def test_post_retry_does_not_duplicate():
+    market = FakeMarket({'A': 100.0})
+    market.inject_error('post_order')
+    result = make_manager(market).execute('A', 3, OrderDirection.ORDER_DIRECTION_BUY)
+    assert result.filled
+    assert len(market.orders) == 1
+    assert market.positions['A'] == 3
+
+# После перезапуска снимаются только заявки из списка и только не исполненные
+def test_cancel_orders_skips_final_and_foreign():
+    market = FakeMarket({'A': 100.0}, fill_delay=10)
+    manager = make_manager(market)
+    market.post_order('switch', 'A', 1, buy=True)
+    market.post_order('manual', 'A', 1, buy=True)
+    market.fill_delay = 0
+    market.post_order('done', 'A', 1, buy=True)
+    market.fill_delay = 10
+    assert manager.cancel_orders(['switch', 'done']) == {'switch': 0, 'done': 1}
+    assert market.orders['switch']['status'] == ExecutionStatus.EXECUTION_REPORT_STATUS_CANCELLED
+    assert market.orders['done']['status'] == ExecutionStatus.EXECUTION_REPORT_STATUS_FILL
+    assert market.orders['manual']['status'] == ExecutionStatus.EXECUTION_REPORT_STATUS_NEW
+
+# Заявка исполнилась уже после post_order: цена берется из get_order_state, где executed_order_price -
+# сумма заявки, а не цена бумаги. Деньги в модели портфеля совпадают с брокером
+def test_price_of_polled_order_is_per_share():
+    market = FakeMarket({'A': 100.0, 'B': 50.0}, money=10000.0, lot_sizes={'A': 10}, fill_delay=0.02, commission=0.0)
+    session = strategy.ClientSession('token', client_factory=functools.partial(FakeClient, market=market))
+    engine = strategy.SpreadEngine(session, 'account', strategy.InstrumentCatalog(),
+                                   [strategy.SpreadPair({'ticker': 'A', 'figi': 'A', 'lot_size': 10}, {'ticker': 'B', 'figi': 'B', 'lot_size': 1}, 1, 3)])
+    engine.orders.poll_interval = 0.01
+    engine.portfolio.load(market.portfolio())
+    result = engine.execute('A', 5, OrderDirection.ORDER_DIRECTION_BUY, 10)
+    assert result.filled
+    assert result.price == 100.0
+    assert result.amount == 5000.0
+    assert engine.portfolio.money == market.money == 5000.0
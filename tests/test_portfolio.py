@@ -0,0 +1,78 @@
+from types import SimpleNamespace
+
+from fake_invest import money_value
+from portfolio import PortfolioState
+from tinkoff.invest import OrderDirection
+
+FIGI = 'BBG004730N88'
+
+def positions(money, **balances):
+    return SimpleNamespace(money=[money_value(money), money_value(1, 'usd')],
+                           securities=[SimpleNamespace(figi=figi, balance=balance) for figi, balance in balances.items()])
+
+def stream(money, **balances):
+    return SimpleNamespace(money=[SimpleNamespace(available_value=money_value(money))],
+                           securities=[SimpleNamespace(figi=figi, balance=balance) for figi, balance in balances.items()])
+
+def fill(direction, quantity, amount, commission=0.0, status='EXECUTION_REPORT_STATUS_FILL'):
+    return SimpleNamespace(figi=FIGI, direction=direction, quantity=quantity, amount=amount,
+                           commission=commission, status=status, order_id='order-1')
+
+def loaded(money, **balances):
+    portfolio = PortfolioState()
+    portfolio.load(positions(money, **balances))
+    return portfolio
+
+def test_load():
+    portfolio = PortfolioState()
+    assert portfolio.needs_sync()
+    assert portfolio.load(positions(1000.5, **{FIGI: 10, 'EMPTY': 0})) is False    # Первая загрузка - не расхождение
+    assert portfolio.money == 1000.5
+    assert portfolio.balances == {FIGI: 10}
+    assert not portfolio.needs_sync()
+
+# Поток позиций успел прислать итог сделки до того, как мы применили исполнение:
+# исполнение накладывается на остатки до заявки, и сделка не учитывается дважды
+def test_fill_after_stream_update_is_not_counted_twice():
+    portfolio = loaded(1000, **{FIGI: 10})
+    before = portfolio.snapshot(FIGI)
+    portfolio.apply_stream(stream(499, **{FIGI: 20}))
+    portfolio.apply_fill(fill(OrderDirection.ORDER_DIRECTION_BUY, 10, 500, commission=1), before)
+    assert portfolio.balance(FIGI) == 20
+    assert portfolio.money == 499
+    assert not portfolio.dirty
+
+    before = portfolio.snapshot(FIGI)
+    portfolio.apply_stream(stream(998, **{FIGI: 0}))
+    portfolio.apply_fill(fill(OrderDirection.ORDER_DIRECTION_SELL, 20, 500, commission=1), before)
+    assert portfolio.balance(FIGI) == 0
+    assert FIGI not in portfolio.balances
+    assert portfolio.money == 998
+
+def test_negative_balance_marks_dirty():
+    portfolio = loaded(1000, **{FIGI: 5})
+    portfolio.apply_fill(fill(OrderDirection.ORDER_DIRECTION_SELL, 10, 500), portfolio.snapshot(FIGI))
+    assert portfolio.balance(FIGI) == -5
+    assert portfolio.dirty and portfolio.needs_sync()
+
+    portfolio = loaded(100, **{FIGI: 0})
+    portfolio.apply_fill(fill(OrderDirection.ORDER_DIRECTION_BUY, 10, 500), portfolio.snapshot(FIGI))
+    assert portfolio.dirty
+
+def test_unknown_order_outcome_marks_dirty():
+    portfolio = loaded(1000)
+    portfolio.apply_fill(fill(OrderDirection.ORDER_DIRECTION_BUY, 1, 50, status='EXECUTION_REPORT_STATUS_NEW'),
+                         portfolio.snapshot(FIGI))
+    assert portfolio.dirty
+
+# Сверка с брокером находит расхождение и заменяет модель его данными
+def test_load_reports_drift():
+    portfolio = loaded(1000, **{FIGI: 10})
+    assert portfolio.load(positions(1000.4, **{FIGI: 10})) is False                   # Меньше рубля - не расхождение
+    assert portfolio.drifts == 0
+    assert portfolio.load(positions(1000.4, **{FIGI: 7})) is True
+    assert portfolio.load(positions(900, **{FIGI: 7})) is True
+    assert portfolio.drifts == 2
+    assert portfolio.balances == {FIGI: 7}
+    assert portfolio.money == 900
+    assert not portfolio.dirty
@@ -0,0 +1,115 @@
+import random
+
+import pytest
+
+import resilience
+from fake_invest import FakeRequestError
+from resilience import BACKOFF_BASE, BACKOFF_MAX, FAILURE_THRESHOLD, CircuitBreaker, CircuitOpenError, Resilience, TokenBucket
+
+# Часы и сон подменяются: проверяем ожидания без реального ожидания
+class Clock:
+
+    def __init__(self):
+        self.now = 1000.0
+        self.sleeps = []
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(resilience.time, 'monotonic', clock.monotonic)
+    monkeypatch.setattr(resilience.time, 'sleep', clock.sleep)
+    return clock
+
+def test_backoff_bounds():
+    random.seed(1)
+    for attempt in range(12):
+        ceiling = min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt)
+        delays = [resilience.backoff_delay(attempt) for _ in range(200)]
+        assert all(0 <= d <= ceiling for d in delays)
+        assert max(delays) > ceiling / 2                    # Полный джиттер покрывает весь диапазон
+
+# 60 запросов в минуту, запас 2: два запроса сразу, дальше по секунде на токен
+def test_token_bucket_reserve_waits(clock):
+    bucket = TokenBucket(60, capacity=2)
+    assert bucket.reserve() == 0.0
+    assert bucket.reserve() == 0.0
+    assert bucket.reserve() == pytest.approx(1.0)
+    assert bucket.reserve() == pytest.approx(2.0)
+    clock.now += 10                                         # За 10 с запас восполняется, но не выше capacity
+    assert bucket.reserve() == 0.0
+    assert bucket.reserve() == 0.0
+    assert bucket.reserve() == pytest.approx(1.0)
+
+def test_breaker_opens_and_allows_one_probe(clock):
+    breaker = CircuitBreaker(reset_timeout=30)
+    for _ in range(FAILURE_THRESHOLD - 1):
+        breaker.failure()
+    breaker.allow('orders')                                 # Порог еще не достигнут
+    breaker.failure()
+    with pytest.raises(CircuitOpenError):
+        breaker.allow('orders')
+
+    clock.now += 30
+    breaker.allow('orders')                                 # Пробный запрос
+    with pytest.raises(CircuitOpenError):
+        breaker.allow('orders')                             # Второй до итога пробного - нет
+    breaker.success()
+    breaker.allow('orders')
+    breaker.allow('orders')
+
+def test_no_retry_on_non_retryable_code(clock):
+    calls = []
+
+    def fn():
+        calls.append(1)
+        raise FakeRequestError('INVALID_ARGUMENT', 'bad figi')
+
+    with pytest.raises(FakeRequestError):
+        Resilience().call('get_order_book', fn)
+    assert len(calls) == 1
+    assert clock.sleeps == []
+
+def test_retryable_error_is_retried(clock):
+    errors = [FakeRequestError('UNAVAILABLE'), FakeRequestError('UNAVAILABLE')]
+
+    def fn():
+        if errors:
+            raise errors.pop(0)
+        return 'ok'
+
+    layer = Resilience()
+    assert layer.call('get_order_book', fn) == 'ok'
+    assert layer.retries == 2
+    assert layer.breaker('get_order_book').failures == 0    # Успех сбрасывает счетчик
+
+def test_resource_exhausted_waits_for_ratelimit_reset(clock):
+    errors = [FakeRequestError('RESOURCE_EXHAUSTED', 'limit', ratelimit_reset=7)]
+
+    def fn():
+        if errors:
+            raise errors.pop(0)
+        return 'ok'
+
+    assert Resilience().call('get_order_book', fn) == 'ok'
+    assert len(clock.sleeps) == 1
+    assert 7 <= clock.sleeps[0] <= 7 + BACKOFF_BASE
+
+# Серия ошибок размыкает предохранитель всего сервиса: другие его методы тоже ждут
+def test_open_breaker_covers_whole_service(clock):
+    layer = Resilience(max_attempts=FAILURE_THRESHOLD)
+
+    def fn():
+        raise FakeRequestError('UNAVAILABLE')
+
+    with pytest.raises(FakeRequestError):
+        layer.call('post_order', fn)
+    with pytest.raises(CircuitOpenError):
+        layer.call('get_order_state', lambda: 'ok')
+    assert layer.call('get_order_book', lambda: 'ok') == 'ok'
@@ -0,0 +1,32 @@
+import functools, threading, time
+
+import spread_strategy as strategy
+from fake_invest import FakeClient, FakeMarket
+
+def test_concurrent_first_use_opens_one_channel():
+    market = FakeMarket({'A': 100.0})
+    session = strategy.ClientSession('token', client_factory=functools.partial(FakeClient, market=market, connect_latency=0.05))
+    threads = [threading.Thread(target=lambda: session.client) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert market.connects == 1
+    session.close()
+
+def test_positions_stream_survives_main_channel_close():
+    market = FakeMarket({'A': 100.0}, positions={'A': 10})
+    factory = functools.partial(FakeClient, market=market)
+    session = strategy.ClientSession('token', client_factory=factory)
+    engine = strategy.SpreadEngine(session, 'account', strategy.InstrumentCatalog(),
+                                   [strategy.SpreadPair({'ticker': 'A', 'figi': 'A', 'lot_size': 1}, {'ticker': 'B', 'figi': 'B', 'lot_size': 1}, 1, 3)])
+    engine.start_positions_stream()
+    session.client
+    deadline = time.monotonic() + 5
+    while market.connects < 2 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert market.connects == 2                             # Поток позиций открыл свой канал
+    session.close()
+    time.sleep(0.05)
+    assert engine.positions_thread.is_alive()
+    assert market.connects == 2
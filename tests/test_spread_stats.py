@@ -0,0 +1,68 @@
+import random
+from array import array
+
+import numpy as np
+
+from spread_stats import FenwickTree, RollingSpreadStats
+
+def random_spreads(n, seed=1, volatility=0.2):
+    rnd = random.Random(seed)
+    value, values = 0.0, []
+    for _ in range(n):
+        value += rnd.gauss(0, volatility)
+        values.append(round(value, 2))
+    return values
+
+def test_fenwick_from_counts_matches_add():
+    counts = [random.Random(2).randint(0, 5) for _ in range(100)]
+    tree = FenwickTree(100)
+    for i, count in enumerate(counts):
+        tree.add(i, count)
+    assert FenwickTree.from_counts(counts).tree == tree.tree
+
+# Квантили и перцентиль по окну совпадают с точными по последним size значениям,
+# в том числе после того, как спред ушел далеко и корзины перестроились
+def test_quantiles_match_window():
+    stats = RollingSpreadStats(size=2000)
+    values = random_spreads(30000, volatility=0.5)
+    stats.seed(values)
+    window = np.array(values[-2000:])
+    assert stats.count == 2000
+    assert abs(stats.mean() - window.mean()) < 1e-9
+    assert abs(stats.std() - window.std()) < 1e-9
+    for q in (0.05, 0.25, 0.5, 0.75, 0.95):
+        assert stats.quantile(q) == round(float(np.quantile(window, q, method='inverted_cdf')), 2)
+    last = values[-1]
+    assert stats.percentile(last) == 100.0 * np.count_nonzero(window <= last + 1e-9) / len(window)
+
+# Спред мечется шире диапазона корзин: перестройка не чаще раза на count наблюдений
+def test_recenter_is_rate_limited(monkeypatch):
+    stats = RollingSpreadStats(size=1000)
+    rebuilds = []
+    recenter = stats._recenter
+    monkeypatch.setattr(stats, '_recenter', lambda origin: rebuilds.append(origin) or recenter(origin))
+    for i in range(5000):
+        stats.add(-30.0 if i % 2 else 30.0)
+    assert len(rebuilds) <= 15
+    assert stats.quantile(0.5) is not None
+
+def test_restore_round_trip():
+    stats = RollingSpreadStats(size=500)
+    stats.seed(random_spreads(800, seed=3))
+    stats.observe(1.23, now=100.0)
+    restored = RollingSpreadStats(size=500)
+    restored.restore(stats.state(now=110.0), elapsed=5.0, now=200.0)
+    assert list(restored.values()) == list(stats.values())
+    for key, value in stats.snapshot().items():
+        assert abs(restored.snapshot()[key] - value) < 1e-9
+    assert restored.sampled_at == 200.0 - 10.0 - 5.0
+    assert restored.last == 1.23
+
+# Снимок из окна побольше: остаются последние size значений
+def test_restore_into_smaller_window():
+    stats = RollingSpreadStats(size=500)
+    stats.seed(random_spreads(500, seed=4))
+    restored = RollingSpreadStats(size=100)
+    restored.restore(stats.state())
+    assert list(restored.values()) == list(stats.values())[-100:]
+    assert restored.buffer.typecode == array('d').typecode
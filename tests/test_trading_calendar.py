@@ -0,0 +1,59 @@
+import datetime
+from types import SimpleNamespace
+
+from trading_calendar import TradingCalendar, calendar_after_error, day_sessions, merge_sessions
+
+UTC = datetime.timezone.utc
+UNSET = datetime.datetime(1970, 1, 1, tzinfo=UTC)
+
+def at(hour, minute=0, day=19):
+    return datetime.datetime(2026, 10, day, hour, minute, tzinfo=UTC)
+
+def trading_day(start, end, evening=(UNSET, UNSET), premarket=(UNSET, UNSET), is_trading_day=True):
+    return SimpleNamespace(is_trading_day=is_trading_day, start_time=start, end_time=end,
+                           evening_start_time=evening[0], evening_end_time=evening[1],
+                           premarket_start_time=premarket[0], premarket_end_time=premarket[1])
+
+def test_day_sessions():
+    day = trading_day(at(7), at(15, 40), evening=(at(16, 5), at(20, 50)), premarket=(at(4), at(7)))
+    assert day_sessions(day) == [(at(4), at(7)), (at(7), at(15, 40)), (at(16, 5), at(20, 50))]
+    assert day_sessions(day, morning=False) == [(at(7), at(15, 40)), (at(16, 5), at(20, 50))]
+
+# Незаполненные времена (1970-01-01) и неторговый день сессий не дают
+def test_day_sessions_skips_unset_and_non_trading_days():
+    assert day_sessions(trading_day(at(7), at(15, 40))) == [(at(7), at(15, 40))]
+    assert day_sessions(trading_day(UNSET, UNSET)) == []
+    assert day_sessions(trading_day(at(7), at(15, 40), is_trading_day=False)) == []
+
+# Утренняя сессия заканчивается ровно в начале основной: получается один интервал
+def test_merge_sessions_joins_touching_premarket():
+    merged = merge_sessions([(at(7), at(15, 40)), (at(16, 5), at(20, 50)), (at(4), at(7))])
+    assert merged == [(at(4), at(15, 40)), (at(16, 5), at(20, 50))]
+    assert merge_sessions([(at(7), at(12)), (at(10), at(15))]) == [(at(7), at(15))]
+
+def test_current_and_next_at_boundaries():
+    calendar = TradingCalendar([(at(7), at(15, 40)), (at(16, 5), at(20, 50)), (at(7, day=20), at(15, 40, day=20))])
+    assert calendar.current(at(7)) == (at(7), at(15, 40))          # Начало входит в сессию
+    assert calendar.current(at(15, 40)) is None                     # Конец - уже нет
+    assert calendar.next_session(at(15, 40)) == (at(16, 5), at(20, 50))
+    assert calendar.next_session(at(7)) == (at(16, 5), at(20, 50))  # Идущая сессия - не следующая
+    assert calendar.current(at(6, 59)) is None
+    assert calendar.next_session(at(6, 59)) == (at(7), at(15, 40))
+    assert calendar.next_session(at(7, day=20)) is None
+    assert calendar.is_open(at(20, 49))
+
+# Запрос расписания упал, а в кэше нет будущих сессий: торгуем по часам по умолчанию
+def test_calendar_after_error_falls_back_to_default_hours():
+    calendar = TradingCalendar([(at(7, day=1), at(15, day=1))])
+    calendar.checked = 123.0
+    fallback = calendar_after_error(calendar, Exception('UNAVAILABLE'))
+    assert fallback is not calendar
+    assert fallback.next_session() is not None
+    assert fallback.checked == 123.0                                # Повтор не раньше, чем через SCHEDULE_RETRY
+    for start, end in fallback.sessions:
+        assert start.astimezone().weekday() < 5
+
+def test_calendar_after_error_keeps_cache_with_future_sessions():
+    now = datetime.datetime.now(UTC)
+    calendar = TradingCalendar([(now + datetime.timedelta(hours=1), now + datetime.timedelta(hours=2))])
+    assert calendar_after_error(calendar, Exception('UNAVAILABLE')) is calendar
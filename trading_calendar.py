@@ -0,0 +1,174 @@
+"""Расписание торгов биржи: когда открывается и закрывается каждая сессия.
+
+Расписание берется из trading_schedules на несколько дней вперед и хранится в кэше на диске,
+поэтому праздники, сокращенные дни, утренняя и вечерняя сессии учитываются без запросов на
+каждой итерации. Стратегия спит ровно до начала следующей сессии, заранее прогревает канал
+и котировки и останавливает поток в момент закрытия.
+
+Если расписание не удалось получить и кэша нет, используются прежние часы:
+будни 10:00-18:45 и 19:00-23:59 по местному времени.
+"""
+
+import bisect, datetime, json, os, time
+from typing import List, Optional, Tuple
+
+SCHEDULE_EXCHANGE = 'MOEX'                              # Биржа, по расписанию которой торгуем
+SCHEDULE_CACHE_FILE = 'schedule_cache.json'
+SCHEDULE_CACHE_TTL = 6 * 60 * 60                        # Как часто перечитывать расписание, сек
+SCHEDULE_RETRY = 15 * 60                                # Не чаще раза в столько секунд запрашивать расписание повторно
+SCHEDULE_DAYS = 7                                       # На сколько дней вперед запрашивать расписание
+MORNING_SESSION = True                                  # Торговать в утреннюю сессию, если она есть в расписании
+WARMUP = 60                                             # За сколько секунд до открытия прогревать канал и котировки
+
+# Часы торгов без расписания: будни, основная и вечерняя сессии по местному времени
+FALLBACK_SESSIONS = [
+    (datetime.time(10, 0), datetime.time(18, 45)),
+    (datetime.time(19, 0), datetime.time(23, 59)),
+]
+
+Session = Tuple[datetime.datetime, datetime.datetime]
+
+def now_utc() -> datetime.datetime:
+    return datetime.datetime.now(datetime.timezone.utc)
+
+# Незаполненное время в ответе API приходит как 1970-01-01
+def _is_set(ts: Optional[datetime.datetime]) -> bool:
+    return ts is not None and ts.year > 2000
+
+# Торговые интервалы одного дня из TradingDay: утренняя, основная и вечерняя сессии
+def day_sessions(day, morning: bool = MORNING_SESSION) -> List[Session]:
+    if not day.is_trading_day:
+        return []
+    candidates = [(day.start_time, day.end_time), (day.evening_start_time, day.evening_end_time)]
+    if morning:
+        candidates.insert(0, (getattr(day, 'premarket_start_time', None), getattr(day, 'premarket_end_time', None)))
+    return [(start, end) for start, end in candidates if _is_set(start) and _is_set(end) and start < end]
+
+# Склеиваем интервалы, которые касаются или пересекаются (утренняя сессия переходит в основную без перерыва)
+def merge_sessions(sessions: List[Session]) -> List[Session]:
+    merged = []
+    for start, end in sorted(sessions):
+        if merged and start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+# Прежние часы торгов на days дней вперед, начиная с сегодняшнего
+def fallback_sessions(days: int = SCHEDULE_DAYS) -> List[Session]:
+    today = datetime.date.today()
+    sessions = []
+    for i in range(days):
+        date = today + datetime.timedelta(days=i)
+        if date.weekday() > 4:
+            continue                                        # Суббота и воскресенье
+        for start, end in FALLBACK_SESSIONS:
+            sessions.append((datetime.datetime.combine(date, start).astimezone(datetime.timezone.utc),
+                             datetime.datetime.combine(date, end).astimezone(datetime.timezone.utc)))
+    return sessions
+
+class TradingCalendar:
+
+    def __init__(self, sessions: Optional[List[Session]] = None, updated: float = 0.0, exchange: str = SCHEDULE_EXCHANGE):
+        self.sessions = merge_sessions(sessions or [])      # Отсортированные интервалы (начало, конец) в UTC
+        self.starts = [start for start, end in self.sessions]
+        self.updated = updated                              # Когда расписание получено с биржи (unix, сек)
+        self.checked = 0.0                                  # Когда его последний раз запрашивали, даже неудачно
+        self.exchange = exchange
+
+    # Сессия, идущая в момент now, или None
+    def current(self, now: Optional[datetime.datetime] = None) -> Optional[Session]:
+        now = now or now_utc()
+        i = bisect.bisect_right(self.starts, now) - 1
+        if i >= 0 and now < self.sessions[i][1]:
+            return self.sessions[i]
+        return None
+
+    # Ближайшая сессия, которая начнется после now, или None, если расписание кончилось
+    def next_session(self, now: Optional[datetime.datetime] = None) -> Optional[Session]:
+        now = now or now_utc()
+        i = bisect.bisect_right(self.starts, now)
+        return self.sessions[i] if i < len(self.sessions) else None
+
+    def is_open(self, now: Optional[datetime.datetime] = None) -> bool:
+        return self.current(now) is not None
+
+    # Пора ли перечитать расписание. Если биржа не вернула следующих сессий (или запрос упал),
+    # повторяем не чаще раза в retry секунд, а не на каждой итерации цикла
+    def is_stale(self, ttl: float = SCHEDULE_CACHE_TTL, retry: float = SCHEDULE_RETRY) -> bool:
+        if time.time() - self.checked < retry:
+            return False
+        return time.time() - self.updated >= ttl or self.next_session() is None
+
+    @classmethod
+    def load(cls, path: str = SCHEDULE_CACHE_FILE) -> 'TradingCalendar':
+        try:
+            with open(path, encoding='utf-8') as f:
+                data = json.load(f)
+            sessions = [(datetime.datetime.fromisoformat(start), datetime.datetime.fromisoformat(end)) for start, end in data['sessions']]
+            return cls(sessions, data['updated'], data['exchange'])
+        except (OSError, ValueError, KeyError, TypeError):
+            return cls()
+
+    def save(self, path: str = SCHEDULE_CACHE_FILE):
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({
+                'exchange': self.exchange,
+                'updated': self.updated,
+                'sessions': [(start.isoformat(), end.isoformat()) for start, end in self.sessions],
+            }, f)
+        os.replace(tmp_path, path)
+
+    # Сессии из ответа trading_schedules
+    def apply(self, response):
+        sessions = [s for schedule in response.exchanges for day in schedule.days for s in day_sessions(day)]
+        self.sessions = merge_sessions(sessions)
+        self.starts = [start for start, end in self.sessions]
+        self.updated = time.time()
+
+    # Расписание с биржи с сегодняшнего дня на days дней вперед
+    def update(self, session, days: int = SCHEDULE_DAYS):
+        self.checked = time.time()
+        from_, to = schedule_range(days)
+        self.apply(session.call('trading_schedules', lambda client: client.instruments.trading_schedules(exchange=self.exchange, from_=from_, to=to)))
+
+# Период запроса расписания: с начала сегодняшнего дня на days дней вперед
+def schedule_range(days: int = SCHEDULE_DAYS) -> Tuple[datetime.datetime, datetime.datetime]:
+    from_ = now_utc().replace(hour=0, minute=0, second=0, microsecond=0)
+    return from_, from_ + datetime.timedelta(days=days)
+
+# Расписание не обновилось: оставляем кэш, пока в нем есть сессии, иначе торгуем по часам по умолчанию.
+# Время попытки переносится, чтобы следующая была не раньше чем через SCHEDULE_RETRY
+def calendar_after_error(calendar: TradingCalendar, e: Exception) -> TradingCalendar:
+    if calendar.next_session() is not None or calendar.is_open():
+        print(f"Не удалось обновить расписание торгов, используем кэш: {e}")
+        return calendar
+    print(f"Не удалось получить расписание торгов, торгуем по часам по умолчанию: {e}")
+    fallback = TradingCalendar(fallback_sessions(), exchange=calendar.exchange)
+    fallback.checked = calendar.checked
+    return fallback
+
+# Загружаем расписание из кэша и перечитываем его с биржи, только если оно устарело
+def create_trading_calendar(session, path: str = SCHEDULE_CACHE_FILE, ttl: float = SCHEDULE_CACHE_TTL) -> TradingCalendar:
+
+    calendar = TradingCalendar.load(path)
+    if not calendar.is_stale(ttl):
+        return calendar
+
+    try:
+        calendar.update(session)
+    except Exception as e:
+        return calendar_after_error(calendar, e)
+
+    calendar.save(path)
+    return calendar
+
+# Спим до момента when без лишних пробуждений. Длинный сон режется на куски,
+# чтобы перевод системных часов или сон ноутбука не сдвинули пробуждение
+def sleep_until(when: datetime.datetime, max_chunk: float = 3600):
+    while True:
+        left = (when - now_utc()).total_seconds()
+        if left <= 0:
+            return
+        time.sleep(min(left, max_chunk))